@@ -0,0 +1,140 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Helpers shared by the benchmarks."""
+
+from Queue import Queue
+import serial
+import threading
+import time
+
+import firmata
+from firmata.constants import *
+from firmata.utils import encodeSequence
+from tests.fakeboard import PtyBoard, ThreadedPtyBoard
+from tests.test_io import MockSerial
+
+
+def Percentile(samples, p):
+  """Returns the p-th percentile (0-100) of a list of numbers, or None if it is empty."""
+  if not samples:
+    return None
+  ordered = sorted(samples)
+  index = int(round((len(ordered) - 1) * p / 100.0))
+  return ordered[index]
+
+
+def FormatLatencies(name, samples):
+  """Formats p50/p99/max of a list of latencies (in seconds) as a single line in milliseconds."""
+  return '%-10s n=%-6d p50=%8.3fms p99=%8.3fms max=%8.3fms' % (
+      name, len(samples), Percentile(samples, 50) * 1e3, Percentile(samples, 99) * 1e3, max(samples) * 1e3)
+
+
+def OfflineBoard(**options):
+  """Returns a Board on an in-memory mock serial port, with none of its threads started."""
+  real_serial = serial.Serial
+  serial.Serial = lambda *args, **kwargs: MockSerial()
+  try:
+    board = firmata.Board('', 57600, start_serial=False, **options)
+  finally:
+    serial.Serial = real_serial
+  board.atod_map = range(16)
+  return board
+
+
+def MegaCapabilities():
+  """Returns the pin_config of an Arduino Mega: 54 digital pins (2-13 with PWM) and 16 analog inputs."""
+  pins = []
+  for pin in xrange(70):
+    if pin < 2:
+      pins.append({})
+    elif pin < 54:
+      pins.append({MODE_INPUT: 1, MODE_OUTPUT: 1, MODE_PWM: 8} if pin <= 13 else {MODE_INPUT: 1, MODE_OUTPUT: 1})
+    else:
+      pins.append({MODE_INPUT: 1, MODE_OUTPUT: 1, MODE_ANALOG: 10})
+  return pins
+
+
+class SimulatedBoard(ThreadedPtyBoard):
+  """A PtyBoard that answers firmware, capability, analog mapping, pin state and I2C read queries like real firmware.
+
+  Each answer is sent `latency` seconds after its query arrives, standing in for USB and firmware turnaround. Queries
+  that arrive together are answered together, as they would be over a real link, except that I2C reads take `i2c_time`
+  seconds each on a bus that does one at a time. Every I2C register reads as its own number.
+  """
+  def __init__(self, pins=None, latency=0.002, firmware_name='Simulated', i2c_time=0.0005):
+    self.pins = pins if pins is not None else MegaCapabilities()
+    self.latency = latency
+    self.firmware_name = firmware_name
+    self.i2c_time = i2c_time
+    self._i2c_free = 0  # When the simulated I2C bus finishes its last transaction.
+    self._due = 0  # When the queries taken by the current Read are answered.
+    self._answers = Queue()  # (time due, bytes) pairs, in order.
+    self._sender = threading.Thread(target=self._SendAnswers)
+    self._sender.daemon = True
+    self._sender.start()
+    ThreadedPtyBoard.__init__(self)
+
+  def _SendAnswers(self):
+    while True:
+      answer = self._answers.get()
+      if answer is None:
+        return
+      due, data = answer
+      delay = due - time.time()
+      if delay > 0:
+        time.sleep(delay)
+      self.Send(data)
+
+  def Read(self):
+    self._due = time.time() + self.latency
+    ThreadedPtyBoard.Read(self)
+
+  def _Query(self, command, body):
+    if command == SE_I2C_REQUEST:
+      self._i2c_free = max(self._i2c_free, self._due) + self.i2c_time
+      self._due = self._i2c_free
+    self._answers.put((self._due, self.Answer(command, body)))
+
+  def Answer(self, command, body):
+    if command == SE_REPORT_FIRMWARE:
+      return [PROTOCOL_VERSION, 2, 3, SYSEX_START, SE_REPORT_FIRMWARE, 2, 3] + encodeSequence(
+          [ord(c) for c in self.firmware_name]) + [SYSEX_END]
+    if command == SE_CAPABILITY_QUERY:
+      answer = [SYSEX_START, SE_CAPABILITY_RESPONSE]
+      for modes in self.pins:
+        for mode, resolution in sorted(modes.items()):
+          answer += [mode, resolution]
+        answer.append(0x7f)
+      return answer + [SYSEX_END]
+    if command == SE_ANALOG_MAPPING_QUERY:
+      channels = []
+      for modes in self.pins:
+        channels.append(sum(1 for c in channels if c != 0x7f) if MODE_ANALOG in modes else 0x7f)
+      return [SYSEX_START, SE_ANALOG_MAPPING_RESPONSE] + channels + [SYSEX_END]
+    if command == SE_PIN_STATE_QUERY:
+      pin = body[0]
+      mode = MODE_ANALOG if MODE_ANALOG in self.pins[pin] else MODE_OUTPUT
+      return [SYSEX_START, SE_PIN_STATE_RESPONSE, pin, mode, 0, SYSEX_END]
+    if command == SE_I2C_REQUEST and body[1] & I2C_READ:
+      addr = body[0]
+      reg, count = (body[2] + (body[3] << 7), body[4] + (body[5] << 7)) if len(body) == 6 else (0, body[2])
+      return [SYSEX_START, SE_I2C_REPLY, addr, 0] + encodeSequence([reg] + [reg & 0xff] * count) + [SYSEX_END]
+    return []
+
+  def Close(self):
+    self._closing = True
+    self.join()
+    self._answers.put(None)
+    self._sender.join()
+    PtyBoard.Close(self)
@@ -0,0 +1,98 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares threaded Boards with a BoardHub as the number of simulated boards grows.
+
+N fake boards on pseudo-terminals each send a stream of ANALOG_MESSAGEs; the benchmark measures how long it takes for
+all of them to be dispatched, the latency of each message, and how many threads the process is running meanwhile. Run
+with `python -m benchmarks.hub_scaling [BOARDS...]`.
+"""
+
+import sys
+import threading
+import time
+
+import firmata
+from firmata import hub
+from firmata.constants import *
+from benchmarks.fakeboard import FormatLatencies
+from tests.fakeboard import PtyBoard
+
+
+MESSAGES_PER_BOARD = 500
+BOARD_COUNTS = (1, 8, 32, 64)
+
+
+def Measure(kind, count, messages=MESSAGES_PER_BOARD, workers=0):
+  """Returns (seconds, threads, latencies) for `count` boards of the given kind ('threaded' or 'hub')."""
+  fakes = [PtyBoard() for _ in xrange(count)]
+  board_hub = None
+  if kind == 'hub':
+    board_hub = hub.BoardHub(workers=workers)
+    board_hub.start()
+    boards = [board_hub.AddBoard(fake.path, 57600, start_serial=False) for fake in fakes]
+  else:
+    boards = [firmata.Board(fake.path, 57600, start_serial=False) for fake in fakes]
+  remaining = [count * messages]
+  lock = threading.Lock()
+  done = threading.Event()
+  sent = {}
+  latencies = []
+  def Listener(token):
+    now = time.time()
+    with lock:
+      latencies.append(now - sent[token['value']])
+      remaining[0] -= 1
+      if not remaining[0]:
+        done.set()
+    return (False, False)
+  for board in boards:
+    board.atod_map = range(16)
+    board.AddListener('ANALOG_MESSAGE', Listener)
+    if kind == 'hub':
+      board.firmware_name = 'Fake'  # Nothing to wait for.
+      board.StartCommunications()
+    else:
+      board.port.StartCommunications()
+      board.start()
+  time.sleep(0.1)  # Give the threaded readers a chance to flush their input before we start sending.
+  threads = threading.active_count()
+  start = time.time()
+  for i in xrange(messages):
+    sent[i] = time.time()
+    for fake in fakes:
+      fake.Send([ANALOG_MESSAGE_0, i & 0x7f, i >> 7])
+  done.wait(30)
+  elapsed = time.time() - start
+  if board_hub:
+    board_hub.Shutdown()
+  else:
+    for board in boards:
+      board.StopCommunications()
+  for fake in fakes:
+    fake.Close()
+  return elapsed, threads, latencies
+
+
+def main(argv):
+  counts = [int(arg) for arg in argv[1:]] or BOARD_COUNTS
+  for count in counts:
+    for kind, workers in (('threaded', 0), ('hub', 0), ('hub', 4)):
+      elapsed, threads, latencies = Measure(kind, count, workers=workers)
+      name = kind if kind == 'threaded' else 'hub/%d' % workers
+      print('boards=%-3d %-9s threads=%-4d %8.0f msgs/s  %s' % (
+          count, name, threads, len(latencies) / elapsed, FormatLatencies('', latencies)))
+
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -0,0 +1,63 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures the aggregate I2C read rate from several sensors on one simulated bus.
+
+Blocking reads pay the host round trip for every read; reads with up to WINDOW requests in flight overlap it, leaving
+the bus time as the limit. Run with `python -m benchmarks.i2c_throughput [LATENCY_MS]`.
+"""
+
+import sys
+import time
+
+import firmata
+from benchmarks.fakeboard import SimulatedBoard
+
+
+DEVICES = (0x10, 0x11, 0x12, 0x13)
+READS = 400
+WINDOW = 16
+
+
+def Measure(window, latency, reads=READS):
+  """Returns reads per second, round-robin across DEVICES, with up to `window` reads in flight."""
+  fake = SimulatedBoard(latency=latency)
+  board = firmata.Board(fake.path, 57600, start_serial=False)
+  board.StartCommunications(query_version=True)
+  device = board.I2CConfig(0)
+  start = time.time()
+  in_flight = []
+  for i in xrange(reads):
+    addr = DEVICES[i % len(DEVICES)]
+    if window == 1:
+      assert device.I2CRead(addr, i % 100, 2) == [i % 100] * 2
+      continue
+    if len(in_flight) == window:
+      assert in_flight.pop(0).result() is not None
+    in_flight.append(device.I2CReadAsync(addr, i % 100, 2))
+  for request in in_flight:
+    assert request.result() is not None
+  elapsed = time.time() - start
+  board.StopCommunications()
+  fake.Close()
+  return reads / elapsed
+
+
+def main(argv):
+  latency = float(argv[1]) / 1e3 if len(argv) > 1 else 0.002
+  for name, window in (('blocking', 1), ('pipelined', WINDOW)):
+    print('%-10s latency=%.1fms  %8.0f reads/s' % (name, latency * 1e3, Measure(window, latency)))
+
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -0,0 +1,69 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures the latency from a byte arriving on the serial port to its token being dispatched by the Board.
+
+A fake board on a pseudo-terminal sends ANALOG_MESSAGEs at random intervals; a listener records how long each one
+took to reach `Board.DispatchToken`. Run with `python -m benchmarks.reader_latency`.
+"""
+
+import random
+import sys
+import threading
+import time
+
+import firmata
+from firmata import io
+from firmata.constants import *
+from benchmarks.fakeboard import FormatLatencies
+from tests.fakeboard import PtyBoard
+
+
+SAMPLES = 200
+MEAN_INTERVAL = 0.01
+
+
+def Measure(mode, samples=SAMPLES, mean_interval=MEAN_INTERVAL):
+  """Returns a list of byte-in to token-dispatched latencies, in seconds, using the given reader mode."""
+  fake = PtyBoard()
+  board = firmata.Board(fake.path, 57600, start_serial=False, reader_mode=mode)
+  board.atod_map = range(16)
+  sent = {}
+  latencies = []
+  done = threading.Event()
+  def Listener(token):
+    latencies.append(time.time() - sent[token['value']])
+    if len(latencies) == samples:
+      done.set()
+    return (False, False)
+  board.AddListener('ANALOG_MESSAGE', Listener)
+  board.port.StartCommunications()
+  board.start()
+  time.sleep(0.1)  # Give the reader a chance to flush its input before we start sending.
+  for i in xrange(samples):
+    time.sleep(random.uniform(0, 2 * mean_interval))
+    sent[i] = time.time()
+    fake.Send([ANALOG_MESSAGE_0, i & 0x7f, i >> 7])
+  done.wait(samples * io.READER_TIMEOUT)
+  board.StopCommunications()
+  fake.Close()
+  return latencies
+
+
+def main(argv):
+  for mode in (io.READER_SLEEP, io.READER_SELECT, io.READER_BLOCKING):
+    print(FormatLatencies(mode, Measure(mode)))
+
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -0,0 +1,75 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures how many bytes per second SerialReader can lex.
+
+Replays the byte streams from tests/test_io.py through a SerialReader on an in-memory port and reports throughput.
+Run with `python -m benchmarks.reader_throughput`.
+"""
+
+import sys
+import time
+
+from firmata import io
+from tests.test_io import ARDUINO_ANALOG_MAPPING, ARDUINO_BOARD_STATE, ARDUINO_CAPABILITY, FIRMATA_INIT, MONDO_DATA
+
+
+REPEAT = 20000
+
+
+class MemorySerial(object):
+  """An in-memory port which stops the reader once it has been drained."""
+  def __init__(self, data):
+    self._data = data
+    self._pos = 0
+
+  def inWaiting(self):
+    available = len(self._data) - self._pos
+    if not available:
+      raise io.ShutdownException()
+    return available
+
+  def read(self, num=1):
+    ret = self._data[self._pos:self._pos + num]
+    self._pos += num
+    return ret
+
+  def flushInput(self):
+    pass
+
+
+def Measure(stream, lexer, repeat=REPEAT):
+  """Lexes `stream` (a list of characters) `repeat` times. Returns (bytes per second, tokens emitted)."""
+  data = ''.join(stream) * repeat
+  reader = io.SerialReader(MemorySerial(data), None, mode=io.READER_SLEEP, lexer=lexer)
+  start = time.time()
+  reader.run()
+  elapsed = time.time() - start
+  return len(data) / elapsed, reader.q.qsize()
+
+
+def main(argv):
+  streams = [
+      ('MONDO_DATA', MONDO_DATA),
+      ('FIRMATA_INIT', FIRMATA_INIT),
+      ('BOARD_STATE', ARDUINO_BOARD_STATE),
+      ('CAPABILITY', ARDUINO_CAPABILITY + ARDUINO_ANALOG_MAPPING),
+  ]
+  for lexer in (io.LEXER_PIKE, io.LEXER_TABLE):
+    for name, stream in streams:
+      rate, tokens = Measure(stream, lexer)
+      print('%-6s %-14s %10.0f bytes/s  (%d tokens)' % (lexer, name, rate, tokens))
+
+
+if __name__ == '__main__':
+  main(sys.argv)
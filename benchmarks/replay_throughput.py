@@ -0,0 +1,58 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures throughput of the whole receive path by replaying a session through firmata.replay.
+
+With no arguments a synthetic session is used: the board handshake followed by SAMPLES rounds of reports from 6
+analog channels and 3 digital ports. A capture file (see firmata.capture) or a plain file of received bytes can be
+given instead. Run with `python -m benchmarks.replay_throughput [FILE]`.
+"""
+
+import sys
+
+from firmata import io
+from firmata import replay
+from firmata.capture import MAGIC
+from firmata.constants import *
+from tests.test_io import ARDUINO_ANALOG_MAPPING, ARDUINO_CAPABILITY, FIRMATA_INIT
+
+
+SAMPLES = 20000
+
+
+def SyntheticSession(samples=SAMPLES):
+  data = bytearray(''.join(FIRMATA_INIT + ARDUINO_CAPABILITY + ARDUINO_ANALOG_MAPPING))
+  for i in xrange(samples):
+    for channel in xrange(6):
+      data.extend([ANALOG_MESSAGE + channel, i & 0x7f, (i >> 7) & 0x7f])
+    for port in xrange(3):
+      data.extend([DIGITAL_MESSAGE + port, i & 0x7f, 0])
+  return [(0, bytes(data))]
+
+
+def Load(path):
+  with open(path, 'rb') as f:
+    is_capture = f.read(len(MAGIC)) == MAGIC
+  return replay.LoadCapture(path) if is_capture else replay.LoadBytes(path)
+
+
+def main(argv):
+  chunks = Load(argv[1]) if len(argv) > 1 else SyntheticSession()
+  for lexer in (io.LEXER_PIKE, io.LEXER_TABLE):
+    _, stats = replay.Replay(replay.ReplaySerial(chunks), lexer=lexer)
+    print('%-6s %8d bytes %8d tokens %6.2fs %10.0f bytes/s %10.0f tokens/s' % (
+        lexer, stats.bytes_read, stats.tokens, stats.seconds, stats.bytes_per_second, stats.tokens_per_second))
+
+
+if __name__ == '__main__':
+  main(sys.argv)
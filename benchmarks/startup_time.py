@@ -0,0 +1,67 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures how long board discovery takes against a simulated 70 pin Arduino Mega.
+
+The fake board answers each query after a fixed turnaround, so sequential discovery pays it once per pin while
+pipelined discovery pays it about twice, and discovery from a warm capability cache once.
+
+Run with `python -m benchmarks.startup_time [LATENCY_MS]`.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import firmata
+from firmata.cache import CapabilityCache
+from benchmarks.fakeboard import SimulatedBoard
+
+
+RUNS = 5
+
+
+def Measure(pipelined, latency, runs=RUNS, cache=None):
+  """Returns a list of seconds taken by QueryBoardCapabilitiesAndState, one per run."""
+  durations = []
+  for _ in xrange(runs):
+    fake = SimulatedBoard(latency=latency)
+    board = firmata.Board(fake.path, 57600, start_serial=False)
+    board.device_id = 'mega'  # Each run gets a fresh pty, but it stands for the same board.
+    board.capability_cache = cache
+    board.StartCommunications(query_version=True)
+    start = time.time()
+    board.QueryBoardCapabilitiesAndState(pipelined=pipelined)
+    durations.append(time.time() - start)
+    assert len(board.pin_config) == 70
+    board.StopCommunications()
+    fake.Close()
+  return durations
+
+
+def main(argv):
+  latency = float(argv[1]) / 1e3 if len(argv) > 1 else 0.002
+  cache_dir = tempfile.mkdtemp()
+  cache = CapabilityCache(os.path.join(cache_dir, 'cache.json'))
+  Measure(True, latency, runs=1, cache=cache)  # Warms the cache.
+  for name, pipelined, run_cache in (('sequential', False, None), ('pipelined', True, None), ('cached', True, cache)):
+    durations = Measure(pipelined, latency, cache=run_cache)
+    print('%-10s latency=%.1fms  min=%7.1fms  mean=%7.1fms' % (
+        name, latency * 1e3, min(durations) * 1e3, sum(durations) / len(durations) * 1e3))
+  shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -0,0 +1,86 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares the memory and allocation cost of dict tokens with `firmata.tokens` objects.
+
+Run with `python -m benchmarks.token_allocation`.
+"""
+
+import gc
+import sys
+import time
+
+from firmata import tokens
+from benchmarks.fakeboard import OfflineBoard
+
+
+COUNT = 200000
+
+
+def DictAnalog(i):
+  return dict(token='ANALOG_MESSAGE', pin=i & 0xf, value=i & 0x3fff)
+
+
+def DictDigital(i):
+  bitmask = i & 0xff
+  token = dict(token='DIGITAL_MESSAGE', port=i & 0xf, pins=[])
+  for pin_num in xrange(8):
+    token['pins'].append((bitmask % 2) == 1)
+    bitmask = bitmask >> 1
+  return token
+
+
+def SlotsAnalog(i):
+  return tokens.AnalogMessage(i & 0xf, i & 0x3fff)
+
+
+def SlotsDigital(i):
+  return tokens.DigitalMessage(i & 0xf, i & 0xff)
+
+
+def Allocations(make, count=COUNT):
+  """Returns (gc tracked allocations, bytes, microseconds) per token for `count` live tokens made by `make`."""
+  gc.collect()
+  gc.disable()
+  try:
+    before = gc.get_count()[0]
+    start = time.time()
+    live = [make(i) for i in xrange(count)]
+    elapsed = time.time() - start
+    allocations = gc.get_count()[0] - before - 1  # Don't count `live` itself.
+  finally:
+    gc.enable()
+  size = sum(sys.getsizeof(t) + (sys.getsizeof(t['pins']) if isinstance(t, dict) and 'pins' in t else 0)
+             for t in live)
+  return float(allocations) / count, float(size) / count, elapsed * 1e6 / count
+
+
+def DispatchRate(token_list):
+  """Returns tokens dispatched per second by a Board with no listeners."""
+  board = OfflineBoard()
+  start = time.time()
+  for token in token_list:
+    board.DispatchToken(token)
+  return len(token_list) / (time.time() - start)
+
+
+def main(argv):
+  for name, make in (('dict analog', DictAnalog), ('slots analog', SlotsAnalog),
+                     ('dict digital', DictDigital), ('slots digital', SlotsDigital)):
+    allocations, size, micros = Allocations(make)
+    print('%-14s %4.1f allocations/token %5.0f bytes/token %5.2f us/token' % (name, allocations, size, micros))
+  print('dispatch       %8.0f tokens/s' % DispatchRate([SlotsAnalog(i) for i in xrange(COUNT)]))
+
+
+if __name__ == '__main__':
+  main(sys.argv)
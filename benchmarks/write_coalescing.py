@@ -0,0 +1,75 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures command-to-wire latency when a control loop writes a pin faster than the serial link can carry.
+
+A producer calls SerialWriter.Put at RATE Hz for DURATION seconds against a port that takes as long to write as a
+real BAUD link would. Run with `python -m benchmarks.write_coalescing`.
+"""
+
+import sys
+import time
+
+from firmata import io
+from firmata.constants import *
+from benchmarks.fakeboard import FormatLatencies
+
+
+BAUD = 9600
+RATE = 1000
+DURATION = 2.0
+
+
+class SlowSerial(object):
+  """A port whose write() blocks for as long as sending the bytes at `baud` would take."""
+  def __init__(self, baud):
+    self._baud = baud
+    self.writes = []
+
+  def write(self, data):
+    time.sleep(len(data) * 10.0 / self._baud)
+    self.writes.append((time.time(), bytearray(data)))
+
+  def flushOutput(self):
+    pass
+
+
+def Measure(coalesce, baud=BAUD, rate=RATE, duration=DURATION):
+  """Returns the put-to-written latency of every pin write that reached the port."""
+  port = SlowSerial(baud)
+  writer = io.SerialWriter(port, None, coalesce=coalesce)
+  writer.start()
+  sent = {}
+  seq = 0
+  end = time.time() + duration
+  while time.time() < end:
+    sent[seq] = time.time()
+    writer.Put([ANALOG_MESSAGE + 3, seq & 0x7f, seq >> 7])
+    seq += 1
+    time.sleep(1.0 / rate)
+  writer.Put(None)
+  writer.join()
+  latencies = []
+  for written, data in port.writes:
+    for i in xrange(0, len(data), 3):
+      latencies.append(written - sent[data[i + 1] + (data[i + 2] << 7)])
+  return latencies
+
+
+def main(argv):
+  for coalesce in (False, True):
+    print(FormatLatencies('coalesce' if coalesce else 'queue', Measure(coalesce)))
+
+
+if __name__ == '__main__':
+  main(sys.argv)
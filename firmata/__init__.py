@@ -20,9 +20,14 @@ then used by the main body of code to respond to API calls made by the host appl
 The API presented to the host program is encapsulated in the `Board` class, instances of which are obtained by calling
 the previously mentioned `FirmataInit()` function. You can create as many Board classes as you wish, but you will not
 go to space today if you create more than on on the same serial port.
+
+Board state and the API live in `BaseBoard`; `Board` drives it with threads, `firmata.aio.AsyncBoard` drives it from
+an asyncio event loop, and `firmata.hub.HubBoard` shares one IO thread with every other board on a `BoardHub`.
 """
 
+from array import array
 import collections
+import heapq
 import logging
 from Queue import Queue, Empty
 import sys
@@ -30,16 +35,233 @@ import threading
 import time
 
 from firmata.constants import *
+from firmata.history import HISTORY_CAPACITY, PinHistory
 from firmata.io import SerialPort
+from firmata.metrics import Histogram
+from firmata.profiling import PROFILE_SAMPLE_EVERY, STAGE_DISPATCH, STAGE_HANDLER, STAGE_HANDOFF
+from firmata.scheduler import ReportingBudgetError, ReportingScheduler
+from firmata.stream import DROP_OLDEST, STREAM_CAPACITY, STREAM_KINDS, SampleStream
+from firmata import tokens
 from firmata.utils import *
 
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+# Startup deadlines, in seconds.
+RESET_TIMEOUT = 2.5  # How long a board that resets when the port is opened may take to start sending.
+FIRMWARE_TIMEOUT = 5  # How long to keep probing for the firmware report after that.
+PROBE_INTERVAL = 0.1  # How long to wait for an answer to the first probe. Doubles after each unanswered probe,
+MAX_PROBE_INTERVAL = 1  # up to this.
+DISCOVERY_TIMEOUT = 10  # How long QueryBoardCapabilitiesAndState waits for all of its responses.
+
+# The number of samples an I2CStream keeps by default.
+I2C_STREAM_CAPACITY = 1024
+
+# Edges for AddEdgeListener.
+RISING = 1
+FALLING = 2
+BOTH_EDGES = RISING | FALLING
+
+# Threads a Board can dispatch tokens on.
+DISPATCH_THREAD = 'thread'  # The Board's own thread, which takes them off the reader's queue.
+DISPATCH_INLINE = 'inline'  # The reader thread, as soon as each is lexed.
+DISPATCH_BATCHED = 'batched'  # The reader thread, once it has lexed everything from a read.
+DISPATCH_MODES = (DISPATCH_THREAD, DISPATCH_INLINE, DISPATCH_BATCHED)
+
+# Pin numbers are 7 bits in the protocol, so no board has more pins than this.
+MAX_PINS = 128
+
+# The positions of the bits set in each byte, so DIGITAL_MESSAGE handling only visits the pins that changed.
+_SET_BITS = [tuple(i for i in xrange(8) if n >> i & 1) for n in xrange(256)]
+
 
 class I2CNotEnabled(Exception): pass
+class HandshakeError(Exception): pass
+
+
+def I2CReadRequest(addr, reg, count, mode=I2C_READ):
+  """Returns the body of an SE_I2C_REQUEST sysex asking device `addr` for `count` bytes from register `reg`.
+
+  mode is I2C_READ for a single read, or I2C_READ_CONTINUOUSLY for the board to keep reading and replying.
+  """
+  assert addr < 0x80
+  message = [addr, mode]
+  if reg is not None:
+    message += encodeSequence([reg])
+  message += encodeSequence([count])
+  return message
+
+
+class I2CRequest(object):
+  """The eventual result of an I2C read: the list of bytes read, or None if no reply arrived before the timeout.
+
+  A minimal future. result() waits for it, and add_done_callback() arranges for a callable to be called with the
+  request once it is resolved, on the thread that resolves it (the board's dispatch thread, or the I2C timeout thread).
+  """
+  def __init__(self, addr, reg, count, deadline):
+    self.addr = addr
+    self.reg = reg
+    self.count = count
+    self.deadline = deadline
+    self.data = None
+    self._done = threading.Event()
+    self._lock = threading.Lock()
+    self._callbacks = []
+
+  def done(self):
+    return self._done.is_set()
+
+  def result(self, timeout=None):
+    """Waits for the request to be resolved, then returns the bytes read, or None if the read timed out.
+
+    Args:
+      timeout: A number. The most seconds to wait. The default, None, waits until the request's own timeout.
+    """
+    self._done.wait(timeout)
+    return self.data
+
+  def add_done_callback(self, callback):
+    """Calls callback with this request once it is resolved, or right away if it already has been."""
+    with self._lock:
+      if not self._done.is_set():
+        self._callbacks.append(callback)
+        return
+    callback(self)
+
+  def _Resolve(self, data):
+    with self._lock:
+      if self._done.is_set():
+        return
+      self.data = data
+      self._done.set()
+      callbacks, self._callbacks = self._callbacks, None
+    for callback in callbacks:
+      callback(self)
+
+
+class _I2CTimeouts(object):
+  """Resolves I2C requests with None once their deadline passes, from a thread that runs while any are unresolved."""
+  def __init__(self, expire):
+    self._expire = expire
+    self._heap = []  # (deadline, sequence number, request)
+    self._sequence = 0
+    self._condition = threading.Condition()
+    self._thread = None
+
+  def Add(self, request):
+    with self._condition:
+      self._sequence += 1
+      heapq.heappush(self._heap, (request.deadline, self._sequence, request))
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._Run)
+        self._thread.daemon = True
+        self._thread.start()
+      elif self._heap[0][2] is request:
+        self._condition.notify()
+
+  def Resolved(self):
+    """Wakes the thread to drop requests that have been resolved, so that it can exit once none are left."""
+    with self._condition:
+      self._condition.notify()
+
+  def _Run(self):
+    while True:
+      with self._condition:
+        while self._heap and (self._heap[0][2].done() or self._heap[0][0] > time.time()):
+          if self._heap[0][2].done():
+            heapq.heappop(self._heap)
+          else:
+            self._condition.wait(self._heap[0][0] - time.time())
+        if not self._heap:
+          self._thread = None
+          return
+        _, _, request = heapq.heappop(self._heap)
+      self._expire(request)
+
+
+class I2CStream(object):
+  """The replies to a continuous I2C read, each kept as a (timestamp, data) pair in a bounded ring buffer.
+
+  Samples are timestamped with time.time() when they are dispatched. Once `capacity` samples are buffered, each new one
+  replaces the oldest. Samples can be taken from the buffer with Latest() and Samples(), consumed in order by
+  iterating over the stream, or delivered to callbacks added with AddCallback(), which run on the board's dispatch
+  thread.
+  """
+  def __init__(self, device, addr, reg, count, capacity=I2C_STREAM_CAPACITY):
+    self.addr = addr
+    self.reg = reg
+    self.count = count
+    self.active = True
+    self.received = 0  # Samples received since the stream started.
+    self._device = device
+    self._samples = collections.deque(maxlen=capacity)
+    self._condition = threading.Condition()
+    self._callbacks = ()  # Replaced, never mutated, so _Add can read it unlocked.
+
+  def _Add(self, data):
+    sample = (time.time(), data)
+    with self._condition:
+      self._samples.append(sample)
+      self.received += 1
+      self._condition.notify_all()
+    for callback in self._callbacks:
+      callback(*sample)
+
+  def AddCallback(self, callback):
+    """Calls callback(timestamp, data) with each sample received from now on."""
+    with self._condition:
+      self._callbacks += (callback,)
+
+  def Latest(self):
+    """Returns the most recent (timestamp, data) sample, or None if none has arrived."""
+    with self._condition:
+      return self._samples[-1] if self._samples else None
+
+  def Samples(self, count=None):
+    """Returns a list of the last `count` buffered (timestamp, data) samples (all of them by default), oldest first."""
+    with self._condition:
+      samples = list(self._samples)
+    return samples if count is None else samples[-count:]
+
+  def __iter__(self):
+    """Yields each (timestamp, data) sample, starting with the oldest buffered one, until the stream is stopped.
+
+    Blocks waiting for new samples. A consumer that falls more than `capacity` samples behind skips the ones that were
+    overwritten.
+    """
+    with self._condition:
+      position = self.received - len(self._samples)
+    while True:
+      with self._condition:
+        while position >= self.received and self.active:
+          self._condition.wait()
+        if position >= self.received:
+          return
+        first = self.received - len(self._samples)
+        position = max(position, first)
+        sample = self._samples[position - first]
+      position += 1
+      yield sample
+
+  def Stop(self):
+    """Stops the continuous read. See I2CDevice.StopContinuousRead."""
+    self._device.StopContinuousRead(self.addr)
+
+  def _Stopped(self):
+    with self._condition:
+      self.active = False
+      self._condition.notify_all()
 
 
 class I2CDevice(object):
   """Encapsulates I2C functionality.
 
+  Any number of reads may be in flight at once. Each read is matched to its reply by address and register, in the order
+  the reads were sent.
+
   A typical I2C conversation
   Config:
   >> 0xf0 (SYSEX_START)
@@ -75,18 +297,47 @@ class I2CDevice(object):
   """
   def __init__(self, board):
     """Construct an I2CDevice and add a listener."""
-    self.replies = dict()
-    self.update_event = threading.Event()
-    self._shutdown = False
+    self.replies = dict()  # The latest reply from each address that has been read from or written to.
     self._board = board
-    def I2CListener(token):
-      addr = token['addr']
-      if addr not in self.replies:
+    self._lock = threading.Lock()  # Guards replies and _pending.
+    self._pending = {}  # (addr, reg) -> deque of I2CRequests waiting for a reply, oldest first.
+    self._streams = {}  # (addr, reg) -> the I2CStream of a continuous read.
+    self._timeouts = _I2CTimeouts(self._Expire)
+    self._board.AddListener('I2C_REPLY', self._I2CListener)
+
+  def _I2CListener(self, token):
+    addr = token.addr
+    with self._lock:
+      request = self._PopPending(addr, token.reg) or self._PopPending(addr, None)
+      stream = self._streams.get((addr, token.reg)) if self._streams else None
+      if request is None and stream is None and addr not in self.replies:
         self._board.logger.warning('I2C: Unexpected message from address %s.' % addr)
       self.replies[addr] = token
-      self.update_event.set()
-      return (False, True)
-    self._board.AddListener('I2C_REPLY', I2CListener)
+    if stream is not None:
+      stream._Add(token.data)
+    if request is not None:
+      request._Resolve(token.data)
+      self._timeouts.Resolved()
+    return (False, True)
+
+  def _PopPending(self, addr, reg):
+    """Removes and returns the oldest request waiting for a reply from (addr, reg), or None. Must hold _lock."""
+    requests = self._pending.get((addr, reg))
+    if not requests:
+      return None
+    request = requests.popleft()
+    if not requests:
+      del self._pending[(addr, reg)]
+    return request
+
+  def _Expire(self, request):
+    with self._lock:
+      requests = self._pending.get((request.addr, request.reg))
+      if requests and request in requests:
+        requests.remove(request)
+        if not requests:
+          del self._pending[(request.addr, request.reg)]
+    request._Resolve(None)
 
   def I2CWrite(self, addr, reg, data):
     """Send an I2C write command.
@@ -101,113 +352,157 @@ class I2CDevice(object):
     if reg is not None:
       message += encodeSequence([reg])
     message += encodeSequence(data)
-    self.replies.setdefault(addr, None)
+    with self._lock:
+      self.replies.setdefault(addr, None)
     self._board.SendSysex(SE_I2C_REQUEST, message)
 
+  def I2CReadAsync(self, addr, reg, count, timeout=1):
+    """Send an I2C read command without waiting for the reply.
+
+    Args:
+      addr: A byte. An I2C address. Must be less than 0x80.
+      reg: A byte. The I2C register to read from. Set to None to exclude it.
+      count: A number. The number of bytes of to read from the I2C bus.
+      timeout: A number. The number of seconds to wait to receieve the reply before giving up.
+
+    Returns:
+      An I2CRequest, resolved with the list of bytes read, or with None if no reply arrived before the timeout.
+    """
+    request = I2CRequest(addr, reg, count, time.time() + timeout)
+    with self._lock:
+      self._pending.setdefault((addr, reg), collections.deque()).append(request)
+      self.replies.setdefault(addr, None)
+    self._timeouts.Add(request)
+    self._board.SendSysex(SE_I2C_REQUEST, I2CReadRequest(addr, reg, count))
+    return request
+
+  def StartContinuousRead(self, addr, reg, count, capacity=I2C_STREAM_CAPACITY, callback=None):
+    """Asks the board to read from a device repeatedly, replying after each read without being asked again.
+
+    The board reads once per sampling interval (see BaseBoard.SetSamplingInterval).
+
+    Args:
+      addr: A byte. An I2C address. Must be less than 0x80.
+      reg: A byte. The I2C register to read from. The board reports it in each reply, so it must be given.
+      count: A number. The number of bytes to read each time.
+      capacity: An integer. The number of samples the stream buffers.
+      callback: A callable, passed to the stream's AddCallback, or None.
+
+    Returns:
+      An I2CStream receiving the replies.
+    """
+    stream = I2CStream(self, addr, reg, count, capacity)
+    if callback is not None:
+      stream.AddCallback(callback)
+    with self._lock:
+      old = self._streams.get((addr, reg))
+      self._streams[(addr, reg)] = stream
+      self.replies.setdefault(addr, None)
+    if old is not None:
+      old._Stopped()
+    self._board.SendSysex(SE_I2C_REQUEST, I2CReadRequest(addr, reg, count, mode=I2C_READ_CONTINUOUSLY))
+    return stream
+
+  def StopContinuousRead(self, addr):
+    """Stops every continuous read from a device. The board does not track them by register.
+
+    Args:
+      addr: A byte. The I2C address passed to StartContinuousRead.
+    """
+    with self._lock:
+      stopped = [key for key in self._streams if key[0] == addr]
+      streams = [self._streams.pop(key) for key in stopped]
+    self._board.SendSysex(SE_I2C_REQUEST, [addr, I2C_STOP_READING])
+    for stream in streams:
+      stream._Stopped()
+
   def I2CRead(self, addr, reg, count, timeout=1):
-    """Send an I2C read command.
+    """Send an I2C read command and wait for the reply.
 
     Args:
       addr: A byte. An I2C address. Must be less than 0x80.
-      reg: A byte. The I2C register to which to write. Set to None to exclude it.
+      reg: A byte. The I2C register to read from. Set to None to exclude it.
       count: A number. The number of bytes of to read from the I2C bus.
       timeout: A number. The number of seconds to wait to receieve I2C traffic before giving up.
 
     Returns:
-      A list of tokens received from the device before the timeout.
+      The list of bytes read, or None if no reply arrived before the timeout.
     """
-    assert addr < 0x80
-    message = [addr, I2C_READ]
-    if reg is not None:
-      message += encodeSequence([reg])
-    message += encodeSequence([count])
-    self.replies[addr] = None
-    self._board.SendSysex(SE_I2C_REQUEST, message)
-    receieved = []
-    end_t = time.time() + timeout
-    while True:
-      self.update_event.clear()
-      token = self.replies[addr]
-      if token:
-        assert token['addr'] == addr
-        assert token['reg'] == reg
-        return token['data']
-      remaining = end_t - time.time()
-      if remaining <= 0:
-        return None
-      self.update_event.wait(timeout=remaining)
+    return self.I2CReadAsync(addr, reg, count, timeout).result()
 
 
-class Board(threading.Thread):
-  def __init__(self, port, baud, log_to_file=None, start_serial=False, query_version=False):
-    """Board object constructor. Should not be called directly.
+class BaseBoard(object):
+  """Board state and the Firmata API, independent of how bytes get to and from the board.
+
+  Subclasses set `port` to an object whose Put(commands) method sends commands to the board, and pass every token
+  received from the board to DispatchToken.
+  """
+  def __init__(self, port):
+    """Constructs a BaseBoard.
 
     Args:
-      port: The serial port to use. Expressed as either a string or an integer (see pyserial docs for more info.)
-      baud: A number representing the baud rate to use for serial communication.
-      log_to_file: A string specifying the file to log serial events to, or None (the default) for no logging.
-      start_serial: If True, starts the serial IO thread right away. Default: False.
-      query_version: A boolean. If set, commands requesting firmware version are sent instead of depending on the board
-                     to reset on USB connect.
+      port: An object with a Put(commands) method, where commands is a list of bytes to send to the board.
     """
     logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
     self.logger = logging.getLogger()
-    self.port = SerialPort(port=port, baud=baud, log_to_file=log_to_file, start_serial=start_serial)
-    self.shutdown = False
+    self.port = port
     self.firmware_version = 'Unknown'
     self.firmware_name = 'Unknown'
     self.errors = []
     self.dtoa_map = []
     self.atod_map = []
     self.pin_config = []
-    self._listeners = collections.defaultdict(list)
-    self._listeners_lock = threading.Lock()
-    self.pin_state = collections.defaultdict(lambda: 0) #pins all default to output low
+    self.device_id = None  # Identifies the physical board in capability_cache, e.g. by its port name.
+    self.capability_cache = None  # A firmata.cache.CapabilityCache, or None to always query the board.
+    self._revalidating = None  # (cache key, channels) of a cache entry being checked against the board.
+    self._listeners = collections.defaultdict(tuple)  # Replaced, never mutated, so dispatch can read it unlocked.
+    self._listeners_lock = threading.Lock()  # Serializes changes to _listeners.
+    self.pin_state = array('l', [0]) * MAX_PINS  # pins all default to output low
+    # When a report from the board last set each pin's state, or 0. A DIGITAL_MESSAGE only sets the pins it changes.
+    self.pin_updated = array('d', [0.0]) * MAX_PINS
+    self.port_mask = array('H', [0]) * (MAX_PINS // 8)  # The mask of the last DIGITAL_MESSAGE for each port.
+    self.port_updated = array('d', [0.0]) * (MAX_PINS // 8)  # When it arrived, or 0.
+    self._edge_listeners = {}  # Pin -> ((listener, edge mask), ...). Replaced, never mutated, like _listeners.
+    self._state_version = 0  # Odd while a handler is updating pin_state; see _ReadAllPins.
     self.pin_mode = collections.defaultdict(lambda: MODE_OUTPUT) #pins all default to output
+    self.histories = {}  # Maps pin number to the PinHistory of its reported values; see RecordHistory.
+    self._history_capacity = None  # If set, every reported pin gets a PinHistory of this capacity.
+    self._handlers = [None] * len(tokens.TOKEN_CLASSES)  # Indexed by token tag.
+    self._token_counts = [0] * len(tokens.TOKEN_CLASSES)  # Tokens dispatched, indexed by tag.
+    self._created = time.time()  # For the token rates in Stats.
+    self.dispatch_latency = None  # A firmata.metrics.Histogram, for boards that hand tokens between threads.
+    for token_class, handler in (
+        (tokens.ErrorMessage, self._HandleError),
+        (tokens.StringMessage, self._HandleError),
+        (tokens.ReservedCommand, self._HandleReservedCommand),
+        (tokens.ReportFirmware, self._HandleReportFirmware),
+        (tokens.AnalogMappingResponse, self._HandleAnalogMappingResponse),
+        (tokens.CapabilityResponse, self._HandleCapabilityResponse),
+        (tokens.AnalogMessage, self._HandleAnalogMessage),
+        (tokens.DigitalMessage, self._HandleDigitalMessage),
+        (tokens.ProtocolVersion, self._HandleProtocolVersion),
+        (tokens.PinStateResponse, self._HandlePinStateResponse),
+        (tokens.I2cReply, self._HandleI2cReply)):
+      self._handlers[token_class.TAG] = handler
+    self._unprofiled_handlers = list(self._handlers)  # What _handlers holds when no profiler is installed.
+    self._dispatch = self.DispatchToken  # What the dispatch loop calls; swapped by SetProfiler.
+    self._profiler = None
+    self._profile_every = PROFILE_SAMPLE_EVERY
+    self._profile_count = 0
+    self._profile_marks = None  # The reader's (seq, time queued) samples, for boards whose reader has them.
+    self._profile_handler_time = None  # Set by a profiled handler, for the dispatch around it to report.
+    self.startup_timings = collections.OrderedDict()  # Seconds taken by each phase of the handshake and discovery.
+    self._discovery = threading.Condition()  # Guards the fields below and is notified as startup responses arrive.
+    self._handshaking = False
+    self._heard_from_board = False
+    self._discovering = False
+    self._pipelining = False
+    self._awaiting_capabilities = False
+    self._awaiting_mapping = False
+    self._cache_mismatch = False  # Whether the board's analog mapping differed from the cached one.
+    self._queried_pins = set()
+    self._pending_pins = set()  # Pins whose state has been queried but has not arrived yet.
     self._i2c_device = I2CDevice(self)
-    super(Board, self).__init__()
-    if start_serial:
-      self.StartCommunications(query_version=query_version)
-
-  def __del__(self):
-    self.StopCommunications()
-
-  def StartCommunications(self, query_version=False):
-    """Starts all the threads needed to communicate with the physical board.
-
-    Args:
-      query_version: A boolean. If set, commands requesting firmware version are sent instead of depending on the board
-                     to reset on USB connect.
-    """
-    wait_for_serial = False
-    if self.firmware_name == 'Unknown':
-      wait_for_serial = threading.Condition()
-      wait_for_serial.acquire()
-      def FirmwareReportListener(token):
-        wait_for_serial.acquire()
-        wait_for_serial.notify_all()
-        wait_for_serial.release()
-        return (True, False)
-      self.AddListener('REPORT_FIRMWARE', FirmwareReportListener)
-    # Not all boards reset on port open, send the request just in case
-    if query_version:
-      self.QueryProtocolVersion()
-      self.QueryFirmwareVersionAndString()
-    self.port.StartCommunications()
-    self.shutdown = False
-    self.start()
-    if wait_for_serial:
-      wait_for_serial.wait(10)
-      wait_for_serial.release()
-
-  def StopCommunications(self):
-    """Stops communication with the board, and returns only after all communication has ceased."""
-    self.port.StopCommunications()
-    self.shutdown = True
-    self.join()
-
-  def __del__(self):
-    self.port.StopCommunications()
 
   def AddListener(self, token_type, listener):
     """Add a callable to be called the next time a particular token_type is received.
@@ -218,83 +513,265 @@ class Board(threading.Thread):
           the callable will be deleted. If abort is True, the normal processing of this token will cease after
           callbacks are called.
     """
-    self._listeners_lock.acquire()
-    self._listeners[token_type].append(listener)
-    self._listeners_lock.release()
+    with self._listeners_lock:
+      self._listeners[token_type] += (listener,)
+
+  def RemoveListener(self, token_type, listener):
+    """Remove a callable previously added with AddListener. Does nothing if it is not registered.
+
+    Args:
+      token_type: A string. The type of token the listener was added for.
+      listener: The callable to remove.
+    """
+    self._RemoveListeners(token_type, [listener])
+
+  def _RemoveListeners(self, token_type, listeners):
+    with self._listeners_lock:
+      remaining = list(self._listeners.get(token_type, ()))
+      for listener in listeners:
+        if listener in remaining:
+          remaining.remove(listener)
+      self._listeners[token_type] = tuple(remaining)
 
   def DispatchToken(self, token):
     """Given a token, mutates Board state and calls listeners as appropriate.
 
     Args:
-      token: A dictionary. The token to dispatch.
+      token: A `firmata.tokens.Token`, or a dict in the form the lexer used to emit. The token to dispatch.
     Returns:
       A boolean indicating success (True) or failure (False). On failure, an error will have been appended to the error
       queue.
     """
+    if isinstance(token, dict):
+      token = tokens.FromDict(token)
+    tag = getattr(token, 'TAG', None)
+    if tag is not None:
+      self._token_counts[tag] += 1
     token_type = token['token']
-    self._listeners_lock.acquire()
-    my_listeners = self._listeners.get(token_type, [])
-    if self._listeners[token_type]:
-      del self._listeners[token_type]
-    abort_regular_execution = False
-    for l in my_listeners:
-      delete, abort = l(token)
-      if abort:
-        abort_regular_execution = True
-      if not delete:
-        self._listeners[token_type].append(l)
-    self._listeners_lock.release()
-    if abort_regular_execution:
-      return True
-    if token_type == 'ERROR':
-      self.errors.append(token['message'])
-      return True
-    if token_type == 'STRING_MESSAGE':
-      self.errors.append(token['message'])
-      return True
-    if token_type == 'RESERVED_COMMAND':
-      self.errors.append('Unable to parse a reserved command: %s' % (repr(token)))
+    my_listeners = self._listeners.get(token_type)
+    if my_listeners:
+      abort_regular_execution = False
+      finished = None
+      for l in my_listeners:
+        delete, abort = l(token)
+        if abort:
+          abort_regular_execution = True
+        if delete:
+          if finished is None:
+            finished = []
+          finished.append(l)
+      if finished:
+        self._RemoveListeners(token_type, finished)
+      if abort_regular_execution:
+        return True
+    if tag is None:
+      self.errors.append('Unable to dispatch token: %s' % (repr(token)))
       return False
-    if token_type == 'REPORT_FIRMWARE':
-      self.firmware_version = '%s.%s' % (token['major'], token['minor'])
-      self.firmware_name = token['name']
-      return True
-    if token_type == 'ANALOG_MAPPING_RESPONSE':
-      self.dtoa_map = token['channels']
-      self.atod_map = []
-      map_dict = {}
-      for i in xrange(len(self.dtoa_map)):
-        if self.dtoa_map[i] is not False:
-          map_dict[self.dtoa_map[i]] = i
-      for k in sorted(map_dict.keys()):
-        self.atod_map.append(map_dict[k])
-      return True
-    if token_type == 'CAPABILITY_RESPONSE':
-      self.pin_config = token['pins']
-      return True
-    if token_type == 'ANALOG_MESSAGE':
-      pin = self.atod_map[token['pin']]
-      self.pin_state[pin] = token['value']
-      return True
-    if token_type == 'DIGITAL_MESSAGE':
-      for pin in xrange(8):
-        self.pin_state[token['port'] * 8 + pin] = token['pins'][pin]
-      return True
-    if token_type == 'PROTOCOL_VERSION':
-      self.firmware_version = '%s.%s' % (token['major'], token['minor'])
-      return True
-    if token_type == 'PIN_STATE_RESPONSE':
-      self.pin_state[token['pin']] = token['data']
-      self.pin_mode[token['pin']] = token['mode']
-      return True
+    return self._handlers[tag](token)
+
+  def _HandleError(self, token):
+    self.errors.append(token.message)
+    return True
+
+  def _HandleReservedCommand(self, token):
+    self.errors.append('Unable to parse a reserved command: %s' % (repr(token)))
+    return False
+
+  def _HandleReportFirmware(self, token):
+    self.firmware_version = '%s.%s' % (token.major, token.minor)
+    self.firmware_name = token.name
+    if self._handshaking:
+      with self._discovery:
+        self._discovery.notify_all()
+    return True
+
+  def _HandleAnalogMappingResponse(self, token):
+    self.dtoa_map = token.channels
+    self.atod_map = []
+    map_dict = {}
+    for i in xrange(len(self.dtoa_map)):
+      if self.dtoa_map[i] is not False:
+        map_dict[self.dtoa_map[i]] = i
+    for k in sorted(map_dict.keys()):
+      self.atod_map.append(map_dict[k])
+    mismatch = False
+    if self._revalidating is not None:
+      key, channels = self._revalidating
+      self._revalidating = None
+      mismatch = list(token.channels) != list(channels)
+      if mismatch:
+        self.logger.warning('Analog mapping does not match the cached one, invalidating %s' % key)
+        self.capability_cache.Invalidate(key)
+    if self._discovering:
+      with self._discovery:
+        self._awaiting_mapping = False
+        if mismatch:  # Discovery now waits for the capabilities, and caches them once they arrive.
+          self._awaiting_capabilities = self._cache_mismatch = True
+        self._discovery.notify_all()
+    if mismatch:
+      self.QueryCapabilities()  # The cached pin_config is stale too.
+    return True
+
+  def _HandleCapabilityResponse(self, token):
+    self.pin_config = token.pins
+    if self._discovering:
+      with self._discovery:
+        self._awaiting_capabilities = False
+        if self._pipelining:
+          self._QueryPinStates(xrange(len(self.pin_config)))
+        self._discovery.notify_all()
+    return True
+
+  def _HandleAnalogMessage(self, token):
+    pin = self.atod_map[token.pin]
+    self._state_version += 1
+    self.pin_state[pin] = token.value
+    self.pin_updated[pin] = time.time()
+    self._state_version += 1
+    return True
+
+  def _HandleDigitalMessage(self, token):
+    port, mask = token.port, token.mask
+    now = time.time()
+    changed = (self.port_mask[port] ^ mask) & 0xff
+    self._state_version += 1
+    self.port_mask[port] = mask
+    self.port_updated[port] = now
+    first_pin = port * 8
+    for i in _SET_BITS[changed]:
+      self.pin_state[first_pin + i] = (mask >> i) & 1
+      self.pin_updated[first_pin + i] = now
+    self._state_version += 1
+    if changed and self._edge_listeners:
+      for i in _SET_BITS[changed]:
+        listeners = self._edge_listeners.get(first_pin + i)
+        if listeners:
+          value = (mask >> i) & 1
+          for listener, edges in listeners:
+            if edges & (RISING if value else FALLING):
+              listener(first_pin + i, value, now)
+    return True
+
+  def _SyncPortMask(self, pin):
+    """Sets pin's bit of port_mask to what the next DIGITAL_MESSAGE must show for pin_state to change.
+
+    Called wherever pin_state or pin_mode changes other than by a report. Reports show the values of input pins and
+    show every other pin as low, so an input pin's bit follows pin_state and any other pin's is 0.
+    """
+    port, bit = pin // 8, 1 << (pin % 8)
+    if self.pin_mode[pin] == MODE_INPUT and self.pin_state[pin] & 1:
+      self.port_mask[port] |= bit
+    else:
+      self.port_mask[port] &= ~bit & 0xffff
+
+  def _HandleAnalogMessageRecording(self, token):
+    self._HandleAnalogMessage(token)
+    pin = self.atod_map[token.pin]
+    history = self._PinHistory(pin)
+    if history is not None:
+      history.Append(self.pin_updated[pin], token.value)
+    return True
+
+  def _HandleDigitalMessageRecording(self, token):
+    self._HandleDigitalMessage(token)
+    mask, first_pin = token.mask, token.port * 8
+    for i in xrange(8):
+      history = self._PinHistory(first_pin + i)
+      if history is not None:
+        history.Append(self.port_updated[token.port], (mask >> i) & 1)
+    return True
+
+  def _PinHistory(self, pin):
+    history = self.histories.get(pin)
+    if history is None and self._history_capacity:
+      history = self.histories[pin] = PinHistory(self._history_capacity)
+    return history
+
+  def _HandleProtocolVersion(self, token):
+    self.firmware_version = '%s.%s' % (token.major, token.minor)
+    return True
+
+  def _HandlePinStateResponse(self, token):
+    self._state_version += 1
+    self.pin_state[token.pin] = token.data
+    self.pin_updated[token.pin] = time.time()
+    self._state_version += 1
+    self.pin_mode[token.pin] = token.mode
+    self._SyncPortMask(token.pin)
+    if self._discovering:
+      with self._discovery:
+        self._pending_pins.discard(token.pin)
+        if not self._pending_pins:
+          self._discovery.notify_all()
+    return True
+
+  def _HandleI2cReply(self, token):
     self.errors.append('Unable to dispatch token: %s' % (repr(token)))
     return False
 
+  def _SetHandler(self, token_class, handler):
+    self._unprofiled_handlers[token_class.TAG] = handler
+    self._handlers[token_class.TAG] = handler if self._profiler is None else self._ProfiledHandler(handler)
+
+  def SetProfiler(self, hook, sample_every=PROFILE_SAMPLE_EVERY):
+    """Starts timing the stages tokens go through, or with hook None, stops. See firmata.profiling.
+
+    Args:
+      hook: A callable taking (stage, token type, seconds), e.g. a firmata.profiling.FlameCollector, or None.
+      sample_every: An integer. Time one token in this many.
+    """
+    self._profiler = hook
+    self._profile_every = sample_every
+    self._profile_count = 0
+    self._profile_handler_time = None
+    if hook is None:
+      self._dispatch = self.DispatchToken
+      self._handlers[:] = self._unprofiled_handlers
+    else:
+      self._dispatch = self._DispatchProfiled
+      self._handlers[:] = [self._ProfiledHandler(handler) for handler in self._unprofiled_handlers]
+
+  def _ProfiledHandler(self, handler):
+    clock = time.time
+    def ProfiledHandler(token):
+      if self._profile_handler_time is None:
+        return handler(token)  # Not a sampled token.
+      start = clock()
+      result = handler(token)
+      self._profile_handler_time = clock() - start
+      return result
+    return ProfiledHandler
+
+  def _DispatchProfiled(self, token):
+    hook, clock = self._profiler, time.time
+    marks = self._profile_marks
+    if marks is not None:  # The reader picked the sample.
+      sampled = False
+      while marks and marks[0][0] <= token.seq:  # Marks before this token's are of tokens the reader's queue dropped.
+        seq, queued = marks.popleft()
+        sampled = seq == token.seq
+      if sampled:
+        hook(STAGE_HANDOFF, token['token'], clock() - queued)
+    else:
+      self._profile_count += 1
+      sampled = not self._profile_count % self._profile_every
+    if not sampled:
+      return self.DispatchToken(token)
+    self._profile_handler_time = 0  # Marks the token as sampled for _ProfiledHandler.
+    start = clock()
+    result = self.DispatchToken(token)
+    duration = clock() - start
+    handler_time, self._profile_handler_time = self._profile_handler_time, None
+    hook(STAGE_DISPATCH, token['token'], duration)
+    if handler_time:
+      hook(STAGE_HANDLER, token['token'], handler_time)
+    return result
+
   def SendSysex(self, cmd, data=None):
     if data:
-      self.port.writer.q.put([SYSEX_START, cmd] + data + [SYSEX_END])
+      self.port.Put([SYSEX_START, cmd] + data + [SYSEX_END])
     else:
-      self.port.writer.q.put([SYSEX_START, cmd, SYSEX_END])
+      self.port.Put([SYSEX_START, cmd, SYSEX_END])
 
   def I2CConfig(self, delay=0):
     # Set all I2C capable pins to I2C mode, there is no way to specify which to use.
@@ -304,34 +781,174 @@ class Board(threading.Thread):
     self.SendSysex(SE_I2C_CONFIG, encodeSequence([delay]))
     return self._i2c_device
 
-  def QueryBoardCapabilitiesAndState(self, wait=True):
-    """ Query the board capabilities and state."""
+  def QueryBoardCapabilitiesAndState(self, wait=True, pipelined=True, timeout=DISCOVERY_TIMEOUT):
+    """Query the board capabilities and state.
+
+    Args:
+      wait: A boolean. If set (the default), returns only once the responses have arrived or the timeout has passed.
+      pipelined: A boolean. If set (the default), every query is sent without waiting for the previous one to be
+          answered, and responses are collected as they arrive. Pin states are queried along with the capabilities if
+          pin_config is already known, and otherwise as soon as the capability response is dispatched, so the exchange
+          takes at most two round trips. If not set, each query waits for its response in turn.
+          If `capability_cache` has an entry for this board and firmware, the capabilities and analog mapping are taken
+          from it instead of being waited for. The analog mapping is still queried, and if it differs from the cached
+          one the entry is invalidated, and the capabilities and the new pins' states are waited for and cached.
+      timeout: A number. When waiting, the most seconds to wait for all of the responses.
+
+    Returns:
+      When waiting, a sorted list of the pins whose state did not arrive before the timeout, which is empty on success.
+      Missing responses are also logged and appended to `errors`. Otherwise None.
+    """
     if not wait:
       self.QueryCapabilities()
       self.QueryAnalogMapping()
       for i in xrange(len(self.pin_config)):
         self.QueryPinState(i)
-    else:
-      query_lock = threading.Condition()
-      query_lock.acquire()
+      return None
+    start = time.time()
+    deadline = start + timeout
+    with self._discovery:
+      self._discovering = True
+      self._pipelining = pipelined
+      self._awaiting_capabilities = self._awaiting_mapping = True
+      self._cache_mismatch = False
+      self._queried_pins.clear()
+      self._pending_pins.clear()
+      cache_key = self._CapabilityCacheKey()
+      cached = cache_key and self.capability_cache.Get(cache_key)
+      if cached:
+        pin_config, channels = cached
+        self._HandleCapabilityResponse(tokens.CapabilityResponse(pin_config))
+        self._HandleAnalogMappingResponse(tokens.AnalogMappingResponse(channels))
+        self._revalidating = (cache_key, channels)
+        self._awaiting_mapping = True  # The board's own, to check the entry against.
+        self.QueryAnalogMapping()
+      elif pipelined:
+        self.QueryCapabilities()
+        self.QueryAnalogMapping()
+        self._QueryPinStates(xrange(len(self.pin_config)))
+      else:
+        self.QueryCapabilities()
+        self._WaitForDiscovery(lambda: not self._awaiting_capabilities, deadline)
+        self.QueryAnalogMapping()
+        self._WaitForDiscovery(lambda: not self._awaiting_mapping, deadline)
+      if pipelined:
+        self._QueryPinStates(xrange(len(self.pin_config)))
+        self._WaitForDiscovery(
+            lambda: not (self._awaiting_capabilities or self._awaiting_mapping or self._pending_pins), deadline)
+      else:
+        for pin in xrange(len(self.pin_config)):
+          self._QueryPinStates([pin])
+          if not self._WaitForDiscovery(lambda: not self._pending_pins, deadline):
+            self._pending_pins.update(xrange(pin, len(self.pin_config)))  # Reported missing along with this one.
+            break
+      if self._cache_mismatch:  # pin_config is the board's own only once the capabilities queried again arrive.
+        cached = None
+        self._WaitForDiscovery(lambda: not self._awaiting_capabilities, deadline)
+        self._QueryPinStates(xrange(len(self.pin_config)))
+        self._WaitForDiscovery(lambda: not self._pending_pins, deadline)
+      self._discovering = False
+      missing = sorted(self._pending_pins)
+      if self._awaiting_capabilities:
+        self._ReportDiscoveryError('No capability response from the board.')
+      if self._awaiting_mapping:
+        self._ReportDiscoveryError('No analog mapping response from the board.')
+      if missing:
+        self._ReportDiscoveryError('No pin state response for pins: %s' % ', '.join(str(pin) for pin in missing))
+      if cache_key and not cached and not (self._awaiting_capabilities or self._awaiting_mapping):
+        self.capability_cache.Put(cache_key, self.pin_config, self.dtoa_map)
+    self.startup_timings['discovery'] = time.time() - start
+    return missing
 
-      def QueryResponseListener(token):
-        query_lock.acquire()
-        query_lock.notify_all()
-        query_lock.release()
-        return (True, False)
+  def _WaitForDiscovery(self, predicate, deadline):
+    """Waits for responses until predicate() is true or the deadline passes. Must hold _discovery.
 
-      self.AddListener('CAPABILITY_RESPONSE', QueryResponseListener)
-      self.QueryCapabilities()
-      query_lock.wait()
-      self.AddListener('ANALOG_MAPPING_RESPONSE', QueryResponseListener)
-      self.QueryAnalogMapping()
-      query_lock.wait()
-      for i in xrange(len(self.pin_config)):
-        self.AddListener('PIN_STATE_RESPONSE', QueryResponseListener)
-        self.QueryPinState(i)
-        query_lock.wait()
-      query_lock.release()
+    Returns:
+      The final value of predicate().
+    """
+    while not predicate():
+      remaining = deadline - time.time()
+      if remaining <= 0:
+        return False
+      self._discovery.wait(remaining)
+    return True
+
+  def _QueryPinStates(self, pins):
+    """Queries the state of each of pins not queried yet in this discovery. Must hold _discovery."""
+    for pin in pins:
+      if pin not in self._queried_pins:
+        self._queried_pins.add(pin)
+        self._pending_pins.add(pin)
+        self.QueryPinState(pin)
+
+  def _CapabilityCacheKey(self):
+    """Returns this board's key in capability_cache, or None if the cache cannot be used."""
+    if self.capability_cache is None or not self.device_id or self.firmware_name == 'Unknown':
+      return None
+    return self.capability_cache.Key(self.device_id, self.firmware_name, self.firmware_version)
+
+  def _ReportDiscoveryError(self, message):
+    self.logger.warning(message)
+    self.errors.append(message)
+
+  def _BeginHandshake(self):
+    """Starts listening for the board.
+
+    Called before reading from the port, so that nothing the board sends is missed.
+    """
+    self._handshaking = True
+    self._heard_from_board = False
+    for token_class in tokens.TOKEN_CLASSES:
+      self.AddListener(token_class.TYPE, self._HeardFromBoard)
+
+  def _HeardFromBoard(self, token):
+    with self._discovery:
+      self._heard_from_board = True
+      self._discovery.notify_all()
+    return (True, False)
+
+  def _FinishHandshake(self, query_version, reset_timeout, firmware_timeout, probe_interval):
+    """Waits for the board to report its firmware, probing for the report if the board does not send it on its own.
+
+    The handshake has two phases. In 'reset', a board that resets when the port is opened is given up to reset_timeout
+    seconds to boot; the phase ends as soon as anything arrives from it. In 'firmware', QueryProtocolVersion and
+    QueryFirmwareVersionAndString are sent, and sent again with the wait doubling (up to MAX_PROBE_INTERVAL) each time
+    they go unanswered, until the firmware report arrives or firmware_timeout seconds pass. The time each phase took is
+    recorded in `startup_timings`.
+
+    Raises:
+      HandshakeError: The board did not report its firmware in time.
+    """
+    probes = 0
+    start = time.time()
+    try:
+      with self._discovery:
+        if not query_version:
+          self._WaitForDiscovery(lambda: self._heard_from_board, start + reset_timeout)
+        phase_start = time.time()
+        self.startup_timings['reset'] = phase_start - start
+        deadline = phase_start + firmware_timeout
+        reported = lambda: self.firmware_name != 'Unknown'
+        interval = probe_interval
+        if self._heard_from_board:
+          self._WaitForDiscovery(reported, min(deadline, time.time() + interval))  # It may be reporting on its own.
+        while not reported() and time.time() < deadline:
+          probes += 1
+          self.QueryProtocolVersion()
+          self.QueryFirmwareVersionAndString()
+          self._WaitForDiscovery(reported, min(deadline, time.time() + interval))
+          interval = min(interval * 2, MAX_PROBE_INTERVAL)
+        self.startup_timings['firmware'] = time.time() - phase_start
+    finally:
+      self._handshaking = False
+      for token_class in tokens.TOKEN_CLASSES:
+        self.RemoveListener(token_class.TYPE, self._HeardFromBoard)
+    self.logger.debug('Handshake: reset %.3fs, firmware %.3fs, %d probes' % (
+        self.startup_timings['reset'], self.startup_timings['firmware'], probes))
+    if self.firmware_name == 'Unknown':
+      raise HandshakeError('No firmware report from the board after %.1fs and %d probes; %s' % (
+          time.time() - start, probes, 'it sent other data, is it running Firmata at this baud rate?'
+          if self._heard_from_board else 'nothing at all was received from it.'))
 
   def QueryPinState(self, pin):
     assert 0 <= pin < len(self.pin_config)
@@ -341,7 +958,7 @@ class Board(threading.Thread):
     self.SendSysex(SE_CAPABILITY_QUERY)
 
   def QueryProtocolVersion(self):
-    self.port.writer.q.put([PROTOCOL_VERSION])
+    self.port.Put([PROTOCOL_VERSION])
 
   def QueryFirmwareVersionAndString(self):
     self.SendSysex(SE_REPORT_FIRMWARE)
@@ -349,20 +966,10 @@ class Board(threading.Thread):
   def QueryAnalogMapping(self):
     self.SendSysex(SE_ANALOG_MAPPING_QUERY)
 
-  def run(self):
-    """Reads tokens as they come in, and dispatches them appropriately. If an error occurs, the thread terminates."""
-    while not self.shutdown:
-      token = None
-      try:
-        token = self.port.reader.q.get(timeout=0.2)
-      except Empty:
-        continue
-      if not token or not self.DispatchToken(token):
-        break
-
   def digitalWrite(self, pin, value):
     assert value == 0 or value == 1
     self.pin_state[pin] = value
+    self._SyncPortMask(pin)
     port = pin / 8
     state = 0
     for i in range(8):
@@ -370,7 +977,7 @@ class Board(threading.Thread):
       # TODO: can we send a digitalWrite to an analog pin to enable the pullup?
       if self.pin_mode[pin_nr] == MODE_INPUT or self.pin_mode[pin_nr] == MODE_OUTPUT:
         state |= (self.pin_state[pin_nr] & 0x01) << i
-    self.port.writer.q.put([DIGITAL_MESSAGE + port, state & 0x7f, state >> 7])
+    self.port.Put([DIGITAL_MESSAGE + port, state & 0x7f, state >> 7])
 
   def digitalRead(self, pin):
     assert 0 <= pin < len(self.pin_config)
@@ -382,35 +989,205 @@ class Board(threading.Thread):
     assert 0 <= pin < len(self.pin_config)
     assert self.pin_config[pin].has_key(mode)
     self.pin_mode[pin] = mode
-    self.port.writer.q.put([SET_PIN_MODE, pin, mode])
+    self._SyncPortMask(pin)
+    self.port.Put([SET_PIN_MODE, pin, mode])
 
   def analogWrite(self, pin, value):
     assert 0 <= pin < len(self.pin_config)
     assert 0 <= value <= 255
     if self.pin_mode[pin] != MODE_PWM:
       self.pinMode(pin, MODE_PWM)
-    self.port.writer.q.put([ANALOG_MESSAGE + pin, value % 128, value >> 7])
+    self.port.Put([ANALOG_MESSAGE + pin, value % 128, value >> 7])
 
   def analogRead(self, pin):
     pin = self.atod_map[pin]
     assert self.pin_config[pin][MODE_ANALOG]
     return self.pin_state[pin]
 
+  def analogReadAll(self, as_numpy=False):
+    """Returns the last reported value of every analog channel, all as of the same moment.
+
+    Args:
+      as_numpy: A boolean. If set, NumPy arrays are returned instead of array.arrays. Requires NumPy.
+    Returns:
+      (values, updated): values[i] is the value of analog channel i (analogRead(i)), and updated[i] the time.time() it
+      was reported at, or 0 if it never has been.
+    """
+    return self._ReadAllPins(self.atod_map, as_numpy)
+
+  def digitalReadAll(self, as_numpy=False):
+    """Returns the state of every pin, all as of the same moment.
+
+    Args:
+      as_numpy: A boolean. If set, NumPy arrays are returned instead of array.arrays. Requires NumPy.
+    Returns:
+      (values, updated): values[pin] is the state of pin, and updated[pin] the time.time() a report last changed it, or
+      0 if none has. A DIGITAL_MESSAGE only stamps the pins whose state it changes, so updated says nothing about how
+      fresh an unchanged pin is; port_updated[pin // 8] holds when its port was last reported.
+    """
+    return self._ReadAllPins(range(len(self.pin_config)), as_numpy)
+
+  def _ReadAllPins(self, pins, as_numpy):
+    # The dispatching thread makes _state_version odd while it updates pin_state and pin_updated, and even again when
+    # it is done, so a copy taken while the version stayed the same and even is consistent. Copying never blocks
+    # dispatch, and retries are rare since a copy is two C-level slices.
+    while True:
+      version = self._state_version
+      if not version & 1:
+        values, updated = self.pin_state[:], self.pin_updated[:]
+        if version == self._state_version:
+          break
+      time.sleep(0)
+    if as_numpy:
+      if numpy is None:
+        raise ImportError('as_numpy requires NumPy')
+      pins = numpy.array(pins, dtype=numpy.intp)
+      return (numpy.frombuffer(values, dtype=numpy.int_)[pins], numpy.frombuffer(updated, dtype=numpy.float64)[pins])
+    return array('l', [values[pin] for pin in pins]), array('d', [updated[pin] for pin in pins])
+
   def EnableAnalogReporting(self, pin):
     assert 0 <= pin <= len(self.atod_map)
-    self.port.writer.q.put([REPORT_ANALOG + pin, 1])
+    self.port.Put([REPORT_ANALOG + pin, 1])
 
   def DisableAnalogReporting(self, pin):
     assert 0 <= pin <= len(self.atod_map)
-    self.port.writer.q.put([REPORT_ANALOG + pin, 0])
+    self.port.Put([REPORT_ANALOG + pin, 0])
 
   def EnableDigitalReporting(self, port):
     assert 0 <= port <= len(self.pin_config) / 8 + 1
-    self.port.writer.q.put([REPORT_DIGITAL + port, 1])
+    self.port.Put([REPORT_DIGITAL + port, 1])
 
   def DisableDigitalReporting(self, port):
     assert 0 <= port <= len(self.pin_config) / 8 + 1
-    self.port.writer.q.put([REPORT_DIGITAL + port, 0])
+    self.port.Put([REPORT_DIGITAL + port, 0])
+
+  def AddEdgeListener(self, pin, listener, edges=BOTH_EDGES):
+    """Calls listener(pin, value, timestamp) each time a DIGITAL_MESSAGE changes the state of pin.
+
+    value is 1 for a rising edge and 0 for a falling one, and timestamp the time.time() the report was dispatched at.
+    Listeners run on the dispatch thread, after pin_state has been updated. Reports that leave the pin as it was, and
+    changes made by digitalWrite or PIN_STATE_RESPONSE, call nothing.
+
+    Args:
+      pin: An integer. The pin to watch.
+      listener: A callable taking (pin, value, timestamp).
+      edges: RISING, FALLING or BOTH_EDGES (the default).
+    """
+    with self._listeners_lock:
+      edge_listeners = dict(self._edge_listeners)
+      edge_listeners[pin] = edge_listeners.get(pin, ()) + ((listener, edges),)
+      self._edge_listeners = edge_listeners
+
+  def RemoveEdgeListener(self, pin, listener):
+    """Removes a listener previously added for pin with AddEdgeListener. Does nothing if it is not registered."""
+    with self._listeners_lock:
+      edge_listeners = dict(self._edge_listeners)
+      remaining = tuple(entry for entry in edge_listeners.get(pin, ()) if entry[0] != listener)
+      if remaining:
+        edge_listeners[pin] = remaining
+      else:
+        edge_listeners.pop(pin, None)
+      self._edge_listeners = edge_listeners
+
+  def RecordHistory(self, pins=None, capacity=HISTORY_CAPACITY):
+    """Starts recording each value reported for pins, with the time it arrived, in a firmata.history.PinHistory.
+
+    Reports are only recorded while this is on; until it is called, ANALOG_MESSAGE and DIGITAL_MESSAGE cost nothing
+    extra. Memory is fixed at about 20 bytes per sample of capacity per pin.
+
+    Args:
+      pins: A list of pin numbers, using digital pin numbers for analog pins (see atod_map). By default every pin is
+          recorded, starting with its first report.
+      capacity: An integer. How many of the most recent samples to keep per pin.
+    """
+    if pins is None:
+      self._history_capacity = capacity
+    else:
+      for pin in pins:
+        if pin not in self.histories:
+          self.histories[pin] = PinHistory(capacity)
+    self._SetHandler(tokens.AnalogMessage, self._HandleAnalogMessageRecording)
+    self._SetHandler(tokens.DigitalMessage, self._HandleDigitalMessageRecording)
+
+  def StopRecordingHistory(self):
+    """Stops recording and discards every pin's history."""
+    self._SetHandler(tokens.AnalogMessage, self._HandleAnalogMessage)
+    self._SetHandler(tokens.DigitalMessage, self._HandleDigitalMessage)
+    self._history_capacity = None
+    self.histories = {}
+
+  def History(self, pin):
+    """Returns the PinHistory of pin (by digital pin number), or None if it is not being recorded."""
+    return self.histories.get(pin)
+
+  def Stream(self, pins=None, kinds=STREAM_KINDS, capacity=STREAM_CAPACITY, overflow=DROP_OLDEST, max_batch=None):
+    """Returns a firmata.stream.SampleStream of the board's reports, to be consumed in batches.
+
+    Args:
+      pins: A list of pin numbers to stream, using digital pin numbers for analog pins, or None (the default) for all.
+      kinds: A sequence of the token types to stream: 'ANALOG_MESSAGE', 'DIGITAL_MESSAGE' or both (the default).
+      capacity: An integer. The most samples to buffer for a consumer that falls behind.
+      overflow: The policy for a sample that arrives when the buffer is full; see firmata.stream.
+      max_batch: An integer. The most samples in one batch, or None (the default) for no limit.
+    """
+    return SampleStream(self, pins=pins, kinds=kinds, capacity=capacity, overflow=overflow, max_batch=max_batch,
+                        loop=getattr(self, 'loop', None))
+
+  def ScheduleReporting(self, analog, digital=None, degrade=False, **options):
+    """Enables reporting at the given rates, fitted to what the serial link can carry. See firmata.scheduler.
+
+    Args:
+      analog: A dict mapping analog channel numbers to the reports per second wanted from each.
+      digital: A dict mapping digital port numbers to how many times a second each is expected to change.
+      degrade: A boolean. If set, analog rates that do not fit are scaled down until they do, instead of raising.
+      **options: Passed to ReportingScheduler.
+
+    Returns:
+      The ReportingScheduler, whose `plan` is what was applied and whose Rates() compares it with what arrives.
+
+    Raises:
+      ReportingBudgetError: The rates do not fit, and degrade is not set. Nothing is sent.
+    """
+    scheduler = ReportingScheduler(self, **options)
+    scheduler.Apply(scheduler.Plan(analog, digital, degrade=degrade))
+    return scheduler
+
+  def Stats(self, since=None):
+    """Returns counters describing how hard the link to the board is working. See also firmata.metrics.
+
+    Stats keeps no state between calls, so callers measuring rates over their own intervals do not disturb each other.
+
+    Args:
+      since: An earlier result of Stats, to compute token_rates from, or None (the default) for rates since the board
+          was created.
+
+    Returns:
+      A dict with:
+        bytes_in, bytes_out: Bytes read from and written to the board.
+        tokens: Maps each token type to the number dispatched.
+        token_rates: Maps each token type to the number dispatched per second since `since`.
+        lexer_errors, lexer_recoveries, lexer_skipped_bytes: Malformed messages, the times the lexer found its way back
+            to a command after one, and the bytes it discarded doing so.
+        errors: len(self.errors).
+        queue_depths: Maps each of the port's queues ('reader', 'writer', 'logger') to the items waiting in it.
+        queue_overflows: Maps each of the port's queues to the items put while it was full (see firmata.queues).
+        dispatch_latency: A Histogram.Snapshot() of the time from lexing to dispatch (sampled), or None.
+        time: The time.time() the counters were read at.
+    """
+    stats = self.port.Stats()
+    now, counts = time.time(), list(self._token_counts)
+    if since is None:
+      last_time, last_tokens = self._created, {}
+    else:
+      last_time, last_tokens = since['time'], since['tokens']
+    elapsed = max(now - last_time, 1e-9)
+    stats['time'] = now
+    stats['tokens'] = dict((token_class.TYPE, count) for token_class, count in zip(tokens.TOKEN_CLASSES, counts))
+    stats['token_rates'] = dict((kind, (count - last_tokens.get(kind, 0)) / elapsed)
+                                for kind, count in stats['tokens'].items())
+    stats['errors'] = len(self.errors)
+    stats['dispatch_latency'] = self.dispatch_latency.Snapshot() if self.dispatch_latency else None
+    return stats
 
   def SetSamplingInterval(self, interval=19):
     """Set the sampling interval in ms.
@@ -421,7 +1198,118 @@ class Board(threading.Thread):
     self.SendSysex(SE_SAMPLING_INTERVAL, encodeSequence([interval]))
 
 
-def FirmataInit(port, baud=57600, log_to_file=None, query_version=False):
+class Board(BaseBoard, threading.Thread):
+  """A board driven by threads: SerialPort's reader and writer threads, and this thread, which dispatches tokens.
+
+  With dispatch_mode DISPATCH_INLINE or DISPATCH_BATCHED, the reader thread dispatches tokens itself and this thread is
+  never started. That saves a queue handoff and a thread wakeup per token, but a listener that blocks then holds up
+  reading too, and nothing run by a listener may call StopCommunications.
+  """
+  def __init__(self, port, baud, log_to_file=None, start_serial=False, query_version=False,
+               dispatch_mode=DISPATCH_THREAD, **port_options):
+    """Board object constructor. Should not be called directly.
+
+    Args:
+      port: The serial port to use. Expressed as either a string or an integer (see pyserial docs for more info.)
+      baud: A number representing the baud rate to use for serial communication.
+      log_to_file: A string specifying the file to log serial events to, or None (the default) for no logging.
+      start_serial: If True, starts the serial IO thread right away. Default: False.
+      query_version: A boolean. If set, commands requesting firmware version are sent instead of depending on the board
+                     to reset on USB connect.
+      dispatch_mode: The thread tokens are dispatched on, from DISPATCH_MODES. Defaults to DISPATCH_THREAD.
+      port_options: Any other keyword arguments are passed on to the `SerialPort` constructor (e.g. reader_mode).
+
+    Raises:
+      ValueError: dispatch_mode is not one of DISPATCH_MODES.
+    """
+    if dispatch_mode not in DISPATCH_MODES:
+      raise ValueError('Unknown dispatch mode: %r' % (dispatch_mode,))
+    BaseBoard.__init__(self, SerialPort(port=port, baud=baud, log_to_file=log_to_file, start_serial=start_serial,
+                                        **port_options))
+    self.device_id = port
+    self.dispatch_mode = dispatch_mode
+    self.shutdown = False
+    self.dispatch_latency = Histogram()
+    threading.Thread.__init__(self)
+    if start_serial:
+      try:
+        self.StartCommunications(query_version=query_version)
+      except HandshakeError:
+        self.StopCommunications()  # The caller never gets the board, so cannot stop its threads.
+        raise
+
+  def StartCommunications(self, query_version=False, reset_timeout=RESET_TIMEOUT, firmware_timeout=FIRMWARE_TIMEOUT,
+                          probe_interval=PROBE_INTERVAL):
+    """Starts all the threads needed to communicate with the physical board, and waits for its firmware report.
+
+    Args:
+      query_version: A boolean. If set, the board is probed for its firmware right away instead of first being given
+                     time to reset on USB connect.
+      reset_timeout: A number. The most seconds to wait for a board that resets on connect to start sending.
+      firmware_timeout: A number. The most seconds to then spend probing for the firmware report.
+      probe_interval: A number. Seconds to wait for an answer to the first probe before probing again.
+
+    Raises:
+      HandshakeError: The board did not report its firmware in time. The threads are left running.
+    """
+    handshake = self.firmware_name == 'Unknown'
+    if handshake:
+      self._BeginHandshake()
+    self._StartDispatch()
+    self.port.StartCommunications()
+    if handshake:
+      self._FinishHandshake(query_version, reset_timeout, firmware_timeout, probe_interval)
+
+  def _StartDispatch(self):
+    """Starts dispatching the reader's tokens, on this thread or, in the inline modes, on the reader's."""
+    self.shutdown = False
+    if self.dispatch_mode == DISPATCH_THREAD:
+      self.start()
+    else:
+      self.port.reader.SetDispatch(self._DispatchReceived, batched=self.dispatch_mode == DISPATCH_BATCHED)
+
+  def SetProfiler(self, hook, sample_every=PROFILE_SAMPLE_EVERY):
+    """Like BaseBoard.SetProfiler, but also times reading, lexing and the handoff to the dispatching thread."""
+    # The board side first: marks the reader makes before _profile_marks is set are then discarded as stale, not left
+    # to pile up behind a dispatch that ignores them.
+    BaseBoard.SetProfiler(self, hook, sample_every)
+    self.port.reader.SetProfiler(hook, sample_every)
+    self._profile_marks = self.port.reader.profile_marks
+
+  def StopCommunications(self):
+    """Stops communication with the board, and returns only after all communication has ceased."""
+    self.port.StopCommunications()
+    self.shutdown = True
+    if self.dispatch_mode == DISPATCH_THREAD:
+      self.join()
+
+  def __del__(self):
+    if getattr(self, 'port', None):  # Not set if the constructor rejected its arguments.
+      self.port.StopCommunications()
+
+  def run(self):
+    """Reads tokens as they come in, and dispatches them appropriately. If an error occurs, the thread terminates."""
+    reader = self.port.reader
+    while not self.shutdown:
+      token = None
+      try:
+        token = reader.q.get(timeout=0.2)
+      except Empty:
+        continue
+      if not token or not self._DispatchReceived(token):
+        break
+
+  def _DispatchReceived(self, token):
+    """Dispatches a token from the reader, sampling the dispatch latency. Returns False to stop dispatching."""
+    marks = self.port.reader.lex_marks
+    while marks and marks[0][0] <= token.seq:  # Marks before this token's are of tokens the reader's queue dropped.
+      seq, lexed = marks.popleft()
+      if seq == token.seq:
+        self.dispatch_latency.Observe(time.time() - lexed)
+    return self._dispatch(token)
+
+
+def FirmataInit(port, baud=57600, log_to_file=None, query_version=False, capability_cache=None, **port_options):
   """Instantiate a `Board` object for a given serial port.
 
   Args:
@@ -430,12 +1318,26 @@ def FirmataInit(port, baud=57600, log_to_file=None, query_version=False):
     log_to_file: A string specifying the file to log serial events to, or None (the default) for no logging.
     query_version: A boolean. If set, commands requesting firmware version are sent instead of depending on the board
                    to reset on USB connect.
+    capability_cache: A firmata.cache.CapabilityCache to take the board's capabilities and analog mapping from if it
+                      has been seen before with the same firmware, or None (the default) to always query them.
+    port_options: Any other keyword arguments are passed on to the `SerialPort` constructor (e.g. reader_mode).
 
   Returns:
     A Board object which implements the firmata protocol over the specified serial port.
+
+  Raises:
+    HandshakeError: The board did not report its firmware in time.
   """
-  board = Board(port, baud, log_to_file=log_to_file, start_serial=True, query_version=query_version)
+  board = Board(port, baud, log_to_file=log_to_file, start_serial=False, **port_options)
+  board.capability_cache = capability_cache
+  try:
+    board.StartCommunications(query_version=query_version)
+  except HandshakeError:
+    board.StopCommunications()
+    raise
   board.QueryBoardCapabilitiesAndState()
   return board
 
-__all__ = ['FirmataInit', 'Board', 'SerialPort'] + CONST_R.values()
+__all__ = ['FirmataInit', 'BaseBoard', 'Board', 'BOTH_EDGES', 'DISPATCH_BATCHED', 'DISPATCH_INLINE', 'DISPATCH_THREAD',
+           'FALLING', 'HandshakeError', 'I2CRequest', 'I2CStream', 'ReportingBudgetError', 'RISING',
+           'SerialPort'] + CONST_R.values()
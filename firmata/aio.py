@@ -0,0 +1,238 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Drives boards from an asyncio event loop instead of threads.
+
+A threaded `firmata.Board` costs four threads (reader, writer, dispatcher and an optional logger) and three queue
+handoffs per board. An `AsyncBoard` costs none: its serial port is non-blocking, the event loop calls into it when the
+port is readable or writable, and tokens are lexed and dispatched on the loop's thread. Queries that wait for the board
+return futures instead of blocking:
+
+  loop = asyncio.get_event_loop()
+  board = AsyncBoard('/dev/ttyACM0', 57600, loop=loop)
+  loop.run_until_complete(board.StartCommunications())
+  loop.run_until_complete(board.QueryBoardCapabilitiesAndState())
+  board.digitalWrite(13, 1)
+
+All of an AsyncBoard's methods must be called from the loop's thread. On Python 2 this module uses trollius, the
+asyncio backport; if neither is installed `asyncio` is None and AsyncBoard cannot be constructed.
+"""
+
+try:
+  import asyncio
+except ImportError:
+  try:
+    import trollius as asyncio
+  except ImportError:
+    asyncio = None
+
+from firmata import BaseBoard, I2CReadRequest
+from firmata.constants import *
+from firmata.io import NonBlockingPort
+
+
+class AsyncBoard(BaseBoard):
+  """A board whose serial IO and token dispatch run on an asyncio event loop."""
+  def __init__(self, port, baud, loop=None, transport=None):
+    """Constructs an AsyncBoard. Nothing is read from the port until StartCommunications is called.
+
+    Args:
+      port: The serial port to use. Expressed as either a string or an integer (see pyserial docs for more info.)
+      baud: A number representing the baud rate to use for serial communication.
+      loop: The event loop to run on. Defaults to asyncio.get_event_loop().
+      transport: A pySerial compatible object with a fileno() method to use instead of opening `port`.
+    """
+    if asyncio is None:
+      raise ImportError('AsyncBoard requires asyncio, or trollius on Python 2')
+    self.loop = loop if loop is not None else asyncio.get_event_loop()
+    BaseBoard.__init__(self, NonBlockingPort(port, baud, self._Dispatch, transport=transport))
+    self.port.on_write_pending = self._ScheduleFlush
+    self._reading = False
+    self._flush_scheduled = False
+    self._writer_added = False
+    self._i2c_reads = {}  # I2C address -> futures waiting for a reply from it, oldest first.
+    self.AddListener('I2C_REPLY', self._I2CReplyListener)
+
+  def _NewFuture(self):
+    return asyncio.Future(loop=self.loop)
+
+  def _Expect(self, token_type):
+    """Returns a future resolved with the next token of token_type, after Board state has been updated from it."""
+    future = self._NewFuture()
+    def Listener(token):
+      if not future.done():
+        future.set_result(token)
+      return (True, False)
+    self.AddListener(token_type, Listener)
+    return future
+
+  def _Dispatch(self, token):
+    # Unlike Board.run, a token that fails to dispatch does not stop the board; the failure is in self.errors.
+    if not self._dispatch(token):
+      self.logger.warning('Unable to dispatch token: %r' % (token,))
+
+  def _OnReadable(self):
+    try:
+      self.port.Read()
+    except (OSError, IOError), e:
+      self.logger.error('Read from board failed, closing: %s' % e)
+      self.StopCommunications()
+
+  def _ScheduleFlush(self):
+    # Commands queued in the same loop iteration go out in a single write.
+    if not self._flush_scheduled:
+      self._flush_scheduled = True
+      self.loop.call_soon(self._Flush)
+
+  def _Flush(self):
+    self._flush_scheduled = False
+    if not self._reading:
+      return  # StartCommunications flushes whatever was queued before it.
+    if self.port.Flush():
+      if self._writer_added:
+        self.loop.remove_writer(self.port.fileno())
+        self._writer_added = False
+    elif not self._writer_added:
+      self.loop.add_writer(self.port.fileno(), self._Flush)
+      self._writer_added = True
+
+  def StartCommunications(self, query_version=False):
+    """Starts watching the serial port.
+
+    Args:
+      query_version: A boolean. If set, commands requesting firmware version are sent instead of depending on the board
+                     to reset on USB connect.
+
+    Returns:
+      A future resolved with this board once the board has reported its firmware.
+    """
+    if self.firmware_name == 'Unknown':
+      ready = self._Expect('REPORT_FIRMWARE')
+    else:
+      ready = self._NewFuture()
+      ready.set_result(None)
+    ready = self._Chain(ready, lambda _: self)
+    if query_version:
+      self.QueryProtocolVersion()
+      self.QueryFirmwareVersionAndString()
+    if not self._reading:
+      self._reading = True
+      self.loop.add_reader(self.port.fileno(), self._OnReadable)
+      self._ScheduleFlush()
+    return ready
+
+  def StopCommunications(self):
+    """Stops watching the serial port and closes it. Pending I2C reads are cancelled."""
+    if not self._reading:
+      return
+    self._reading = False
+    self.loop.remove_reader(self.port.fileno())
+    if self._writer_added:
+      self.loop.remove_writer(self.port.fileno())
+      self._writer_added = False
+    for futures in self._i2c_reads.values():
+      for future in futures:
+        future.cancel()
+    self._i2c_reads.clear()
+    self.port.Close()
+
+  def _Chain(self, future, transform):
+    """Returns a future resolved with transform(future.result()), or failed or cancelled along with future."""
+    chained = self._NewFuture()
+    def Done(f):
+      if chained.done():
+        return
+      if f.cancelled():
+        chained.cancel()
+      elif f.exception() is not None:
+        chained.set_exception(f.exception())
+      else:
+        chained.set_result(transform(f.result()))
+    future.add_done_callback(Done)
+    return chained
+
+  def QueryBoardCapabilitiesAndState(self):
+    """Query the board capabilities and state.
+
+    The capability and analog mapping queries go out together, and as soon as the capabilities arrive every pin's
+    state is queried at once, so the whole exchange takes two round trips regardless of the number of pins.
+
+    Returns:
+      A future resolved with this board once the capabilities, analog mapping and every pin's state have arrived.
+    """
+    done = self._NewFuture()
+    waiting = {'mapping': True, 'pins': None}  # pins: the set of pins whose state has not arrived yet.
+
+    def MaybeDone():
+      if not waiting['mapping'] and waiting['pins'] is not None and not waiting['pins'] and not done.done():
+        done.set_result(self)
+
+    def PinStateListener(token):
+      pins = waiting['pins']
+      pins.discard(token.pin)
+      if not pins:
+        self.loop.call_soon(MaybeDone)  # After this token has updated pin_state.
+      return (not pins, False)
+
+    def CapabilitiesReceived(f):
+      if f.cancelled():
+        return
+      waiting['pins'] = set(xrange(len(self.pin_config)))
+      if waiting['pins']:
+        self.AddListener('PIN_STATE_RESPONSE', PinStateListener)
+        for pin in xrange(len(self.pin_config)):
+          self.QueryPinState(pin)
+      MaybeDone()
+
+    def MappingReceived(f):
+      waiting['mapping'] = False
+      MaybeDone()
+
+    self._Expect('CAPABILITY_RESPONSE').add_done_callback(CapabilitiesReceived)
+    self._Expect('ANALOG_MAPPING_RESPONSE').add_done_callback(MappingReceived)
+    self.QueryCapabilities()
+    self.QueryAnalogMapping()
+    return done
+
+  def I2CRead(self, addr, reg, count, timeout=1):
+    """Send an I2C read command. I2CConfig must have been called first.
+
+    Args:
+      addr: A byte. An I2C address. Must be less than 0x80.
+      reg: A byte. The I2C register to read from. Set to None to exclude it.
+      count: A number. The number of bytes of to read from the I2C bus.
+      timeout: A number. The number of seconds to wait for the reply before giving up.
+
+    Returns:
+      A future resolved with the list of bytes read, or with None if no reply arrived before the timeout.
+    """
+    future = self._NewFuture()
+    self._i2c_reads.setdefault(addr, []).append(future)
+    self._i2c_device.replies.setdefault(addr, None)  # Marks the reply as expected.
+    self.SendSysex(SE_I2C_REQUEST, I2CReadRequest(addr, reg, count))
+    def TimedOut():
+      if not future.done():
+        self._i2c_reads[addr].remove(future)
+        future.set_result(None)
+    handle = self.loop.call_later(timeout, TimedOut)
+    future.add_done_callback(lambda _: handle.cancel())
+    return future
+
+  def _I2CReplyListener(self, token):
+    futures = self._i2c_reads.get(token.addr)
+    while futures:
+      future = futures.pop(0)
+      if not future.done():  # Skips reads that timed out or were cancelled.
+        future.set_result(token.data)
+        break
+    return (False, False)
@@ -0,0 +1,81 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""An on-disk cache of board capabilities and analog mappings.
+
+A board's capability and analog mapping responses only change when its firmware does, so once they have been seen for
+a device and firmware, `CapabilityCache` lets later discoveries use them without asking again. Entries are keyed on the
+device (usually its port name) and the firmware name and version from REPORT_FIRMWARE, and stored as JSON:
+
+  cache = CapabilityCache(os.path.expanduser('~/.firmata_cache.json'))
+  board = FirmataInit('/dev/ttyACM0', capability_cache=cache)
+"""
+
+import json
+import os
+import tempfile
+import threading
+
+
+class CapabilityCache(object):
+  """Maps (device, firmware name, firmware version) to a board's pin_config and analog mapping channels."""
+  def __init__(self, path):
+    """Constructs a CapabilityCache, loading any entries already stored at path.
+
+    Args:
+      path: A string. The file the cache is stored in. It is created on the first Put().
+    """
+    self.path = path
+    self._lock = threading.Lock()
+    self._entries = {}
+    try:
+      with open(path) as f:
+        self._entries = json.load(f)
+    except (IOError, ValueError):
+      pass  # A missing or corrupt cache is an empty one.
+
+  @staticmethod
+  def Key(device_id, firmware_name, firmware_version):
+    return '%s|%s|%s' % (device_id, firmware_name, firmware_version)
+
+  def Get(self, key):
+    """Returns (pin_config, channels) stored for key, or None.
+
+    pin_config is in the form of BaseBoard.pin_config, and channels in the form of tokens.AnalogMappingResponse.
+    """
+    with self._lock:
+      entry = self._entries.get(key)
+    if entry is None:
+      return None
+    pin_config = [dict((int(mode), resolution) for mode, resolution in pin.items()) for pin in entry['pins']]
+    return pin_config, entry['channels']
+
+  def Put(self, key, pin_config, channels):
+    """Stores a board's pin_config and analog mapping channels under key, and saves the cache."""
+    with self._lock:
+      self._entries[key] = {'pins': pin_config, 'channels': channels}
+      self._Save()
+
+  def Invalidate(self, key):
+    """Removes the entry for key, if there is one, and saves the cache."""
+    with self._lock:
+      if self._entries.pop(key, None) is not None:
+        self._Save()
+
+  def _Save(self):
+    # Written to a temporary file and renamed over the cache, so a crash never leaves it half written.
+    directory = os.path.dirname(os.path.abspath(self.path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.firmata_cache')
+    with os.fdopen(fd, 'w') as f:
+      json.dump(self._entries, f)
+    os.rename(temp_path, self.path)
@@ -0,0 +1,135 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Binary capture of serial traffic.
+
+`SerialCapture` records the raw chunks read from and written to a serial port, with a timestamp and direction, to a
+compact append-only file. It is cheap enough to leave on in production: the serial threads only queue a reference to
+each chunk, writes to disk are buffered, and if the disk cannot keep up chunks are dropped (and counted) rather than
+queued without bound (see firmata.queues). Captures are turned into the text SerialLogger writes by running this module:
+
+  python -m firmata.capture CAPTURE_FILE [OUTPUT_FILE]
+
+A capture file is MAGIC followed by records, each a RECORD header (timestamp, direction, length) and `length` bytes.
+"""
+
+import struct
+import sys
+import threading
+import time
+
+from firmata.constants import *
+from firmata.queues import DROP_NEWEST, BoundedQueue
+
+
+MAGIC = 'FMTCAP01'
+RECORD = struct.Struct('<dBI')
+
+DIRECTION_IN = 0  # Bytes read from the board.
+DIRECTION_OUT = 1  # Bytes written to the board.
+
+DIRECTION_PREFIX = {DIRECTION_IN: '<<', DIRECTION_OUT: '>>'}
+
+CAPTURE_QUEUE_SIZE = 4096
+CAPTURE_BUFFER_SIZE = 1 << 16
+
+
+class SerialCapture(threading.Thread):
+  """Writes timestamped chunks of serial traffic to a capture file from a background thread."""
+  def __init__(self, path, max_queued=CAPTURE_QUEUE_SIZE, buffer_size=CAPTURE_BUFFER_SIZE, on_high_water=None):
+    """Constructs a SerialCapture.
+
+    Args:
+      path: A string. The file to write the capture to. It is truncated if it exists.
+      max_queued: An integer. The most chunks that may wait to be written before new ones are dropped.
+      buffer_size: An integer. The size of the file's write buffer in bytes.
+      on_high_water: Called with ('logger', depth) when the queue is nearly full. See firmata.queues.
+    """
+    self._file = open(path, 'wb', buffer_size)
+    self._file.write(MAGIC)
+    self.q = BoundedQueue(max_queued, DROP_NEWEST, name='logger', on_high_water=on_high_water)
+    self.records = 0
+    super(SerialCapture, self).__init__()
+
+  @property
+  def dropped(self):
+    """Chunks not captured because max_queued were already waiting."""
+    return self.q.dropped
+
+  def Log(self, direction, data):
+    """Queues a chunk of traffic to be captured. Never blocks.
+
+    Args:
+      direction: DIRECTION_IN or DIRECTION_OUT.
+      data: A str or bytearray. The bytes read or written.
+    """
+    self.q.put((time.time(), direction, bytes(data)))
+
+  def Close(self):
+    """Writes out everything queued so far, closes the file and stops the thread."""
+    self.q.put(None)
+    self.join()
+
+  def run(self):
+    while True:
+      record = self.q.get()
+      if record is None:
+        break
+      timestamp, direction, data = record
+      self._file.write(RECORD.pack(timestamp, direction, len(data)))
+      self._file.write(data)
+      self.records += 1
+    self._file.close()
+
+
+def ReadCapture(path):
+  """Reads a capture file.
+
+  Args:
+    path: A string. The capture file to read.
+
+  Yields:
+    A (timestamp, direction, data) tuple for each record, where data is a bytearray.
+  """
+  with open(path, 'rb') as f:
+    if f.read(len(MAGIC)) != MAGIC:
+      raise ValueError('%s is not a firmata capture file' % path)
+    while True:
+      header = f.read(RECORD.size)
+      if len(header) < RECORD.size:
+        return
+      timestamp, direction, length = RECORD.unpack(header)
+      yield timestamp, direction, bytearray(f.read(length))
+
+
+def FormatBytes(direction, data):
+  """Returns the SerialLogger text lines for a chunk of traffic, one per byte."""
+  prefix = DIRECTION_PREFIX[direction]
+  return ['%s %s (%s)' % (prefix, hex(rune), CONST_R.get(rune, 'UNKNOWN')) for rune in bytearray(data)]
+
+
+def main(argv):
+  if len(argv) not in (2, 3):
+    sys.stderr.write('usage: %s CAPTURE_FILE [OUTPUT_FILE]\n' % argv[0])
+    return 2
+  out = open(argv[2], 'w') if len(argv) == 3 else sys.stdout
+  for _, direction, data in ReadCapture(argv[1]):
+    for line in FormatBytes(direction, data):
+      out.write('%s\n' % line)
+  if out is not sys.stdout:
+    out.close()
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -27,6 +27,8 @@ MODE_MAX = 6
 # I2C command constants
 I2C_READ = 0x08
 I2C_WRITE = 0x00
+I2C_READ_CONTINUOUSLY = 0x10
+I2C_STOP_READING = 0x18
 
 
 CONST = dict(
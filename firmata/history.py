@@ -0,0 +1,125 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Timestamped history of the values reported for a pin.
+
+`PinHistory` keeps the last `capacity` (timestamp, value) samples of a pin in two preallocated arrays, so recording a
+sample allocates nothing and memory stays fixed however long the board runs. Every sample is written twice, at i and
+i + capacity, which makes any run of up to `capacity` recent samples contiguous. Queries return a `SampleWindow` over
+that run without copying it:
+
+  board.RecordHistory(capacity=4096)
+  ...
+  window = board.History(pin).Since(time.time() - 1)
+  values = window.values()  # A copy, as an array('H').
+  times, values = window.numpy()  # Views of the history itself, if NumPy is installed.
+
+A window is only valid until its samples are overwritten, i.e. until `capacity - len(window)` more samples arrive;
+copy what needs to be kept.
+"""
+
+from array import array
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+# The number of samples a PinHistory keeps by default.
+HISTORY_CAPACITY = 1024
+
+
+class SampleWindow(object):
+  """A read-only run of consecutive samples from a PinHistory, oldest first. Nothing is copied until asked for."""
+  __slots__ = ('_times', '_values', '_start', '_stop')
+
+  def __init__(self, times, values, start, stop):
+    self._times = times
+    self._values = values
+    self._start = start
+    self._stop = stop
+
+  def __len__(self):
+    return self._stop - self._start
+
+  def __getitem__(self, index):
+    """Returns the (timestamp, value) sample at index."""
+    if index < 0:
+      index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError(index)
+    return self._times[self._start + index], self._values[self._start + index]
+
+  def __iter__(self):
+    for i in xrange(self._start, self._stop):
+      yield self._times[i], self._values[i]
+
+  def times(self):
+    """Returns a copy of the timestamps, as an array('d')."""
+    return self._times[self._start:self._stop]
+
+  def values(self):
+    """Returns a copy of the values, as an array('H')."""
+    return self._values[self._start:self._stop]
+
+  def numpy(self):
+    """Returns (timestamps, values) as NumPy arrays sharing memory with the history. Requires NumPy."""
+    if numpy is None:
+      raise ImportError('SampleWindow.numpy requires NumPy')
+    times = numpy.frombuffer(self._times, dtype=numpy.float64)
+    values = numpy.frombuffer(self._values, dtype=numpy.uint16)
+    return times[self._start:self._stop], values[self._start:self._stop]
+
+
+class PinHistory(object):
+  """The last `capacity` values reported for a pin, with the time each arrived.
+
+  Append is called from the board's dispatch thread only. Queries may be made from any thread.
+  """
+  def __init__(self, capacity=HISTORY_CAPACITY):
+    self.capacity = capacity
+    self.total = 0  # Samples appended so far, including overwritten ones.
+    self._times = array('d', [0.0]) * (2 * capacity)
+    self._values = array('H', [0]) * (2 * capacity)
+
+  def __len__(self):
+    return min(self.total, self.capacity)
+
+  def Append(self, timestamp, value):
+    i = self.total % self.capacity
+    self._times[i] = self._times[i + self.capacity] = timestamp
+    self._values[i] = self._values[i + self.capacity] = value
+    self.total += 1
+
+  def Last(self, count=None):
+    """Returns a SampleWindow of the last `count` samples (all of those kept by default)."""
+    total = self.total
+    held = min(total, self.capacity)
+    count = held if count is None else min(count, held)
+    stop = total % self.capacity + self.capacity
+    if total <= self.capacity:
+      stop = total  # Not wrapped yet; the first half alone holds everything.
+    return SampleWindow(self._times, self._values, stop - count, stop)
+
+  def Since(self, timestamp):
+    """Returns a SampleWindow of the kept samples that arrived at or after timestamp."""
+    window = self.Last()
+    low, high = window._start, window._stop
+    while low < high:  # Timestamps are in arrival order, so binary search for the first one >= timestamp.
+      middle = (low + high) // 2
+      if self._times[middle] < timestamp:
+        low = middle + 1
+      else:
+        high = middle
+    return SampleWindow(self._times, self._values, low, window._stop)
@@ -0,0 +1,310 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Serves many boards from a single IO thread.
+
+Every threaded `firmata.Board` runs its own reader, writer and dispatcher threads, each waking up on its own timeout.
+A `BoardHub` instead owns one thread that waits on every board's serial port with a selector, reads and lexes whatever
+arrives, and writes whatever is queued. Tokens are dispatched on the hub thread, or, if the hub has workers, on a small
+pool of dispatch threads so that a slow listener cannot hold up IO for the other boards:
+
+  hub = BoardHub(workers=2)
+  hub.start()
+  boards = [hub.AddBoard(path, 57600) for path in paths]
+  boards[0].digitalWrite(13, 1)
+  ...
+  hub.Shutdown()
+
+A board is always dispatched on the same thread, so its tokens are handled in the order they arrived. HubBoard methods
+may be called from any thread, but the ones that wait for the board (StartCommunications,
+QueryBoardCapabilitiesAndState) must not be called from the hub thread or a worker.
+
+On Python 2 the `selectors` module comes from trollius; if neither is installed `selectors` is None and BoardHub cannot
+be constructed.
+"""
+
+import errno
+import fcntl
+import logging
+import os
+from Queue import Queue
+import threading
+
+try:
+  import selectors
+except ImportError:
+  try:
+    from trollius import selectors
+  except ImportError:
+    selectors = None
+
+from firmata import BaseBoard, FIRMWARE_TIMEOUT, PROBE_INTERVAL, RESET_TIMEOUT
+from firmata.io import NonBlockingPort
+
+
+class _HubPort(NonBlockingPort):
+  """A NonBlockingPort whose Put() may be called from any thread while the hub thread flushes it."""
+  def __init__(self, port, baud, emit, transport=None):
+    NonBlockingPort.__init__(self, port, baud, emit, transport=transport)
+    self._lock = threading.Lock()
+
+  def Put(self, commands):
+    with self._lock:
+      NonBlockingPort.Put(self, commands)
+
+  def Flush(self):
+    with self._lock:
+      return NonBlockingPort.Flush(self)
+
+
+class _Worker(threading.Thread):
+  """Dispatches batches of tokens for the boards assigned to it."""
+  def __init__(self):
+    self.q = Queue()
+    super(_Worker, self).__init__()
+    self.daemon = True
+
+  def run(self):
+    while True:
+      item = self.q.get()
+      if item is None:
+        return
+      board, batch = item
+      board._Dispatch(batch)
+
+
+class HubBoard(BaseBoard):
+  """A board whose serial IO is done by a BoardHub. Obtain one with BoardHub.AddBoard."""
+  def __init__(self, hub, port, baud, transport=None):
+    """Constructs a HubBoard. Nothing is read from the port until StartCommunications is called.
+
+    Args:
+      hub: The BoardHub serving this board.
+      port: The serial port to use. Expressed as either a string or an integer (see pyserial docs for more info.)
+      baud: A number representing the baud rate to use for serial communication.
+      transport: A pySerial compatible object with a fileno() method to use instead of opening `port`.
+    """
+    BaseBoard.__init__(self, _HubPort(port, baud, self._Emit, transport=transport))
+    self.device_id = port
+    self.port.on_write_pending = lambda: hub._RequestFlush(self)
+    self.hub = hub
+    self._lexed = []  # Tokens lexed by the current Read(), not yet handed off for dispatch.
+    self._worker = None
+    self._registered = False
+
+  def _Emit(self, token):
+    self._lexed.append(token)
+
+  def _TakeLexed(self):
+    lexed, self._lexed = self._lexed, []
+    return lexed
+
+  def _Dispatch(self, batch):
+    # Like AsyncBoard, a token that fails to dispatch does not stop the board; the failure is in self.errors.
+    for token in batch:
+      if not self._dispatch(token):
+        self.logger.warning('Unable to dispatch token: %r' % (token,))
+
+  def StartCommunications(self, query_version=False, reset_timeout=RESET_TIMEOUT, firmware_timeout=FIRMWARE_TIMEOUT,
+                          probe_interval=PROBE_INTERVAL):
+    """Registers the port with the hub, then waits for the board to report its firmware. See Board.StartCommunications.
+
+    Raises:
+      HandshakeError: The board did not report its firmware in time. The port stays registered.
+    """
+    handshake = self.firmware_name == 'Unknown'
+    if handshake:
+      self._BeginHandshake()
+    self.hub._Register(self)
+    if handshake:
+      self._FinishHandshake(query_version, reset_timeout, firmware_timeout, probe_interval)
+
+  def StopCommunications(self):
+    """Unregisters the port from the hub and closes it. Unwritten bytes are discarded."""
+    self.hub._Unregister(self)
+    self.port.Close()
+
+
+class BoardHub(threading.Thread):
+  """Does the serial IO for any number of HubBoards from one thread."""
+  def __init__(self, workers=0):
+    """Constructs a BoardHub. Call start() before starting any of its boards.
+
+    Args:
+      workers: An integer. The number of threads to dispatch tokens on. With the default, 0, tokens are dispatched on
+          the hub thread, which is fastest as long as listeners return quickly.
+    """
+    if selectors is None:
+      raise ImportError('BoardHub requires selectors, or trollius on Python 2')
+    self.logger = logging.getLogger()
+    self.boards = []
+    self.shutdown = False
+    self._selector = selectors.DefaultSelector()
+    self._wakeup = os.pipe()
+    for fd in self._wakeup:
+      fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+    self._selector.register(self._wakeup[0], selectors.EVENT_READ, None)
+    self._lock = threading.Lock()
+    self._calls = []  # Callables waiting to be run on the hub thread.
+    self._flush_requests = set()  # Boards whose ports have bytes to write.
+    self._workers = [_Worker() for _ in xrange(workers)]
+    self._next_worker = 0
+    super(BoardHub, self).__init__()
+    self.daemon = True
+
+  def AddBoard(self, port, baud=57600, query_version=False, transport=None, start_serial=True, capability_cache=None):
+    """Adds a board to the hub, like FirmataInit does for a threaded Board.
+
+    Args:
+      port: The serial port to use. Expressed as either a string or an integer (see pyserial docs for more info.)
+      baud: A number representing the baud rate to use for serial communication.
+      query_version: A boolean. If set, commands requesting firmware version are sent instead of depending on the board
+                     to reset on USB connect.
+      transport: A pySerial compatible object with a fileno() method to use instead of opening `port`.
+      start_serial: A boolean. If set (the default), StartCommunications and QueryBoardCapabilitiesAndState are called
+          before returning.
+      capability_cache: A firmata.cache.CapabilityCache for the board's discovery to use, or None (the default).
+
+    Returns:
+      A HubBoard.
+    """
+    board = HubBoard(self, port, baud, transport=transport)
+    board.capability_cache = capability_cache
+    if self._workers:
+      board._worker = self._workers[self._next_worker % len(self._workers)]
+      self._next_worker += 1
+    with self._lock:
+      self.boards.append(board)
+    if start_serial:
+      board.StartCommunications(query_version=query_version)
+      board.QueryBoardCapabilitiesAndState()
+    return board
+
+  def start(self):
+    for worker in self._workers:
+      worker.start()
+    super(BoardHub, self).start()
+
+  def Shutdown(self):
+    """Stops every board, then the hub thread and its workers."""
+    for board in list(self.boards):
+      board.StopCommunications()
+    self.shutdown = True
+    self._Wake()
+    if self.is_alive():
+      self.join()
+    for worker in self._workers:
+      if worker.is_alive():
+        worker.q.put(None)
+        worker.join()
+    self._selector.close()
+    os.close(self._wakeup[0])
+    os.close(self._wakeup[1])
+
+  def _Wake(self):
+    try:
+      os.write(self._wakeup[1], 'x')
+    except OSError, e:
+      if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):  # A full pipe will wake the hub anyway.
+        raise
+
+  def _Call(self, function):
+    """Runs function on the hub thread, and waits for it to finish unless this is the hub thread."""
+    if threading.current_thread() is self or not self.is_alive():
+      function()
+      return
+    done = threading.Event()
+    def Call():
+      function()
+      done.set()
+    with self._lock:
+      self._calls.append(Call)
+    self._Wake()
+    done.wait()
+
+  def _Register(self, board):
+    def Register():
+      if not board._registered:
+        self._selector.register(board.port.fileno(), selectors.EVENT_READ, board)
+        board._registered = True
+        self._Flush(board)  # Writes whatever was queued before the board was started.
+    self._Call(Register)
+
+  def _Unregister(self, board):
+    def Unregister():
+      if board._registered:
+        self._selector.unregister(board.port.fileno())
+        board._registered = False
+      with self._lock:
+        self._flush_requests.discard(board)
+        if board in self.boards:
+          self.boards.remove(board)
+    self._Call(Unregister)
+
+  def _RequestFlush(self, board):
+    with self._lock:
+      self._flush_requests.add(board)
+    if threading.current_thread() is not self:
+      self._Wake()
+
+  def _Flush(self, board):
+    if not board._registered:
+      return
+    events = selectors.EVENT_READ
+    if not board.port.Flush():
+      events |= selectors.EVENT_WRITE  # Finish the write when the port can take more.
+    if self._selector.get_key(board.port.fileno()).events != events:
+      self._selector.modify(board.port.fileno(), events, board)
+
+  def _Read(self, board):
+    try:
+      board.port.Read()
+    except (OSError, IOError), e:
+      self.logger.error('Read from board failed, closing: %s' % e)
+      board.StopCommunications()
+      return
+    if board._lexed:
+      if board._worker:
+        board._worker.q.put((board, board._TakeLexed()))
+      else:
+        board._Dispatch(board._TakeLexed())
+
+  def _RunPending(self):
+    try:
+      while os.read(self._wakeup[0], 4096):
+        pass
+    except OSError, e:
+      if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+        raise
+    with self._lock:
+      calls, self._calls = self._calls, []
+    for call in calls:
+      call()
+
+  def run(self):
+    """Waits for any port to become readable or writable and serves it, until Shutdown is called."""
+    while not self.shutdown:
+      for key, events in self._selector.select():
+        board = key.data
+        if board is None:
+          self._RunPending()
+          continue
+        if events & selectors.EVENT_READ and board._registered:
+          self._Read(board)
+        if events & selectors.EVENT_WRITE:
+          self._Flush(board)
+      if self._flush_requests:
+        with self._lock:
+          requests, self._flush_requests = self._flush_requests, set()
+        for board in requests:
+          self._Flush(board)
@@ -11,44 +11,210 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from Queue import Queue, Empty
+import collections
+import errno
+import fcntl
+import os
+from Queue import Empty, Full
+import select
 import serial
 import threading
 import time
 
+from firmata.capture import CAPTURE_QUEUE_SIZE, DIRECTION_IN, DIRECTION_OUT, FormatBytes, SerialCapture
 from firmata.constants import *
+from firmata.lexer import TableLexer
+from firmata.metrics import LATENCY_SAMPLE_EVERY
+from firmata.profiling import STAGE_LEX, STAGE_READ
+from firmata.queues import BLOCK, DROP_NEWEST, DROP_OLDEST, RAISE, BoundedQueue
+from firmata import tokens
 
 
 READER_TIMEOUT = 0.2
 
+# Strategies SerialReader can use to wait for incoming bytes.
+READER_SLEEP = 'sleep'  # Poll inWaiting(), sleeping READER_TIMEOUT between polls.
+READER_SELECT = 'select'  # Block in select() on the port's file descriptor until bytes arrive.
+READER_BLOCKING = 'blocking'  # Block in read() with a read timeout of READER_TIMEOUT.
+
+# The most bytes SerialReader will pull off the port in one read.
+READ_CHUNK_SIZE = 4096
+
+# The size at which SerialWriter stops adding commands to a batch and writes it.
+WRITE_BATCH_SIZE = 4096
+
+# Lexer engines SerialReader can use.
+LEXER_PIKE = 'pike'  # The byte at a time state machine implemented by SerialReader itself.
+LEXER_TABLE = 'table'  # firmata.lexer.TableLexer, which lexes whole chunks at a time.
+
+# Overflow policies of a bounded reader queue, by token type. Other tokens wait for room. See firmata.queues.
+READER_OVERFLOW = {'ANALOG_MESSAGE': DROP_OLDEST}
+
 
 class SerialLogger(threading.Thread):
   """Implements threadsafe logging for use with the serial port threads"""
-  def __init__(self, path):
+  def __init__(self, path, max_queued=0, overflow=DROP_NEWEST, on_high_water=None):
+    """Constructs a SerialLogger.
+
+    Args:
+      path: A string. The file to log to. It is truncated if it exists.
+      max_queued: An integer. The most chunks that may wait to be logged, or 0 (the default) for no limit.
+      overflow: What to do with a chunk logged when max_queued are waiting. See firmata.queues.
+      on_high_water: Called with ('logger', depth) when the queue is nearly full. See firmata.queues.
+    """
     self._file = open(path, 'w')
-    self.q = Queue()
+    self.q = BoundedQueue(max_queued, overflow, name='logger', on_high_water=on_high_water)
     super(SerialLogger, self).__init__()
 
+  def Log(self, direction, data):
+    """Queues a chunk of bytes read (DIRECTION_IN) or written (DIRECTION_OUT) to be logged."""
+    self.q.put((direction, bytes(data)))
+
+  def Close(self):
+    """Writes out everything queued so far, closes the file and stops the thread."""
+    self.q.put(None)
+    self.join()
+
   def run(self):
     """Consumes logging events from the queue and writes them to a file. `None` event is a signal to quit."""
     while True:
       event = self.q.get()
       if event is None:
         break
-      self._file.write('%s\n' % event)
+      for line in FormatBytes(*event):
+        self._file.write('%s\n' % line)
       self._file.flush()
       self.q.task_done()
     self._file.close()
 
 
+class _PendingWrite(object):
+  """A pin or port write waiting in a coalescing SerialWriter's queue. Newer values replace `commands` in place."""
+  __slots__ = ('key', 'commands')
+
+  def __init__(self, key, commands):
+    self.key = key
+    self.commands = commands
+
+
 class SerialWriter(threading.Thread):
-  """Writes bytes from a queue to the serial port."""
-  def __init__(self, port, log):
+  """Writes bytes from a queue to the serial port.
+
+  Everything waiting on the queue when the writer wakes up is combined into a single write() call.
+  """
+  def __init__(self, port, log, max_latency=0, max_bytes=WRITE_BATCH_SIZE, coalesce=False, max_queued=0,
+               overflow=BLOCK, on_high_water=None):
+    """Constructs a SerialWriter.
+
+    Args:
+      port: A pySerial compatible port object.
+      log: A SerialLogger or SerialCapture to log writes to, or None for no logging.
+      max_latency: A number. Seconds to keep waiting for more commands to add to a batch before writing it. The default,
+          0, writes as soon as the queue is empty.
+      max_bytes: An integer. A batch is written as soon as it holds at least this many bytes.
+      coalesce: A boolean. If set, a pin or port write passed to Put() replaces one for the same pin or port that is
+          still waiting in the queue, rather than being queued behind it.
+      max_queued: An integer. The most commands that may wait to be written, or 0 (the default) for no limit.
+      overflow: What Put() does when max_queued commands are waiting: BLOCK (the default) or RAISE Queue.Full, or
+          DROP_OLDEST or DROP_NEWEST if not coalescing. See firmata.queues.
+      on_high_water: Called with ('writer', depth) when the queue is nearly full. See firmata.queues.
+
+    Raises:
+      ValueError: A DROP policy was combined with coalesce, which keeps references to queued writes.
+    """
+    if coalesce and overflow in (DROP_OLDEST, DROP_NEWEST):
+      raise ValueError('Coalesced writes cannot be dropped')
     self._port = port
     self._log = log
-    self.q = Queue()
+    self.q = BoundedQueue(max_queued, overflow, name='writer', on_high_water=on_high_water)
+    self.max_latency = max_latency
+    self.max_bytes = max_bytes
+    self.coalesce = coalesce
+    self._pending = {}  # Maps the command byte of each queued pin or port write to its _PendingWrite.
+    self._pending_lock = threading.Lock()
+    self._batch = bytearray()
+    self.batches = 0
+    self.bytes_written = 0
+    self.coalesced = 0
     super(SerialWriter, self).__init__()
 
+  def Put(self, commands):
+    """Queues commands to be written to the port.
+
+    When coalescing, ANALOG_MESSAGE and DIGITAL_MESSAGE writes are last-writer-wins per pin or port. Every other
+    command is a barrier: it is never reordered, and writes queued after it are never merged into writes before it.
+
+    Args:
+      commands: An integer or a list of integers, the bytes to write.
+    """
+    if not self.coalesce:
+      self.q.put(commands)
+      return
+    with self._pending_lock:
+      if type(commands) == list and len(commands) == 3 and (commands[0] & 0xF0) in (ANALOG_MESSAGE, DIGITAL_MESSAGE):
+        pending = self._pending.get(commands[0])
+        if pending is not None:
+          pending.commands = commands
+          self.coalesced += 1
+          return
+        pending = self._pending[commands[0]] = _PendingWrite(commands[0], commands)
+        try:
+          self.q.put(pending)
+        except Full:
+          del self._pending[commands[0]]  # Never queued, so later writes must not be merged into it.
+          raise
+      else:
+        self._pending.clear()
+        self.q.put(commands)
+
+  @property
+  def average_batch_size(self):
+    """The mean number of bytes per write() so far."""
+    return float(self.bytes_written) / self.batches if self.batches else 0.0
+
+  def _Add(self, commands):
+    if type(commands) == _PendingWrite:
+      with self._pending_lock:
+        if self._pending.get(commands.key) is commands:
+          del self._pending[commands.key]
+        commands = commands.commands
+    if type(commands) == int:
+      self._batch.append(commands)
+    else:
+      self._batch.extend(commands)
+    self.q.task_done()
+
+  def _Gather(self):
+    """Adds queued commands to the batch until the flush policy says to write it.
+
+    Returns:
+      True if the `None` shutdown signal was taken off the queue.
+    """
+    deadline = time.time() + self.max_latency
+    while len(self._batch) < self.max_bytes:
+      try:
+        if self.max_latency:
+          remaining = deadline - time.time()
+          if remaining <= 0:
+            break
+          commands = self.q.get(timeout=remaining)
+        else:
+          commands = self.q.get_nowait()
+      except Empty:
+        break
+      if commands is None:
+        return True
+      self._Add(commands)
+    return False
+
+  def _Flush(self):
+    self._port.write(bytes(self._batch))
+    if self._log:
+      self._log.Log(DIRECTION_OUT, self._batch)
+    self.batches += 1
+    self.bytes_written += len(self._batch)
+    del self._batch[:]
+
   def run(self):
     """Writes all the bytes from `q` to the serial port, aborting if it encounters `None` on the queue"""
     self._port.flushOutput()
@@ -56,15 +222,11 @@ class SerialWriter(threading.Thread):
       commands = self.q.get()
       if commands is None:
         return
-      if type(commands) == int:
-        commands = [commands]
-      if type(commands) != list:
-        commands = list(commands)
-      self._port.write(''.join([chr(command) for command in commands]))
-      for command in commands:
-        if self._log:
-          self._log.put('>> %s (%s)' % (hex(command), CONST_R.get(command, 'UNKNOWN')))
-      self.q.task_done()
+      self._Add(commands)
+      shutdown = self._Gather()
+      self._Flush()
+      if shutdown:
+        return
 
 
 class Error(Exception): pass
@@ -72,39 +234,132 @@ class ShutdownException(Error): pass
 class LexerException(Error): pass
 
 
+def _TokenType(token):
+  return token['token']
+
+
 class SerialReader(threading.Thread):
   """A serial port reader.
 
   Includes a lexer to convert byte sequences into Firmata protocol objects. The lexer is implemented in Rob Pike's
   handwritten style.
   """
-  def __init__(self, port, log):
+  def __init__(self, port, log, mode=None, lexer=LEXER_PIKE, max_queued=0, overflow=None, on_high_water=None):
+    """Constructs a SerialReader.
+
+    Args:
+      port: A pySerial compatible port object.
+      log: A SerialLogger or SerialCapture to log reads to, or None for no logging.
+      mode: One of READER_SLEEP, READER_SELECT or READER_BLOCKING, selecting how the reader waits for bytes to arrive.
+          Defaults to READER_SELECT if the port has a file descriptor, and READER_SLEEP otherwise.
+      lexer: LEXER_PIKE (the default) or LEXER_TABLE, selecting the lexer engine.
+      max_queued: An integer. The most tokens that may wait to be dispatched, or 0 (the default) for no limit.
+      overflow: A dict mapping token types to what to do with them when max_queued tokens are waiting, DROP_OLDEST,
+          DROP_NEWEST or BLOCK. Added to READER_OVERFLOW. See firmata.queues.
+      on_high_water: Called with ('reader', depth) from the reader thread when the queue is nearly full.
+
+    Raises:
+      ValueError: A policy is RAISE. Nothing but the reader thread itself would see the exception.
+    """
+    policies = dict(READER_OVERFLOW)
+    policies.update(overflow or {})
+    if RAISE in policies.values():
+      raise ValueError('The reader queue cannot raise on overflow; use BLOCK or a DROP policy')
     self._port = port
     self._log = log
-    self.q = Queue()
-    self._pushback = []
+    self.q = BoundedQueue(max_queued, BLOCK, policies, classify=_TokenType, name='reader', on_high_water=on_high_water)
+    self._put = self.q.put  # Where Emit sends tokens; swapped by SetDispatch.
+    self._dispatch = None
+    self._batch = []
+    self.bytes_read = 0
+    self.lex_errors = 0  # Counters for the pike lexer, like TableLexer's.
+    self.lex_recoveries = 0
+    self.lex_skipped = 0
+    self.emitted = 0  # Tokens put on q so far.
+    self.lex_marks = collections.deque(maxlen=1024)  # (seq, time.time()) for every LATENCY_SAMPLE_EVERYth token.
+    self._buffer = bytearray(READ_CHUNK_SIZE)
+    self._pos = 0
+    self._end = 0
+    self._wakeup = None
+    self._wakeup_lock = threading.Lock()
     self.shutdown = False
     self.stopped = True
     self.i2c_reply_ready = threading.Event()
+    if mode is None:
+      mode = READER_SELECT if hasattr(port, 'fileno') else READER_SLEEP
+    if mode == READER_BLOCKING:
+      self._port.timeout = READER_TIMEOUT
+    self.mode = mode
+    self.lexer = lexer
+    self._table_lexer = None  # Created when the thread starts.
+    self._Read = self._unprofiled_read = {
+        READER_SLEEP: self._ReadSleep,
+        READER_SELECT: self._ReadSelect,
+        READER_BLOCKING: self._ReadBlocking,
+    }[mode]
+    self.profile_marks = None  # (seq, time queued) for each token sampled by the profiler, oldest first.
+    self._lex_start = 0
     super(SerialReader, self).__init__()
 
+  def Shutdown(self):
+    """Asks the reader thread to stop, waking it up if it is blocked waiting for bytes."""
+    self.shutdown = True
+    with self._wakeup_lock:
+      if self._wakeup:
+        os.write(self._wakeup[1], 'x')
+
+  def _ReadAvailable(self):
+    available = self._port.inWaiting()
+    if available > 0:
+      return self._port.read(min(available, READ_CHUNK_SIZE))
+    return None
+
+  def _ReadSleep(self):
+    runes = self._ReadAvailable()
+    if not runes:
+      time.sleep(READER_TIMEOUT)
+    return runes
+
+  def _ReadSelect(self):
+    runes = self._ReadAvailable()
+    if not runes:
+      readable, _, _ = select.select([self._port, self._wakeup[0]], [], [], READER_TIMEOUT)
+      if self._port in readable:
+        runes = self._ReadAvailable()
+    return runes
+
+  def _ReadBlocking(self):
+    runes = self._port.read()
+    if runes:
+      available = self._port.inWaiting()
+      if available > 0:
+        runes += self._port.read(min(available, READ_CHUNK_SIZE - 1))
+    return runes
+
+  def _Fill(self):
+    """Blocks until bytes are available, then reads everything waiting (up to READ_CHUNK_SIZE) into the buffer."""
+    if self._batch:  # Everything from the last read has been lexed.
+      self._DispatchBatch()
+    runes = None
+    while not runes:
+      if self.shutdown:
+        raise ShutdownException()
+      runes = self._Read()
+    count = len(runes)
+    self.bytes_read += count
+    self._buffer[:count] = runes
+    self._pos = 0
+    self._end = count
+    if self._log:
+      self._log.Log(DIRECTION_IN, runes)
+
   def Next(self, no_high=True):
     if self.shutdown:
       return None
-    if not self._pushback:
-      runes = None
-      while not runes:
-        if self.shutdown:
-          raise ShutdownException()
-        if self._port.inWaiting() > 0:
-          runes = self._port.read()
-        else:
-          time.sleep(READER_TIMEOUT)
-      self._pushback = [ord(rune) for rune in reversed(runes)]
-      if self._log:
-        for rune in self._pushback:
-          self._log.put('<< %s (%s)' % (hex(rune), CONST_R.get(rune, 'UNKNOWN')))
-    rune = self._pushback.pop()
+    if self._pos == self._end:
+      self._Fill()
+    rune = self._buffer[self._pos]
+    self._pos += 1
     if no_high and rune > 0x80 and rune != SYSEX_END:
       raise LexerException(self.Error('Unexpected byte with high bit set: %s. Attempting recovery.' % rune))
     return rune
@@ -115,20 +370,61 @@ class SerialReader(threading.Thread):
     return rune
 
   def Backup(self, rune):
-    self._pushback.append(rune)
+    if rune is None:
+      return
+    self._pos -= 1
+    self._buffer[self._pos] = rune
 
   def Emit(self, token):
-    self.q.put(token)
+    self.emitted += 1
+    token.seq = self.emitted  # So that marks of tokens dropped from q can be told from those still to come.
+    if not self.emitted % LATENCY_SAMPLE_EVERY:
+      self.lex_marks.append((self.emitted, time.time()))
+    self._put(token)
+
+  def SetDispatch(self, dispatch, batched=False):
+    """Has this thread dispatch tokens itself instead of queueing them on q, or with dispatch None, go back to queueing.
+
+    Args:
+      dispatch: A callable taking a token and returning False to stop the reader, like Board.DispatchToken, or None.
+      batched: A boolean. If set, the tokens lexed from each read are dispatched together once all have been lexed,
+          rather than each as soon as it is.
+    """
+    self._dispatch = dispatch
+    if dispatch is None:
+      self._put = self.q.put
+    elif batched:
+      self._put = self._batch.append
+    else:
+      self._put = self._DispatchOne
+
+  def _DispatchOne(self, token):
+    if not self._dispatch(token):
+      self.shutdown = True
+
+  def _DispatchBatch(self):
+    dispatch = self._dispatch
+    for token in self._batch:
+      if not dispatch(token):
+        self.shutdown = True
+        break
+    del self._batch[:]
 
   def Error(self, message):
-    self.Emit(dict(token='ERROR', message=message))
+    self.lex_errors += 1
+    self.Emit(tokens.ErrorMessage(message))
     return self.lexErrorRecover
 
   def lexErrorRecover(self):
-    while self.Peek(False) > 0x80:  # Loop until next stanza (data internal to a command never has the high bit set).
+    skipped = 0
+    while self.Peek(False) < 0x80:  # Loop until next stanza (data internal to a command never has the high bit set).
       self.Next(False)
+      skipped += 1
     if self.Peek(False) == SYSEX_END:  # Discard the SYSEX_END (if present) of a corrupted command.
       self.Next(False)
+      skipped += 1
+    self.lex_recoveries += 1
+    self.lex_skipped += skipped
     return self.lexInitial
 
   def lexReservedCommand(self):
@@ -137,7 +433,7 @@ class SerialReader(threading.Thread):
     while rune != SYSEX_END:
       data.append(rune)
       rune = self.Next()
-    self.Emit(dict(token='RESERVED_COMMAND', data=data))
+    self.Emit(tokens.ReservedCommand(data))
     return self.lexInitial
 
   def lexReportFirmware(self):
@@ -148,7 +444,7 @@ class SerialReader(threading.Thread):
       rune_msb = self.Next()
       name.append(chr((rune_msb << 7) + rune_lsb))
       rune_lsb = self.Next()
-    self.Emit(dict(token='REPORT_FIRMWARE', major=major, minor=minor, name=''.join(name)))
+    self.Emit(tokens.ReportFirmware(major, minor, ''.join(name)))
     return self.lexInitial
 
   def lexAnalogMappingResponse(self):
@@ -157,7 +453,7 @@ class SerialReader(threading.Thread):
     while rune != SYSEX_END:
       pin_channels.append(rune if rune != 127 else False)
       rune = self.Next()
-    self.Emit(dict(token='ANALOG_MAPPING_RESPONSE', channels=pin_channels))
+    self.Emit(tokens.AnalogMappingResponse(pin_channels))
     return self.lexInitial
 
   def lexCapabilityResponse(self):
@@ -171,19 +467,17 @@ class SerialReader(threading.Thread):
         mode = self.Next()
       pins.append(pin)
       rune = self.Next()
-    self.Emit(dict(token='CAPABILITY_RESPONSE', pins=pins))
+    self.Emit(tokens.CapabilityResponse(pins))
     return self.lexInitial
 
   def lexPinStateResponse(self):
     pin, mode = self.Next(), self.Next()
     data = []
-    token = dict(token='PIN_STATE_RESPONSE', pin=pin, mode=mode, data=[])
     rune = self.Next()
     while rune != SYSEX_END:
       data.append(rune)
       rune = self.Next()
-    token['data'] = sum([data[i] << (7 * i) for i in xrange(len(data))])
-    self.Emit(token)
+    self.Emit(tokens.PinStateResponse(pin, mode, sum([data[i] << (7 * i) for i in xrange(len(data))])))
     return self.lexInitial
 
   def lexI2cReply(self):
@@ -200,7 +494,7 @@ class SerialReader(threading.Thread):
       rune_msb = self.Next()
       data.append((rune_msb << 7) + rune_lsb)
       rune_lsb = self.Next()
-    self.Emit(dict(token='I2C_REPLY', addr=addr, reg=reg, data=data))
+    self.Emit(tokens.I2cReply(addr, reg, data))
     return self.lexInitial
 
   def lexSysex(self):
@@ -225,22 +519,17 @@ class SerialReader(threading.Thread):
 
   def lexAnalogMessage(self):
     command, lsb, msb = self.Next(False), self.Next(), self.Next()
-    self.Emit(dict(token='ANALOG_MESSAGE', pin=(command-0xE0), value=(msb << 7) + lsb))
+    self.Emit(tokens.AnalogMessage(command - 0xE0, (msb << 7) + lsb))
     return self.lexInitial
 
   def lexDigitalMessage(self):
     command, lsb, msb = self.Next(False), self.Next(), self.Next()
-    bitmask = (msb << 7) + lsb
-    token_dict = dict(token='DIGITAL_MESSAGE', port=(command-0x90), pins=[])
-    for pin_num in xrange(8):
-      token_dict['pins'].append((bitmask % 2) == 1)
-      bitmask = bitmask >> 1
-    self.Emit(token_dict)
+    self.Emit(tokens.DigitalMessage(command - 0x90, (msb << 7) + lsb))
     return self.lexInitial
 
   def lexProtocolVersion(self):
     major, minor = self.Next(), self.Next()
-    self.Emit(dict(token='PROTOCOL_VERSION', major=major, minor=minor))
+    self.Emit(tokens.ProtocolVersion(major, minor))
     return self.lexInitial
 
   def lexStringData(self):
@@ -250,7 +539,7 @@ class SerialReader(threading.Thread):
       char_msb = self.Next()
       message += chr(char_lsb + (char_msb << 7))
       char_lsb = self.Next()
-    self.Emit(dict(token='STRING_MESSAGE', message=message))
+    self.Emit(tokens.StringMessage(message))
     return self.lexInitial
 
   def lexInitial(self):
@@ -264,12 +553,28 @@ class SerialReader(threading.Thread):
       return self.lexProtocolVersion
     if rune == SYSEX_START:
       return self.lexSysex
+    self.Next(False)
     return self.Error('State Initial could not determine where to go from here given rune %s (%s)' % (hex(rune),
         CONST_R.get(rune, 'UNKNOWN')))
 
   def run(self):
     self._port.flushInput()
+    if self.mode == READER_SELECT:
+      self._wakeup = os.pipe()
     self.stopped = False
+    if self.lexer == LEXER_TABLE:
+      self._RunTableLexer()
+    else:
+      self._RunPikeLexer()
+    with self._wakeup_lock:
+      if self._wakeup:
+        os.close(self._wakeup[0])
+        os.close(self._wakeup[1])
+        self._wakeup = None
+    self.stopped = True
+
+
+  def _RunPikeLexer(self):
     state = self.lexInitial
     while not self.shutdown:
       if state is None:
@@ -280,12 +585,56 @@ class SerialReader(threading.Thread):
         state = e.message
       except ShutdownException:
         break
-    self.stopped = True
+
+  def _RunTableLexer(self):
+    lexer = self._table_lexer = TableLexer(self.Emit)
+    while not self.shutdown:
+      try:
+        self._Fill()
+      except ShutdownException:
+        break
+      lexer.Feed(self._buffer[:self._end])
+
+  def SetProfiler(self, hook, sample_every):
+    """Swaps in (or with hook None, out) read and emit functions that time reads and lexing. See firmata.profiling."""
+    self.__dict__.pop('Emit', None)
+    self._Read = self._unprofiled_read
+    self.profile_marks = None
+    if hook is not None:
+      read, emit, clock = self._Read, self.Emit, time.time
+      marks = self.profile_marks = collections.deque(maxlen=1024)
+      def ProfiledRead():
+        start = clock()
+        runes = read()
+        if runes:
+          hook(STAGE_READ, None, clock() - start)
+        self._lex_start = clock()
+        return runes
+      def ProfiledEmit(token):
+        seq = self.emitted + 1  # The one emit is about to give token.
+        if not seq % sample_every:
+          hook(STAGE_LEX, token['token'], clock() - self._lex_start)
+          marks.append((seq, clock()))
+        emit(token)
+        self._lex_start = clock()
+      self._Read = ProfiledRead
+      self.Emit = ProfiledEmit
+    if self._table_lexer:
+      self._table_lexer._emit = self.Emit
+
+  def Stats(self):
+    """Returns the reader's bytes_in and lexer counters, in the form of BaseBoard.Stats."""
+    lexer = self._table_lexer or self
+    return {'bytes_in': self.bytes_read, 'lexer_errors': lexer.lex_errors, 'lexer_recoveries': lexer.lex_recoveries,
+            'lexer_skipped_bytes': lexer.lex_skipped}
 
 
 class SerialPort(object):
   """Represents a serial port that knows how the Firmata protocol works."""
-  def __init__(self, port, baud, log_to_file=None, start_serial=True):
+  def __init__(self, port, baud, log_to_file=None, start_serial=True, reader_mode=None, lexer=LEXER_PIKE,
+               max_write_latency=0, max_write_batch=WRITE_BATCH_SIZE, coalesce_writes=False, capture_to_file=None,
+               transport=None, reader_queue_size=0, reader_overflow=None, writer_queue_size=0, writer_overflow=BLOCK,
+               logger_queue_size=None, on_high_water=None):
     """Constructs a SerialPort object.
 
     Args:
@@ -294,19 +643,48 @@ class SerialPort(object):
       log_to_file: A string specifying the file to log serial events to, or None (the default) for no logging.
       start_serial: A boolean controlling whether the serial reader and writer threads are started as part of the
           constructor. Defaults to True.
+      reader_mode: How the reader waits for incoming bytes (see SerialReader). Defaults to the best mode the port
+          supports.
+      lexer: The lexer engine the reader uses, LEXER_PIKE (the default) or LEXER_TABLE.
+      max_write_latency: Seconds the writer may hold back a batch waiting for more commands. Defaults to 0.
+      max_write_batch: The number of bytes at which the writer writes a batch without waiting for more commands.
+      coalesce_writes: A boolean. If set, a pin or port write replaces an older one for the same pin or port that has
+          not been written yet. Defaults to False.
+      capture_to_file: A string specifying a file to record a binary capture of serial traffic to (see
+          firmata.capture), or None (the default) for no capture. Cannot be combined with log_to_file.
+      transport: A pySerial compatible object to use instead of opening `port`, e.g. a firmata.replay.ReplaySerial.
+      reader_queue_size: The most tokens that may wait for the board thread, or 0 (the default) for no limit.
+      reader_overflow: A dict mapping token types to overflow policies for a full reader queue (see SerialReader).
+      writer_queue_size: The most commands that may wait for the writer thread, or 0 (the default) for no limit.
+      writer_overflow: The overflow policy for a full writer queue. Defaults to BLOCK (see SerialWriter).
+      logger_queue_size: The most chunks that may wait to be logged. Defaults to no limit for log_to_file, and to
+          firmata.capture.CAPTURE_QUEUE_SIZE for capture_to_file. Chunks that do not fit are dropped.
+      on_high_water: A callable taking (queue name, depth), called when any of the above queues is nearly full. See
+          firmata.queues.
     """
-    self._port = serial.Serial(port=port, baudrate=baud)
+    assert not (log_to_file and capture_to_file)
+    self.baud = baud
+    self._port = transport if transport is not None else serial.Serial(port=port, baudrate=baud)
     self._logger = None
-    logger_q = None
     if log_to_file:
-      self._logger = SerialLogger(log_to_file)
+      self._logger = SerialLogger(log_to_file, max_queued=logger_queue_size or 0, on_high_water=on_high_water)
+    elif capture_to_file:
+      self._logger = SerialCapture(capture_to_file, max_queued=logger_queue_size or CAPTURE_QUEUE_SIZE,
+                                   on_high_water=on_high_water)
+    if self._logger:
       self._logger.start()
-      logger_q = self._logger.q
-    self.reader = SerialReader(self._port, logger_q)
-    self.writer = SerialWriter(self._port, logger_q)
+    self.reader = SerialReader(self._port, self._logger, mode=reader_mode, lexer=lexer, max_queued=reader_queue_size,
+                               overflow=reader_overflow, on_high_water=on_high_water)
+    self.writer = SerialWriter(self._port, self._logger, max_latency=max_write_latency, max_bytes=max_write_batch,
+                               coalesce=coalesce_writes, max_queued=writer_queue_size, overflow=writer_overflow,
+                               on_high_water=on_high_water)
     if start_serial:
       self.StartCommunications()
 
+  def Put(self, commands):
+    """Queues commands to be written to the port. See SerialWriter.Put."""
+    self.writer.Put(commands)
+
   def StartCommunications(self):
     """Starts the reader and writer threads for this serial port."""
     if not self.reader.is_alive():
@@ -314,16 +692,118 @@ class SerialPort(object):
     if not self.writer.is_alive():
       self.writer.start()
 
+  def Stats(self):
+    """Returns byte and lexer counters and queue depths, in the form of BaseBoard.Stats."""
+    stats = self.reader.Stats()
+    stats['bytes_out'] = self.writer.bytes_written
+    queues = {'reader': self.reader.q, 'writer': self.writer.q}
+    if self._logger:
+      queues['logger'] = self._logger.q
+    stats['queue_depths'] = dict((name, q.qsize()) for name, q in queues.items())
+    stats['queue_overflows'] = dict((name, sum(q.overflows.values())) for name, q in queues.items())
+    return stats
+
   def StopCommunications(self):
     """Stops the reader and writer threads for this serial port."""
-    self.reader.shutdown = True
-    self.writer.q.put(None)
+    self.reader.Shutdown()
+    if self.writer.is_alive():  # A full queue would otherwise wait forever for a writer that is not running.
+      self.writer.q.put(None)
     self.writer.join()
     self.reader.join()
     if self._logger:
-      self._logger.q.put(None)
-      self._logger.join()
+      self._logger.Close()
     self._port.close()
     del self.writer
     del self.reader
     del self._logger
+
+
+class NonBlockingPort(object):
+  """A serial port driven by an event loop instead of threads.
+
+  The port's file descriptor is put in non-blocking mode. The owner watches `fileno()`, calls Read() when it is
+  readable and Flush() when it is writable and `wants_write` is set. Tokens are lexed with the table lexer and handed to
+  `emit` on the caller's thread; commands passed to Put() are buffered until the next Flush().
+  """
+  def __init__(self, port, baud, emit, transport=None):
+    """Constructs a NonBlockingPort object.
+
+    Args:
+      port: String or integer defining a serial port. See pySerial docs for details.
+      baud: An integer specifying the baud rate to use for serial communications.
+      emit: A callable taking one argument, called with each token read from the port.
+      transport: A pySerial compatible object with a fileno() method to use instead of opening `port`.
+    """
+    self.baud = baud
+    self._port = transport if transport is not None else serial.Serial(port=port, baudrate=baud, timeout=0)
+    self._fd = self._port.fileno()
+    flags = fcntl.fcntl(self._fd, fcntl.F_GETFL)
+    fcntl.fcntl(self._fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    self._lexer = TableLexer(emit)
+    self._out = bytearray()
+    self.on_write_pending = None  # Called when Put() adds bytes to an empty output buffer.
+    self.bytes_read = 0
+    self.bytes_written = 0
+
+  def fileno(self):
+    return self._fd
+
+  @property
+  def wants_write(self):
+    """True if there are buffered bytes waiting for Flush()."""
+    return len(self._out) > 0
+
+  def Put(self, commands):
+    """Buffers commands to be written by the next Flush().
+
+    Args:
+      commands: A list of bytes to send to the board.
+    """
+    was_empty = not self._out
+    self._out.extend(commands)
+    if was_empty and self.on_write_pending:
+      self.on_write_pending()
+
+  def Read(self):
+    """Reads whatever bytes are available without blocking and lexes them.
+
+    Returns:
+      The number of bytes read. 0 means nothing was available, or the port reached end of file.
+    """
+    try:
+      data = os.read(self._fd, READ_CHUNK_SIZE)
+    except OSError, e:
+      if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+        return 0
+      raise
+    if data:
+      self.bytes_read += len(data)
+      self._lexer.Feed(data)
+    return len(data)
+
+  def Flush(self):
+    """Writes as much of the output buffer as the port accepts without blocking.
+
+    Returns:
+      True if the output buffer is now empty.
+    """
+    while self._out:
+      try:
+        written = os.write(self._fd, bytes(self._out))
+      except OSError, e:
+        if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+          return False
+        raise
+      del self._out[:written]
+      self.bytes_written += written
+    return True
+
+  def Stats(self):
+    """Returns byte and lexer counters, in the form of BaseBoard.Stats. The port has no queues."""
+    return {'bytes_in': self.bytes_read, 'bytes_out': self.bytes_written, 'lexer_errors': self._lexer.lex_errors,
+            'lexer_recoveries': self._lexer.lex_recoveries, 'lexer_skipped_bytes': self._lexer.lex_skipped,
+            'queue_depths': {}, 'queue_overflows': {}}
+
+  def Close(self):
+    """Closes the underlying port. Unwritten bytes are discarded."""
+    self._port.close()
@@ -0,0 +1,210 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A table-driven Firmata lexer that works on whole buffers.
+
+`TableLexer` produces the same tokens as the state machine in `firmata.io.SerialReader`, but instead of pulling one
+byte at a time it is handed chunks of bytes as they are read from the port. A 256 entry table keyed on the command
+byte selects the handler for each message, sysex bodies are located with `bytearray.find`, and a message split across
+chunks is kept back until the rest of it arrives.
+"""
+
+from firmata.constants import *
+from firmata import tokens
+
+
+_SYSEX_END = bytes(bytearray([SYSEX_END]))
+
+
+def _FindHighByte(buf, start, stop):
+  """Returns the index of the first byte in buf[start:stop] that is not valid message data, or -1 if there is none."""
+  if stop <= start or max(buf[start:stop]) <= 0x80:
+    return -1
+  for i in xrange(start, stop):
+    if buf[i] > 0x80 and buf[i] != SYSEX_END:
+      return i
+  return -1
+
+
+def _DecodePairs(body):
+  """Decodes pairs of 7 bit bytes (lsb first) into a list of 14 bit values. A trailing odd byte is ignored."""
+  return [body[i] + (body[i + 1] << 7) for i in xrange(0, len(body) - 1, 2)]
+
+
+class TableLexer(object):
+  """Converts chunks of bytes into Firmata protocol tokens.
+
+  Error recovery matches `SerialReader.lexErrorRecover`: after an ERROR token, bytes are skipped up to the start of
+  the next command, and a SYSEX_END closing the corrupted command is discarded.
+  """
+  def __init__(self, emit):
+    """Constructs a TableLexer.
+
+    Args:
+      emit: A callable taking one argument, called with each token in the order they are lexed.
+    """
+    self._emit = emit
+    self._pending = None
+    self._recovering = False
+    self.lex_errors = 0  # Malformed messages seen.
+    self.lex_recoveries = 0  # Times the start of a command was found again after one.
+    self.lex_skipped = 0  # Bytes discarded while looking for it.
+    self._table = [self._LexUnknown] * 256
+    for command in xrange(ANALOG_MESSAGE_0, ANALOG_MESSAGE_F + 1):
+      self._table[command] = self._LexAnalogMessage
+    for command in xrange(DIGITAL_MESSAGE_0, DIGITAL_MESSAGE_F + 1):
+      self._table[command] = self._LexDigitalMessage
+    self._table[PROTOCOL_VERSION] = self._LexProtocolVersion
+    self._table[SYSEX_START] = self._LexSysex
+    # Maps sysex commands to (handler, minimum body length).
+    self._sysex_table = {
+        SE_RESERVED_COMMAND: (self._LexReservedCommand, 0),
+        SE_ANALOG_MAPPING_RESPONSE: (self._LexAnalogMappingResponse, 0),
+        SE_CAPABILITY_RESPONSE: (self._LexCapabilityResponse, 0),
+        SE_PIN_STATE_RESPONSE: (self._LexPinStateResponse, 2),
+        SE_I2C_REPLY: (self._LexI2cReply, 4),
+        SE_REPORT_FIRMWARE: (self._LexReportFirmware, 2),
+        SE_STRING_DATA: (self._LexStringData, 0),
+    }
+
+  def Feed(self, data):
+    """Lexes a chunk of bytes, emitting every token it completes.
+
+    Args:
+      data: A str or bytearray of bytes read from the port.
+    """
+    if self._pending:
+      buf = self._pending
+      buf += data
+    else:
+      buf = bytearray(data)
+    pos, end = 0, len(buf)
+    if self._recovering:
+      pos = self._Recover(buf, pos, end)
+    table = self._table
+    while pos < end:
+      next_pos = table[buf[pos]](buf, pos, end)
+      if next_pos == pos:  # The message at pos is incomplete.
+        break
+      pos = next_pos
+    self._pending = buf[pos:] if pos < end else None
+
+  def Error(self, message, buf, pos, end):
+    """Emits an ERROR token and skips to the next command, returning its position."""
+    self.lex_errors += 1
+    self._emit(tokens.ErrorMessage(message))
+    return self._Recover(buf, pos, end)
+
+  def _Recover(self, buf, pos, end):
+    start = pos
+    while pos < end and buf[pos] < 0x80:
+      pos += 1
+    self._recovering = pos == end
+    if pos < end:
+      self.lex_recoveries += 1
+      if buf[pos] == SYSEX_END:
+        pos += 1
+    self.lex_skipped += pos - start
+    return pos
+
+  def _HighByte(self, buf, pos, end):
+    return self.Error('Unexpected byte with high bit set: %s. Attempting recovery.' % buf[pos], buf, pos + 1, end)
+
+  def _LexFixed(self, buf, pos, end, length):
+    """Checks the `length` byte message at pos. Returns True if it is complete, or else a position to resume at."""
+    stop = min(pos + length, end)
+    bad = _FindHighByte(buf, pos + 1, stop)
+    if bad >= 0:
+      return self._HighByte(buf, bad, end)
+    if stop < pos + length:
+      return pos
+    return True
+
+  def _LexUnknown(self, buf, pos, end):
+    rune = buf[pos]
+    return self.Error('State Initial could not determine where to go from here given rune %s (%s)' % (hex(rune),
+        CONST_R.get(rune, 'UNKNOWN')), buf, pos + 1, end)
+
+  def _LexAnalogMessage(self, buf, pos, end):
+    complete = self._LexFixed(buf, pos, end, 3)
+    if complete is not True:
+      return complete
+    self._emit(tokens.AnalogMessage(buf[pos] - 0xE0, (buf[pos + 2] << 7) + buf[pos + 1]))
+    return pos + 3
+
+  def _LexDigitalMessage(self, buf, pos, end):
+    complete = self._LexFixed(buf, pos, end, 3)
+    if complete is not True:
+      return complete
+    self._emit(tokens.DigitalMessage(buf[pos] - 0x90, (buf[pos + 2] << 7) + buf[pos + 1]))
+    return pos + 3
+
+  def _LexProtocolVersion(self, buf, pos, end):
+    complete = self._LexFixed(buf, pos, end, 3)
+    if complete is not True:
+      return complete
+    self._emit(tokens.ProtocolVersion(buf[pos + 1], buf[pos + 2]))
+    return pos + 3
+
+  def _LexSysex(self, buf, pos, end):
+    if pos + 2 > end:
+      return pos
+    command = buf[pos + 1]
+    if command not in self._sysex_table:
+      return self.Error('State Sysex could not determine where to go from here given rune %s (%s)' % (hex(command),
+          CONST_R.get(command, 'UNKNOWN')), buf, pos + 2, end)
+    handler, min_length = self._sysex_table[command]
+    stop = buf.find(_SYSEX_END, pos + 2)
+    bad = _FindHighByte(buf, pos + 2, end if stop < 0 else stop)
+    if bad >= 0:
+      return self._HighByte(buf, bad, end)
+    if stop < 0:
+      return pos
+    if stop - (pos + 2) < min_length:
+      self._emit(tokens.ErrorMessage('Truncated %s message: %s' % (CONST_R[command], repr(buf[pos:stop + 1]))))
+    else:
+      handler(buf[pos + 2:stop])
+    return stop + 1
+
+  def _LexReservedCommand(self, body):
+    self._emit(tokens.ReservedCommand(list(body)))
+
+  def _LexReportFirmware(self, body):
+    name = ''.join(chr(c) for c in _DecodePairs(body[2:]))
+    self._emit(tokens.ReportFirmware(body[0], body[1], name))
+
+  def _LexAnalogMappingResponse(self, body):
+    self._emit(tokens.AnalogMappingResponse([rune if rune != 127 else False for rune in body]))
+
+  def _LexCapabilityResponse(self, body):
+    pins = []
+    i, count = 0, len(body)
+    while i < count:
+      pin = dict()
+      while i + 1 < count and body[i] != 127:
+        pin[body[i]] = body[i + 1]
+        i += 2
+      pins.append(pin)
+      i += 1
+    self._emit(tokens.CapabilityResponse(pins))
+
+  def _LexPinStateResponse(self, body):
+    data = sum([body[i] << (7 * (i - 2)) for i in xrange(2, len(body))])
+    self._emit(tokens.PinStateResponse(body[0], body[1], data))
+
+  def _LexI2cReply(self, body):
+    addr, reg = _DecodePairs(body[:4])
+    self._emit(tokens.I2cReply(addr, reg, _DecodePairs(body[4:])))
+
+  def _LexStringData(self, body):
+    self._emit(tokens.StringMessage(''.join(chr(c) for c in _DecodePairs(body))))
@@ -0,0 +1,163 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""How hard a board's link is working.
+
+Every board keeps a few counters as it runs: bytes read and written, tokens dispatched by type, lexer errors and the
+recoveries from them, and, for a threaded Board, a sampled histogram of the time from lexing a token to dispatching it.
+They are plain integers bumped once per read, write, token or error, cheap enough to leave on. BaseBoard.Stats()
+returns them along with the current queue depths, and token rates since an earlier result:
+
+  stats = board.Stats()
+  ...
+  stats = board.Stats(since=stats)
+  print stats['token_rates']['ANALOG_MESSAGE'], stats['queue_depths']['reader']
+
+For monitoring, ServeMetrics() serves the stats of any number of boards in the Prometheus text format:
+
+  server = ServeMetrics([board], port=9750)
+  ...
+  server.Shutdown()
+"""
+
+import BaseHTTPServer
+import bisect
+import threading
+
+
+# Upper bounds, in seconds, of the dispatch latency histogram's buckets. The last bucket is unbounded.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# The reader timestamps one token in this many for the dispatch latency histogram.
+LATENCY_SAMPLE_EVERY = 64
+
+
+class Histogram(object):
+  """Counts observations into fixed buckets, Prometheus style. Observe is called from one thread only."""
+  def __init__(self, bounds=LATENCY_BUCKETS):
+    self.bounds = bounds
+    self.counts = [0] * (len(bounds) + 1)
+    self.sum = 0.0
+
+  def Observe(self, value):
+    self.counts[bisect.bisect_left(self.bounds, value)] += 1
+    self.sum += value
+
+  def Snapshot(self):
+    """Returns {'buckets': [(upper bound, cumulative count), ...], 'sum': total, 'count': observations}.
+
+    The last bucket's upper bound is float('inf').
+    """
+    buckets = []
+    total = 0
+    for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+      total += count
+      buckets.append((bound, total))
+    return {'buckets': buckets, 'sum': self.sum, 'count': total}
+
+
+def _Labels(**labels):
+  return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                           for name, value in sorted(labels.items()))
+
+
+def _Bound(bound):
+  return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def FormatPrometheus(boards):
+  """Returns the stats of boards in the Prometheus text exposition format, labelled with each board's device_id."""
+  stats = [(str(board.device_id), board.Stats()) for board in boards]
+  lines = []
+  def Metric(name, kind, help_text, samples):
+    lines.append('# HELP %s %s' % (name, help_text))
+    lines.append('# TYPE %s %s' % (name, kind))
+    for suffix, labels, value in samples:
+      lines.append('%s%s%s %s' % (name, suffix, _Labels(**labels), repr(value) if isinstance(value, float) else value))
+  for key, help_text in (('bytes_in', 'Bytes read from the board.'),
+                         ('bytes_out', 'Bytes written to the board.'),
+                         ('lexer_errors', 'Malformed messages from the board.'),
+                         ('lexer_recoveries', 'Times the lexer resynchronized after a malformed message.'),
+                         ('lexer_skipped_bytes', 'Bytes discarded while resynchronizing.'),
+                         ('errors', 'Errors appended to Board.errors.')):
+    Metric('firmata_%s_total' % key, 'counter', help_text,
+           [('', {'board': board}, board_stats[key]) for board, board_stats in stats])
+  Metric('firmata_tokens_total', 'counter', 'Tokens dispatched, by type.',
+         [('', {'board': board, 'type': kind}, count)
+          for board, board_stats in stats for kind, count in sorted(board_stats['tokens'].items())])
+  Metric('firmata_queue_depth', 'gauge', 'Items waiting in each of the board\'s queues.',
+         [('', {'board': board, 'queue': queue}, depth)
+          for board, board_stats in stats for queue, depth in sorted(board_stats['queue_depths'].items())])
+  Metric('firmata_queue_overflows_total', 'counter', 'Items put while the queue was full, and so dropped or delayed.',
+         [('', {'board': board, 'queue': queue}, count)
+          for board, board_stats in stats for queue, count in sorted(board_stats['queue_overflows'].items())])
+  samples = []
+  for board, board_stats in stats:
+    latency = board_stats.get('dispatch_latency')
+    if latency is None:
+      continue
+    for bound, count in latency['buckets']:
+      samples.append(('_bucket', {'board': board, 'le': _Bound(bound)}, count))
+    samples.append(('_sum', {'board': board}, latency['sum']))
+    samples.append(('_count', {'board': board}, latency['count']))
+  Metric('firmata_dispatch_latency_seconds', 'histogram', 'Time from lexing a token to dispatching it, sampled.',
+         samples)
+  return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  def do_GET(self):
+    if self.path.split('?')[0] not in ('/', '/metrics'):
+      self.send_error(404)
+      return
+    body = FormatPrometheus(self.server.boards)
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass  # Scrapes are too frequent to log.
+
+
+class MetricsServer(BaseHTTPServer.HTTPServer):
+  """Serves FormatPrometheus(boards) at /metrics from a daemon thread."""
+  def __init__(self, boards, host='127.0.0.1', port=0):
+    BaseHTTPServer.HTTPServer.__init__(self, (host, port), _MetricsHandler)
+    self.boards = boards
+    self._thread = threading.Thread(target=self.serve_forever)
+    self._thread.daemon = True
+
+  @property
+  def address(self):
+    """The (host, port) being served, useful when port 0 picked a free one."""
+    return self.server_address
+
+  def Shutdown(self):
+    self.shutdown()
+    self.server_close()
+    self._thread.join()
+
+
+def ServeMetrics(boards, host='127.0.0.1', port=0):
+  """Starts serving the stats of boards (a list, which may be added to later) over HTTP. Returns the MetricsServer.
+
+  Args:
+    boards: A list of BaseBoards.
+    host: The address to listen on. Defaults to localhost only.
+    port: The port to listen on. Defaults to any free one; see MetricsServer.address.
+  """
+  server = MetricsServer(boards, host=host, port=port)
+  server._thread.start()
+  return server
@@ -0,0 +1,102 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Where the time goes between the serial port and the board's state.
+
+BaseBoard.SetProfiler(hook) times the stages a token goes through and calls hook(stage, token_type, seconds) for one
+token in every `sample_every`:
+
+  STAGE_READ: a read from the port that returned bytes, including any wait for them (token_type is None). Threaded
+      Boards only, and every read is reported.
+  STAGE_LEX: lexing the token, from the end of the previous token or read. Threaded Boards only.
+  STAGE_HANDOFF: from the reader queueing the token to the dispatch thread taking it off the queue. Threaded Boards
+      only.
+  STAGE_DISPATCH: DispatchToken as a whole, i.e. listeners plus the handler.
+  STAGE_HANDLER: the board's own handling of the token, after its listeners.
+
+Installing a profiler swaps instrumented versions of the reader's read and emit functions and the board's dispatch
+and handlers into place, and SetProfiler(None) swaps the originals back, so a board that is not being profiled runs
+exactly the code it would without this module. FlameCollector is a ready-made hook:
+
+  collector = FlameCollector()
+  board.SetProfiler(collector)
+  ...
+  board.SetProfiler(None)
+  print collector.Summary()
+  open('firmata.folded', 'w').write(collector.Folded())  # For flamegraph.pl.
+"""
+
+import collections
+import threading
+
+
+STAGE_READ = 'read'
+STAGE_LEX = 'lex'
+STAGE_HANDOFF = 'handoff'
+STAGE_DISPATCH = 'dispatch'
+STAGE_HANDLER = 'handler'
+
+# Profile one token in this many by default.
+PROFILE_SAMPLE_EVERY = 16
+
+
+class FlameCollector(object):
+  """A profiler hook that totals the time spent in each stage, per token type."""
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._totals = collections.defaultdict(lambda: [0, 0.0, 0.0])  # (stage, token type) -> [count, total, max].
+
+  def __call__(self, stage, token_type, duration):
+    with self._lock:
+      totals = self._totals[(stage, token_type)]
+      totals[0] += 1
+      totals[1] += duration
+      if duration > totals[2]:
+        totals[2] = duration
+
+  def Totals(self):
+    """Returns a dict mapping (stage, token type) to (samples, total seconds, longest sample in seconds)."""
+    with self._lock:
+      return dict((key, tuple(totals)) for key, totals in self._totals.items())
+
+  def Folded(self):
+    """Returns the totals as folded stacks, one 'frame;frame;... microseconds' line each, as flamegraph.pl reads.
+
+    A token's handler is nested in its dispatch, so the dispatch frame's own time is the time spent in listeners.
+    """
+    totals = self.Totals()
+    stacks = {}
+    for (stage, token_type), (_, total, _) in totals.items():
+      if stage == STAGE_READ:
+        stack = 'reader;read'
+      elif stage == STAGE_LEX:
+        stack = 'reader;lex;%s' % token_type
+      elif stage == STAGE_HANDOFF:
+        stack = 'board;handoff;%s' % token_type
+      elif stage == STAGE_DISPATCH:
+        stack = 'board;dispatch;%s' % token_type
+        total -= totals.get((STAGE_HANDLER, token_type), (0, 0.0, 0.0))[1]
+      else:
+        stack = 'board;dispatch;%s;handler' % token_type
+      stacks[stack] = max(0, int(round(total * 1e6)))
+    return ''.join('%s %d\n' % (stack, micros) for stack, micros in sorted(stacks.items()))
+
+  def Summary(self):
+    """Returns a table of samples, mean, longest and total time per stage and token type, slowest stage first."""
+    rows = sorted(self.Totals().items(), key=lambda (key, totals): -totals[1])
+    grand_total = sum(totals[1] for _, totals in rows) or 1.0
+    lines = ['%-9s %-24s %8s %10s %10s %10s %6s' % ('stage', 'token', 'samples', 'mean us', 'max us', 'total ms', '%')]
+    for (stage, token_type), (count, total, longest) in rows:
+      lines.append('%-9s %-24s %8d %10.1f %10.1f %10.2f %6.1f' % (
+          stage, token_type or '-', count, total / count * 1e6, longest * 1e6, total * 1e3, 100 * total / grand_total))
+    return '\n'.join(lines)
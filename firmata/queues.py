@@ -0,0 +1,142 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Bounded queues between the serial threads, with a policy for what happens when they fill up.
+
+The reader, writer and logger threads hand their work over in queues. Unbounded, a stalled consumer (a listener that
+blocks dispatch, say) lets them grow until the process runs out of memory. A `BoundedQueue` holds at most `maxsize`
+items, and when it is full what happens to a new item depends on the item's class, as given by `classify`:
+
+  DROP_OLDEST: the oldest queued item of a class with this policy is discarded to make room. If there is none, the new
+      item is discarded instead.
+  DROP_NEWEST: the new item is discarded.
+  BLOCK: the oldest queued DROP_OLDEST item is discarded to make room. If there is none, put() waits for room, like
+      Queue.Queue.
+  RAISE: the oldest queued DROP_OLDEST item is discarded to make room. If there is none, put() raises Queue.Full.
+
+On a SerialPort the classes of the reader's queue are token types, so a slow consumer can lose analog samples, whose
+next report supersedes them anyway, while sysex replies hold up the reader until they are taken:
+
+  board = firmata.FirmataInit('/dev/ttyACM0', reader_queue_size=4096,
+                              reader_overflow={'DIGITAL_MESSAGE': DROP_OLDEST}, on_high_water=Alarm)
+
+Every put that finds the queue full is counted in `overflows`, by class. When the queue fills to HIGH_WATER of its
+capacity, on_high_water(name, depth) is called from the thread that put the item, and is not called again until the
+queue has drained to half that. `None`, the threads' shutdown signal, always waits for room and is never dropped.
+"""
+
+from Queue import Queue, Full
+import time
+
+from firmata.stream import BLOCK, DROP_NEWEST, DROP_OLDEST
+
+
+RAISE = 'raise'
+QUEUE_OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK, RAISE)
+
+# The fraction of a bounded queue's capacity at which on_high_water is called.
+HIGH_WATER = 0.75
+
+
+class BoundedQueue(Queue):
+  """A Queue.Queue that applies a per class overflow policy when it is full. See the module docstring."""
+  def __init__(self, maxsize=0, policy=BLOCK, policies=None, classify=None, name=None, on_high_water=None):
+    """Constructs a BoundedQueue.
+
+    Args:
+      maxsize: An integer. The most items the queue holds, or 0 (the default) for no limit.
+      policy: The overflow policy for items whose class has none in policies. Defaults to BLOCK.
+      policies: A dict mapping item classes to overflow policies.
+      classify: A callable returning the class of an item. Only called when the queue is full.
+      name: A string identifying the queue to on_high_water.
+      on_high_water: A callable taking (name, depth), or None.
+
+    Raises:
+      ValueError: A policy is not one of QUEUE_OVERFLOW_POLICIES.
+    """
+    Queue.__init__(self, maxsize)
+    self.policy = policy
+    self.policies = dict(policies or {})
+    for item_policy in [policy] + self.policies.values():
+      if item_policy not in QUEUE_OVERFLOW_POLICIES:
+        raise ValueError('Unknown overflow policy: %r' % (item_policy,))
+    self.classify = classify or (lambda item: None)
+    self._droppable = DROP_OLDEST in [policy] + self.policies.values()  # Whether any queued item may make room.
+    self.name = name
+    self.on_high_water = on_high_water
+    self.overflows = {}  # Item class -> puts that found the queue full.
+    self.dropped = 0  # Items discarded by the DROP policies, queued or not.
+    self._high_water = int(maxsize * HIGH_WATER) if maxsize and on_high_water else 0
+    self._high_water_armed = True
+
+  def _Policy(self, item):
+    if item is None:
+      return BLOCK
+    return self.policies.get(self.classify(item), self.policy)
+
+  def put(self, item, block=True, timeout=None):
+    high_water = False
+    self.not_full.acquire()  # Rather than `with`, which costs two more Python calls on every put.
+    try:
+      if self.maxsize > 0 and len(self.queue) >= self.maxsize and not self._Overflow(item, block, timeout):
+        return
+      self.queue.append(item)
+      self.unfinished_tasks += 1
+      self.not_empty.notify()
+      if self._high_water and self._high_water_armed and len(self.queue) >= self._high_water:
+        self._high_water_armed = False
+        high_water = len(self.queue)
+    finally:
+      self.not_full.release()
+    if high_water:
+      self.on_high_water(self.name, high_water)  # Outside the lock, so it may look at the queue.
+
+  def _Overflow(self, item, block, timeout):
+    """Applies the overflow policy for item to the full queue. Returns whether to queue item. Must hold not_full."""
+    item_class = None if item is None else self.classify(item)
+    self.overflows[item_class] = self.overflows.get(item_class, 0) + 1
+    policy = self._Policy(item)
+    if policy == DROP_NEWEST:
+      self.dropped += 1
+      return False
+    if self._droppable:
+      for i, queued in enumerate(self.queue):
+        if queued is not None and self._Policy(queued) == DROP_OLDEST:
+          del self.queue[i]
+          self.dropped += 1
+          self.unfinished_tasks -= 1  # It will never be taken, let alone done.
+          return True
+    if policy == DROP_OLDEST:
+      self.dropped += 1  # Nothing queued may be dropped, so the new item goes.
+      return False
+    elif policy == RAISE:
+      raise Full
+    self._WaitForRoom(block, timeout)
+    return True
+
+  def _WaitForRoom(self, block, timeout):
+    # Must hold self.not_full. The same wait as Queue.put.
+    if not block:
+      raise Full
+    deadline = None if timeout is None else time.time() + timeout
+    while self._qsize() >= self.maxsize:
+      remaining = None if deadline is None else deadline - time.time()
+      if remaining is not None and remaining <= 0:
+        raise Full
+      self.not_full.wait(remaining)
+
+  def _get(self):
+    item = self.queue.popleft()
+    if not self._high_water_armed and len(self.queue) <= self._high_water // 2:
+      self._high_water_armed = True
+    return item
@@ -0,0 +1,182 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Replays recorded serial traffic through the receive path, with no hardware attached.
+
+`ReplaySerial` is a pySerial-like port that plays back the input side of a recorded session, either as fast as it is
+read or at the pace it was recorded. `Replay` pushes a session through SerialPort, SerialReader and
+Board.DispatchToken and reports how long that took, which makes a repeatable benchmark and regression test:
+
+  board, stats = Replay(ReplaySerial(LoadCapture('session.cap')))
+"""
+
+import time
+
+import firmata
+from firmata import io
+from firmata.capture import DIRECTION_IN, ReadCapture
+
+
+def LoadCapture(path):
+  """Returns the input chunks of a capture file (see firmata.capture) as a list of (offset seconds, data)."""
+  chunks = []
+  start = None
+  for timestamp, direction, data in ReadCapture(path):
+    if direction != DIRECTION_IN:
+      continue
+    if start is None:
+      start = timestamp
+    chunks.append((timestamp - start, bytes(data)))
+  return chunks
+
+
+def LoadBytes(path):
+  """Returns the contents of a plain file of received bytes as a list of chunks, all at offset 0."""
+  with open(path, 'rb') as f:
+    return [(0, f.read())]
+
+
+class ReplaySerial(object):
+  """A pySerial-like port that plays back recorded input. Everything written to it is collected in `written`."""
+  def __init__(self, chunks, realtime=False, stop_at_end=True):
+    """Constructs a ReplaySerial.
+
+    Args:
+      chunks: A list of (offset seconds, data) tuples, as returned by LoadCapture or LoadBytes.
+      realtime: A boolean. If set, each chunk only becomes readable `offset` seconds after the first read, as it did
+          when it was recorded. Otherwise everything is readable at once.
+      stop_at_end: A boolean. If set, once everything has been read the SerialReader using the port is stopped.
+    """
+    self._data = ''.join(data for _, data in chunks)
+    self._ends = []  # (offset, position in _data at which the chunk ends)
+    end = 0
+    for offset, data in chunks:
+      end += len(data)
+      self._ends.append((offset, end))
+    self._pos = 0
+    self._start = None
+    self.realtime = realtime
+    self._stop_at_end = stop_at_end
+    self.timeout = None
+    self.written = []
+
+  @property
+  def bytes_read(self):
+    return self._pos
+
+  @property
+  def exhausted(self):
+    """True once every recorded byte has been read."""
+    return self._pos == len(self._data)
+
+  def _Available(self):
+    if not self.realtime:
+      return len(self._data) - self._pos
+    if self._start is None:
+      self._start = time.time()
+    elapsed = time.time() - self._start
+    end = 0
+    for offset, chunk_end in self._ends:
+      if offset > elapsed:
+        break
+      end = chunk_end
+    return end - self._pos
+
+  def _NextOffset(self):
+    for offset, chunk_end in self._ends:
+      if chunk_end > self._pos:
+        return offset
+    return None
+
+  def inWaiting(self):
+    if self.exhausted and self._stop_at_end:
+      raise io.ShutdownException()
+    return self._Available()
+
+  def read(self, size=1):
+    """Reads up to `size` bytes, waiting up to `timeout` seconds (forever if None) for the first to become available."""
+    if self.exhausted and self._stop_at_end:
+      raise io.ShutdownException()
+    available = self._Available()
+    if not available and not self.exhausted:
+      wait = self._NextOffset() - (time.time() - self._start)
+      if self.timeout is not None:
+        wait = min(wait, self.timeout)
+      time.sleep(max(wait, 0))
+      available = self._Available()
+    size = min(size, available)
+    ret = self._data[self._pos:self._pos + size]
+    self._pos += size
+    return ret
+
+  def write(self, data):
+    self.written.append(data)
+
+  def flushInput(self):
+    pass
+
+  def flushOutput(self):
+    pass
+
+  def close(self):
+    pass
+
+
+class ReplayStats(object):
+  """The outcome of a Replay."""
+  def __init__(self, bytes_read, tokens, seconds):
+    self.bytes_read = bytes_read
+    self.tokens = tokens
+    self.seconds = seconds
+
+  @property
+  def bytes_per_second(self):
+    return self.bytes_read / self.seconds if self.seconds else 0.0
+
+  @property
+  def tokens_per_second(self):
+    return self.tokens / self.seconds if self.seconds else 0.0
+
+
+def Replay(port, **port_options):
+  """Plays a ReplaySerial through SerialPort, SerialReader and Board.DispatchToken until it runs out.
+
+  Args:
+    port: A ReplaySerial with stop_at_end set.
+    port_options: Any other keyword arguments are passed on to the `Board` constructor (e.g. lexer or dispatch_mode).
+        Realtime replays default to the READER_BLOCKING reader mode so that chunks are picked up as soon as they are
+        due.
+
+  Returns:
+    A (board, ReplayStats) tuple. The board's state reflects every token in the session.
+  """
+  if port.realtime:
+    port_options.setdefault('reader_mode', io.READER_BLOCKING)
+  board = firmata.Board(None, 0, start_serial=False, transport=port, **port_options)
+  reader = board.port.reader
+  tokens = [0]
+  emit = reader.Emit
+  def CountingEmit(token):
+    tokens[0] += 1
+    emit(token)
+  reader.Emit = CountingEmit
+  start = time.time()
+  board._StartDispatch()
+  board.port.StartCommunications()
+  reader.join()
+  if board.dispatch_mode == firmata.DISPATCH_THREAD:
+    reader.q.put(None)  # Stops the board thread once it has dispatched everything before it.
+    board.join()
+  elapsed = time.time() - start
+  board.StopCommunications()
+  return board, ReplayStats(port.bytes_read, tokens[0], elapsed)
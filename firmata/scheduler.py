@@ -0,0 +1,243 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Fits a board's pin reporting into what its serial link can carry.
+
+Firmata reports every enabled analog channel once per sampling interval, three bytes each, and every enabled digital
+port whenever one of its inputs changes, also three bytes each. At 57600 baud (about 5760 bytes a second) sixteen
+channels every 10ms already need 4800 of them. Asking for more than the link carries does not fail; reports just arrive
+late, and the lexer starts recovering from corrupted messages. A `ReportingScheduler` works out a configuration that
+fits instead, from the rate wanted for each channel:
+
+  scheduler = board.ScheduleReporting({0: 100, 1: 100, 2: 10}, digital={1: 20})
+  ...
+  print scheduler.Rates()  # {('ANALOG_MESSAGE', 0): (expected, measured), ...}
+
+It picks the sampling interval for the fastest channel. If the link cannot carry every channel at that rate at once,
+it rotates channels in and out of reporting in short slots, so that each is enabled for the share of the time its rate
+needs. If even that does not fit, the configuration is rejected with ReportingBudgetError, or, with degrade=True, every
+analog rate is scaled down until it does. Digital rates are the expected rates of change of each port; they cannot be
+controlled from the host, so they are only counted against the budget.
+"""
+
+import math
+import threading
+import time
+
+
+# Bytes in an ANALOG_MESSAGE or DIGITAL_MESSAGE.
+MESSAGE_BYTES = 3
+# Bits on the wire per byte: 8 data bits plus a start and a stop bit.
+BITS_PER_BYTE = 10
+# The fraction of the link that reporting may use, leaving room for commands, replies and timing slack.
+UTILIZATION = 0.8
+# Sampling intervals the firmware accepts, in ms.
+MIN_SAMPLING_INTERVAL = 1
+MAX_SAMPLING_INTERVAL = 0x3fff
+# The most slots channels are rotated through, and how many reports each enabled channel gets per slot.
+MAX_SLOTS = 16
+SLOT_SAMPLES = 10
+
+
+class ReportingBudgetError(Exception): pass
+
+
+class ReportingPlan(object):
+  """A reporting configuration that fits the link, as chosen by ReportingScheduler.Plan."""
+  def __init__(self, interval, slots, slot_time, analog_rates, digital_rates, budget):
+    self.interval = interval  # The sampling interval, in ms.
+    self.slots = slots  # A list of frozensets of analog channels, enabled in turn. One slot means no rotation.
+    self.slot_time = slot_time  # Seconds each slot lasts.
+    self.analog_rates = analog_rates  # Analog channel -> expected reports per second.
+    self.digital_rates = digital_rates  # Digital port -> expected reports per second.
+    self.budget = budget  # The bytes per second reporting may use.
+
+  @property
+  def bytes_per_second(self):
+    """The bytes per second the plan is expected to use."""
+    return MESSAGE_BYTES * (sum(self.analog_rates.values()) + sum(self.digital_rates.values()))
+
+  def __repr__(self):
+    return 'ReportingPlan(interval=%dms, slots=%d, %.0f of %.0f bytes/s)' % (
+        self.interval, len(self.slots), self.bytes_per_second, self.budget)
+
+
+class ReportingScheduler(object):
+  """Configures a board's analog and digital reporting to fit within its serial link, and measures the result."""
+  def __init__(self, board, baud=None, utilization=UTILIZATION, min_interval=MIN_SAMPLING_INTERVAL):
+    """Constructs a ReportingScheduler. Nothing is sent to the board until Apply is called.
+
+    Args:
+      board: The BaseBoard to configure.
+      baud: The link's baud rate. Defaults to the baud its port was opened with.
+      utilization: The fraction of the link reporting may use.
+      min_interval: The shortest sampling interval the board's firmware accepts, in ms.
+    """
+    self.board = board
+    self.baud = baud if baud is not None else board.port.baud
+    self.budget = self.baud / float(BITS_PER_BYTE) * utilization
+    self.min_interval = min_interval
+    self.plan = None
+    self._counts = {}  # (token type, channel or port) -> reports received since Apply.
+    self._started = None
+    self._slot = 0
+    self._rotation = None
+    self._stopped = threading.Event()
+
+  def Plan(self, analog, digital=None, degrade=False):
+    """Returns a ReportingPlan for the given rates. Sends nothing.
+
+    Args:
+      analog: A dict mapping analog channel numbers to the reports per second wanted from each.
+      digital: A dict mapping digital port numbers to how many times a second each is expected to change.
+      degrade: A boolean. If set, analog rates that do not fit are scaled down until they do, instead of raising.
+
+    Raises:
+      ReportingBudgetError: The rates do not fit within the budget, or, with degrade, even the slowest reporting the
+          firmware allows does not.
+      ValueError: An analog rate is not positive, or a digital one is negative.
+    """
+    digital = dict(digital or {})
+    if [rate for rate in analog.values() if rate <= 0] or [rate for rate in digital.values() if rate < 0]:
+      raise ValueError('Analog rates must be positive and digital ones not negative: %r, %r' % (analog, digital))
+    analog_budget = self.budget - MESSAGE_BYTES * sum(digital.values())
+    if analog_budget < 0 or (analog and analog_budget == 0):
+      raise ReportingBudgetError('Digital reporting alone needs %.0f bytes/s, but only %.0f are available' % (
+          MESSAGE_BYTES * sum(digital.values()), self.budget))
+    if not analog:
+      return ReportingPlan(MAX_SAMPLING_INTERVAL, [frozenset()], 0, {}, digital, self.budget)
+    slowest = int(analog_budget // (MESSAGE_BYTES * 1000.0 / MAX_SAMPLING_INTERVAL))  # Channels at once, at most.
+    if len(analog) > MAX_SLOTS * slowest:
+      raise ReportingBudgetError('%d analog channels cannot be rotated within %.2f bytes/s even at the longest '
+                                 'sampling interval' % (len(analog), analog_budget))
+    targets = dict(analog)
+    demand = MESSAGE_BYTES * sum(targets.values())
+    if demand > analog_budget:
+      if not degrade:
+        raise ReportingBudgetError('Analog reporting needs %.0f bytes/s, but only %.0f are available' % (
+            demand, analog_budget))
+      targets = self._Scale(targets, analog_budget / demand)
+    while True:
+      plan = self._Fit(targets, digital, analog_budget)
+      if plan is not None:
+        return plan
+      if not degrade:
+        raise ReportingBudgetError('Analog rates %r cannot be rotated within %.0f bytes/s' % (analog, analog_budget))
+      # Rounding to whole intervals and slots lost too much; back off a little. This ends by the time every channel is
+      # down to the longest interval, which the check above showed to fit.
+      targets = self._Scale(targets, 0.95)
+
+  def _Scale(self, targets, factor):
+    return dict((channel, rate * factor) for channel, rate in targets.items())
+
+  def _Fit(self, targets, digital, analog_budget):
+    """Returns a ReportingPlan meeting every target rate within analog_budget, or None if rounding prevents it."""
+    interval = int(1000 / max(targets.values()))  # Rounded down, so the fastest channel gets at least its rate.
+    interval = min(max(interval, self.min_interval), MAX_SAMPLING_INTERVAL)
+    rate = 1000.0 / interval
+    capacity = int(analog_budget // (MESSAGE_BYTES * rate))  # Channels that can report at once.
+    if capacity >= len(targets):
+      return ReportingPlan(interval, [frozenset(targets)], 0, dict.fromkeys(targets, rate), digital, self.budget)
+    if capacity == 0:
+      return None
+    # Each channel is enabled in `shares[channel]` of `count` slots, so it reports at rate * shares / count on average.
+    for count in xrange(int(math.ceil(len(targets) / float(capacity))), MAX_SLOTS + 1):
+      shares = dict((channel, min(count, int(math.ceil(target / rate * count - 1e-9))))
+                    for channel, target in targets.items())
+      if sum(shares.values()) <= count * capacity:
+        break
+    else:
+      return None
+    slots = [set() for _ in xrange(count)]
+    for channel in sorted(shares, key=lambda channel: (-shares[channel], channel)):
+      for slot in sorted(slots, key=len)[:shares[channel]]:  # The least loaded slots keep every slot within capacity.
+        slot.add(channel)
+    expected = dict((channel, rate * share / count) for channel, share in shares.items())
+    slot_time = SLOT_SAMPLES * interval / 1000.0
+    return ReportingPlan(interval, [frozenset(slot) for slot in slots], slot_time, expected, digital, self.budget)
+
+  def Apply(self, plan):
+    """Configures the board's reporting as planned, and starts measuring rates and rotating channels if need be.
+
+    Analog channels and digital ports not in the plan are left as they are.
+    """
+    self.Stop()
+    self.plan = plan
+    self._stopped = threading.Event()
+    self._counts = dict.fromkeys([('ANALOG_MESSAGE', channel) for channel in plan.analog_rates] +
+                                 [('DIGITAL_MESSAGE', port) for port in plan.digital_rates], 0)
+    self.board.AddListener('ANALOG_MESSAGE', self._CountAnalog)
+    self.board.AddListener('DIGITAL_MESSAGE', self._CountDigital)
+    if plan.analog_rates:
+      self.board.SetSamplingInterval(plan.interval)
+    for channel in plan.analog_rates:
+      if channel not in plan.slots[0]:
+        self.board.DisableAnalogReporting(channel)
+    for channel in sorted(plan.slots[0]):
+      self.board.EnableAnalogReporting(channel)
+    for port in sorted(plan.digital_rates):
+      self.board.EnableDigitalReporting(port)
+    self._started = time.time()
+    self._slot = 0
+    if len(plan.slots) > 1:
+      self._rotation = threading.Thread(target=self._Rotate, args=(plan, self._stopped))
+      self._rotation.daemon = True
+      self._rotation.start()
+    return plan
+
+  def _Rotate(self, plan, stopped):
+    deadline = time.time() + plan.slot_time
+    while not stopped.wait(max(0, deadline - time.time())):
+      deadline += plan.slot_time
+      current, self._slot = plan.slots[self._slot], (self._slot + 1) % len(plan.slots)
+      following = plan.slots[self._slot]
+      for channel in sorted(current - following):
+        self.board.DisableAnalogReporting(channel)
+      for channel in sorted(following - current):
+        self.board.EnableAnalogReporting(channel)
+
+  def _CountAnalog(self, token):
+    key = ('ANALOG_MESSAGE', token.pin)
+    if key in self._counts:
+      self._counts[key] += 1
+    return (False, False)
+
+  def _CountDigital(self, token):
+    key = ('DIGITAL_MESSAGE', token.port)
+    if key in self._counts:
+      self._counts[key] += 1
+    return (False, False)
+
+  def Rates(self):
+    """Returns a dict mapping ('ANALOG_MESSAGE', channel) and ('DIGITAL_MESSAGE', port) to (expected, measured).
+
+    Both are in reports per second; measured is averaged over the time since Apply.
+    """
+    if self.plan is None:
+      return {}
+    elapsed = max(time.time() - self._started, 1e-9)
+    rates = {}
+    for (kind, number), count in self._counts.items():
+      expected = (self.plan.analog_rates if kind == 'ANALOG_MESSAGE' else self.plan.digital_rates)[number]
+      rates[(kind, number)] = (expected, count / elapsed)
+    return rates
+
+  def Stop(self):
+    """Stops rotating channels and measuring rates. Reporting stays as it was last set."""
+    self._stopped.set()
+    if self._rotation is not None:
+      if self._rotation is not threading.current_thread():
+        self._rotation.join()
+      self._rotation = None
+    self.board.RemoveListener('ANALOG_MESSAGE', self._CountAnalog)
+    self.board.RemoveListener('DIGITAL_MESSAGE', self._CountDigital)
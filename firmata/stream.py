@@ -0,0 +1,208 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Streams of pin reports, consumed in batches.
+
+A `SampleStream` buffers (timestamp, pin, value) samples from a board's ANALOG_MESSAGE and DIGITAL_MESSAGE reports,
+and hands them to a consumer in batches of whatever has arrived since it last looked, so the consumer runs once per
+batch rather than once per report and never on the board's dispatch thread:
+
+  stream = board.Stream(pins=[14, 15], capacity=4096)
+  for batch in stream:
+    for timestamp, pin, value in batch:
+      ...
+
+or, on an event loop (trollius on Python 2):
+
+  batch = yield From(stream.NextBatch())
+
+The buffer holds at most `capacity` samples. What happens when a slow consumer lets it fill up is the stream's
+overflow policy:
+
+  DROP_OLDEST: the oldest buffered sample is discarded to make room (the default).
+  DROP_NEWEST: the new sample is discarded.
+  BLOCK: dispatch waits for the consumer to make room. On a threaded Board this holds up dispatch but not the reader
+      thread; on an AsyncBoard or a BoardHub without workers it holds up IO, and the consumer must not run on the same
+      thread, so BLOCK is best left to threaded boards.
+
+Samples discarded by either DROP policy are counted in `dropped`.
+"""
+
+import collections
+import threading
+import time
+
+
+DROP_OLDEST = 'drop-oldest'
+DROP_NEWEST = 'drop-newest'
+BLOCK = 'block'
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+# The number of samples a SampleStream buffers by default.
+STREAM_CAPACITY = 1024
+
+STREAM_KINDS = ('ANALOG_MESSAGE', 'DIGITAL_MESSAGE')
+
+
+class SampleStream(object):
+  """A bounded buffer of (timestamp, pin, value) samples from a board's reports. Obtain one with BaseBoard.Stream.
+
+  Samples are timestamped with time.time() when they are dispatched, and analog pins are identified by their digital
+  pin number (see BaseBoard.atod_map). A DIGITAL_MESSAGE gives a sample for each streamed pin of its port.
+  """
+  def __init__(self, board, pins=None, kinds=STREAM_KINDS, capacity=STREAM_CAPACITY, overflow=DROP_OLDEST,
+               max_batch=None, loop=None):
+    """Constructs a SampleStream and starts listening to board.
+
+    Args:
+      board: The BaseBoard whose reports to stream.
+      pins: A list of pin numbers to stream, or None (the default) to stream every pin.
+      kinds: A sequence of the token types to stream, from STREAM_KINDS.
+      capacity: An integer. The most samples to buffer.
+      overflow: What to do with a sample that arrives when the buffer is full: DROP_OLDEST, DROP_NEWEST or BLOCK.
+      max_batch: An integer. The most samples to return in one batch, or None (the default) for no limit.
+      loop: The event loop NextBatch futures belong to, if any.
+
+    Raises:
+      ValueError: overflow or kinds is not one of the above.
+    """
+    if overflow not in OVERFLOW_POLICIES:
+      raise ValueError('Unknown overflow policy: %r' % (overflow,))
+    if not set(kinds) <= set(STREAM_KINDS):
+      raise ValueError('Only %s can be streamed, not %r' % (', '.join(STREAM_KINDS), kinds))
+    self.pins = None if pins is None else frozenset(pins)
+    self.capacity = capacity
+    self.overflow = overflow
+    self.max_batch = max_batch
+    self.active = True
+    self.dropped = 0  # Samples discarded because the buffer was full.
+    self._board = board
+    self._loop = loop
+    self._samples = collections.deque()
+    self._condition = threading.Condition()
+    self._waiters = collections.deque()  # Futures returned by NextBatch, not yet resolved.
+    self._wake_scheduled = False
+    self._listeners = []
+    for kind in kinds:
+      listener = self._OnAnalogMessage if kind == 'ANALOG_MESSAGE' else self._OnDigitalMessage
+      self._listeners.append((kind, listener))
+      board.AddListener(kind, listener)
+
+  def _OnAnalogMessage(self, token):
+    atod_map = self._board.atod_map
+    if token.pin < len(atod_map):  # Otherwise the handler reports the error.
+      pin = atod_map[token.pin]
+      if self.pins is None or pin in self.pins:
+        self._Put([(time.time(), pin, token.value)])
+    return (False, False)
+
+  def _OnDigitalMessage(self, token):
+    now, mask, first_pin = time.time(), token.mask, token.port * 8
+    self._Put([(now, first_pin + i, (mask >> i) & 1) for i in xrange(8)
+               if self.pins is None or first_pin + i in self.pins])
+    return (False, False)
+
+  def _Put(self, samples):
+    with self._condition:
+      for sample in samples:
+        while len(self._samples) >= self.capacity and self.active:
+          if self.overflow == DROP_NEWEST:
+            self.dropped += 1
+            break
+          elif self.overflow == DROP_OLDEST:
+            self._samples.popleft()
+            self.dropped += 1
+          else:
+            self._condition.wait()
+        else:
+          if not self.active:
+            return
+          self._samples.append(sample)
+      self._condition.notify_all()
+      if self._waiters and not self._wake_scheduled:
+        self._wake_scheduled = True
+        self._loop.call_soon_threadsafe(self._WakeWaiters)
+
+  def _TakeBatch(self):
+    # Must hold self._condition.
+    count = len(self._samples)
+    if self.max_batch is not None:
+      count = min(count, self.max_batch)
+    batch = [self._samples.popleft() for _ in xrange(count)]
+    if batch and self.overflow == BLOCK:
+      self._condition.notify_all()
+    return batch
+
+  def Get(self, timeout=None):
+    """Returns the next batch of samples, oldest first, waiting for at least one to arrive.
+
+    Args:
+      timeout: A number. The most seconds to wait, or None (the default) to wait until a sample arrives or the stream
+          is stopped.
+
+    Returns:
+      A list of (timestamp, pin, value) samples. It is empty if the timeout expired, or if the stream has been stopped
+      and every sample has been taken.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    with self._condition:
+      while not self._samples and self.active:
+        remaining = None if deadline is None else deadline - time.time()
+        if remaining is not None and remaining <= 0:
+          break
+        self._condition.wait(remaining)
+      return self._TakeBatch()
+
+  def __iter__(self):
+    """Yields batches of samples as they arrive, until the stream is stopped and drained."""
+    while True:
+      batch = self.Get()
+      if not batch:
+        return
+      yield batch
+
+  def NextBatch(self):
+    """Returns a future resolved with the next batch of samples, like Get(), on the stream's event loop.
+
+    The future is resolved with an empty list once the stream has been stopped and drained.
+    """
+    if self._loop is None:
+      raise ValueError('NextBatch requires a stream created with a loop')
+    from firmata.aio import asyncio
+    future = asyncio.Future(loop=self._loop)
+    with self._condition:
+      self._waiters.append(future)
+      if (self._samples or not self.active) and not self._wake_scheduled:
+        self._wake_scheduled = True
+        self._loop.call_soon_threadsafe(self._WakeWaiters)
+    return future
+
+  def _WakeWaiters(self):
+    # Runs on the loop, so every sample dispatched since the last wakeup goes into one batch.
+    with self._condition:
+      self._wake_scheduled = False
+      while self._waiters and (self._samples or not self.active):
+        future = self._waiters.popleft()
+        if not future.done():  # Skips cancelled waits.
+          future.set_result(self._TakeBatch())
+
+  def Stop(self):
+    """Stops listening to the board. Samples already buffered can still be taken."""
+    for kind, listener in self._listeners:
+      self._board.RemoveListener(kind, listener)
+    with self._condition:
+      self.active = False
+      self._condition.notify_all()
+      if self._waiters and not self._wake_scheduled:
+        self._wake_scheduled = True
+        self._loop.call_soon_threadsafe(self._WakeWaiters)
@@ -0,0 +1,210 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Token classes emitted by the Firmata lexers.
+
+Each kind of message is a small `__slots__` class with an integer `TAG`, which `Board.DispatchToken` uses to index its
+dispatch table. Tokens can still be read like the dicts the lexer used to emit, so `token['token']` is the token type
+name and `token['pin']` is the same as `token.pin`.
+"""
+
+
+class Token(object):
+  """Base class for all tokens."""
+  __slots__ = ('seq',)  # Set by SerialReader.Emit: the token's place in the order the reader emitted tokens, from 1.
+  TYPE = None  # The token type name, e.g. 'ANALOG_MESSAGE'.
+  TAG = None  # A small integer unique to each token class.
+  FIELDS = ()  # The names of the fields visible through the mapping interface.
+
+  def __getitem__(self, key):
+    if key == 'token':
+      return self.TYPE
+    if key not in self.FIELDS:
+      raise KeyError(key)
+    return getattr(self, key)
+
+  def __contains__(self, key):
+    return key == 'token' or key in self.FIELDS
+
+  def get(self, key, default=None):
+    if key not in self:
+      return default
+    return self[key]
+
+  def keys(self):
+    return ['token'] + list(self.FIELDS)
+
+  def AsDict(self):
+    """Returns the token as a dict, in the form the lexer used to emit."""
+    return dict((key, self[key]) for key in self.keys())
+
+  def __eq__(self, other):
+    if isinstance(other, Token):
+      return self.TAG == other.TAG and all(getattr(self, f) == getattr(other, f) for f in self.FIELDS)
+    if isinstance(other, dict):
+      return self.AsDict() == other
+    return NotImplemented
+
+  def __ne__(self, other):
+    equal = self.__eq__(other)
+    return equal if equal is NotImplemented else not equal
+
+  __hash__ = object.__hash__
+
+  def __repr__(self):
+    return repr(self.AsDict())
+
+
+class ErrorMessage(Token):
+  __slots__ = ('message',)
+  TYPE = 'ERROR'
+  TAG = 0
+  FIELDS = __slots__
+
+  def __init__(self, message):
+    self.message = message
+
+
+class StringMessage(Token):
+  __slots__ = ('message',)
+  TYPE = 'STRING_MESSAGE'
+  TAG = 1
+  FIELDS = __slots__
+
+  def __init__(self, message):
+    self.message = message
+
+
+class ReservedCommand(Token):
+  __slots__ = ('data',)
+  TYPE = 'RESERVED_COMMAND'
+  TAG = 2
+  FIELDS = __slots__
+
+  def __init__(self, data):
+    self.data = data
+
+
+class ReportFirmware(Token):
+  __slots__ = ('major', 'minor', 'name')
+  TYPE = 'REPORT_FIRMWARE'
+  TAG = 3
+  FIELDS = __slots__
+
+  def __init__(self, major, minor, name):
+    self.major = major
+    self.minor = minor
+    self.name = name
+
+
+class AnalogMappingResponse(Token):
+  __slots__ = ('channels',)
+  TYPE = 'ANALOG_MAPPING_RESPONSE'
+  TAG = 4
+  FIELDS = __slots__
+
+  def __init__(self, channels):
+    self.channels = channels
+
+
+class CapabilityResponse(Token):
+  __slots__ = ('pins',)
+  TYPE = 'CAPABILITY_RESPONSE'
+  TAG = 5
+  FIELDS = __slots__
+
+  def __init__(self, pins):
+    self.pins = pins
+
+
+class AnalogMessage(Token):
+  __slots__ = ('pin', 'value')
+  TYPE = 'ANALOG_MESSAGE'
+  TAG = 6
+  FIELDS = __slots__
+
+  def __init__(self, pin, value):
+    self.pin = pin
+    self.value = value
+
+
+class DigitalMessage(Token):
+  """A report of the 8 pins of a port, packed into `mask` (bit i is pin port * 8 + i)."""
+  __slots__ = ('port', 'mask')
+  TYPE = 'DIGITAL_MESSAGE'
+  TAG = 7
+  FIELDS = ('port', 'pins')
+
+  def __init__(self, port, mask):
+    self.port = port
+    self.mask = mask
+
+  @property
+  def pins(self):
+    """The state of each pin in the port as a list of 8 booleans."""
+    return [(self.mask >> i) & 1 == 1 for i in xrange(8)]
+
+
+class ProtocolVersion(Token):
+  __slots__ = ('major', 'minor')
+  TYPE = 'PROTOCOL_VERSION'
+  TAG = 8
+  FIELDS = __slots__
+
+  def __init__(self, major, minor):
+    self.major = major
+    self.minor = minor
+
+
+class PinStateResponse(Token):
+  __slots__ = ('pin', 'mode', 'data')
+  TYPE = 'PIN_STATE_RESPONSE'
+  TAG = 9
+  FIELDS = __slots__
+
+  def __init__(self, pin, mode, data):
+    self.pin = pin
+    self.mode = mode
+    self.data = data
+
+
+class I2cReply(Token):
+  __slots__ = ('addr', 'reg', 'data')
+  TYPE = 'I2C_REPLY'
+  TAG = 10
+  FIELDS = __slots__
+
+  def __init__(self, addr, reg, data):
+    self.addr = addr
+    self.reg = reg
+    self.data = data
+
+
+# Every token class, indexed by TAG.
+TOKEN_CLASSES = (ErrorMessage, StringMessage, ReservedCommand, ReportFirmware, AnalogMappingResponse,
+                 CapabilityResponse, AnalogMessage, DigitalMessage, ProtocolVersion, PinStateResponse, I2cReply)
+
+TOKEN_CLASSES_BY_TYPE = dict((cls.TYPE, cls) for cls in TOKEN_CLASSES)
+
+
+def FromDict(token):
+  """Converts a dict in the form the lexer used to emit into a Token.
+
+  Returns the dict unchanged if its token type has no Token class.
+  """
+  cls = TOKEN_CLASSES_BY_TYPE.get(token.get('token'))
+  if cls is None:
+    return token
+  if cls is DigitalMessage:
+    return DigitalMessage(token['port'], sum(1 << i for i, value in enumerate(token['pins']) if value))
+  return cls(*[token[field] for field in cls.FIELDS])
@@ -0,0 +1,108 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Fake boards on the far end of a pseudo-terminal, for the tests and benchmarks that need a real file descriptor."""
+
+import os
+import select
+import threading
+import tty
+
+from firmata.constants import *
+from tests.test_io import ARDUINO_ANALOG_MAPPING, ARDUINO_CAPABILITY, FIRMATA_INIT, I2C_REPLY_MESSAGE
+
+
+class PtyBoard(object):
+  """A fake board on the far end of a pseudo-terminal.
+
+  `path` can be opened with pySerial like a real serial port; bytes passed to `Send` appear on it. `Read`, called when
+  `master` is readable, takes what the host has written and answers the sysex queries in it, by default like the board
+  of the tests.test_io fixtures.
+  """
+  def __init__(self):
+    self.master, self._slave = os.openpty()
+    tty.setraw(self.master)
+    self.path = os.ttyname(self._slave)
+    self.received = bytearray()  # Everything Read has taken from the host.
+    self.reads = 0
+    self.queries = 0
+    self._pending = bytearray()  # Received bytes after the last SYSEX_END.
+    self._lock = threading.Lock()
+
+  def Send(self, data):
+    """Writes a sequence of byte values to the port."""
+    data = bytes(bytearray(data))
+    with self._lock:
+      while data:
+        data = data[os.write(self.master, data):]
+
+  def Receive(self, size=4096):
+    """Reads whatever the host has written to the port, blocking until something arrives. Nothing is answered."""
+    return bytearray(os.read(self.master, size))
+
+  def Read(self):
+    """Reads whatever the host has written to the port, and answers the queries in it."""
+    data = os.read(self.master, 4096)
+    self.reads += 1
+    self.received += data
+    self._pending += data
+    while SYSEX_END in self._pending:
+      end = self._pending.index(chr(SYSEX_END)) + 1
+      message, self._pending = self._pending[:end], self._pending[end:]
+      start = message.find(chr(SYSEX_START))
+      if start >= 0:
+        self.queries += 1
+        self._Query(message[start + 1], message[start + 2:-1])
+
+  def _Query(self, command, body):
+    self.Send(self.Answer(command, body))
+
+  def Answer(self, command, body):
+    """Returns the byte values to answer a sysex query with, or nothing."""
+    if command == SE_REPORT_FIRMWARE:
+      return ''.join(FIRMATA_INIT)
+    if command == SE_CAPABILITY_QUERY:
+      return ''.join(ARDUINO_CAPABILITY)
+    if command == SE_ANALOG_MAPPING_QUERY:
+      return ''.join(ARDUINO_ANALOG_MAPPING)
+    if command == SE_PIN_STATE_QUERY:
+      pin = body[0]
+      return [SYSEX_START, SE_PIN_STATE_RESPONSE, pin, MODE_ANALOG if pin >= 14 else MODE_OUTPUT, 0, SYSEX_END]
+    if command == SE_I2C_REQUEST:
+      return ''.join(I2C_REPLY_MESSAGE)
+    return []
+
+  def Close(self):
+    os.close(self.master)
+    os.close(self._slave)
+
+
+class ThreadedPtyBoard(PtyBoard, threading.Thread):
+  """A PtyBoard that answers queries from a thread of its own, started by the constructor."""
+  def __init__(self):
+    PtyBoard.__init__(self)
+    threading.Thread.__init__(self)
+    self.daemon = True
+    self._closing = False
+    self.start()
+
+  def run(self):
+    while not self._closing:
+      readable, _, _ = select.select([self.master], [], [], 0.05)
+      if readable:
+        self.Read()
+
+  def Close(self):
+    self._closing = True
+    self.join()
+    PtyBoard.Close(self)
@@ -0,0 +1,84 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import unittest2 as unittest
+
+from firmata import aio
+from firmata.constants import *
+from tests.fakeboard import PtyBoard
+from tests.test_io import FIRMATA_INIT
+
+
+@unittest.skipIf(aio.asyncio is None, 'asyncio (or trollius) is not installed')
+class AsyncBoardTest(unittest.TestCase):
+  def setUp(self):
+    super(AsyncBoardTest, self).setUp()
+    self.loop = aio.asyncio.new_event_loop()
+    self.fake = PtyBoard()  # Answers on the same event loop.
+    self.loop.add_reader(self.fake.master, self.fake.Read)
+    self.board = aio.AsyncBoard(self.fake.path, 57600, loop=self.loop)
+
+  def tearDown(self):
+    super(AsyncBoardTest, self).tearDown()
+    self.board.StopCommunications()
+    self.loop.remove_reader(self.fake.master)
+    self.fake.Close()
+    self.loop.close()
+
+  def Run(self, future, timeout=2):
+    return self.loop.run_until_complete(aio.asyncio.wait_for(future, timeout, loop=self.loop))
+
+  def Start(self):
+    ready = self.board.StartCommunications()
+    self.fake.Send(''.join(FIRMATA_INIT))
+    self.assertIs(self.board, self.Run(ready))
+
+  def test_StartCommunications(self):
+    self.Start()
+    self.assertEqual('Test', self.board.firmware_name)
+    self.assertEqual('5.2', self.board.firmware_version)
+
+  def test_QueryBoardCapabilitiesAndState(self):
+    self.Start()
+    self.assertIs(self.board, self.Run(self.board.QueryBoardCapabilitiesAndState()))
+    self.assertEqual(20, len(self.board.pin_config))
+    self.assertEqual([13, 14, 15, 16, 17, 18], self.board.atod_map)
+    self.assertEqual(MODE_OUTPUT, self.board.pin_mode[13])
+    self.assertEqual(MODE_ANALOG, self.board.pin_mode[19])
+    self.assertEqual((), self.board._listeners['PIN_STATE_RESPONSE'])
+
+  def test_WritesAreBatched(self):
+    self.Start()
+    self.Run(self.board.QueryBoardCapabilitiesAndState())
+    reads, received = self.fake.reads, len(self.fake.received)
+    for pin in xrange(2, 14):
+      self.board.pinMode(pin, MODE_OUTPUT)
+    self.Run(aio.asyncio.sleep(0.05, loop=self.loop))
+    self.assertEqual(reads + 1, self.fake.reads)
+    self.assertEqual(''.join(chr(c) for pin in xrange(2, 14) for c in (SET_PIN_MODE, pin, MODE_OUTPUT)),
+                     bytes(self.fake.received[received:]))
+
+  def test_I2CRead(self):
+    self.Start()
+    self.Run(self.board.QueryBoardCapabilitiesAndState())
+    self.board.I2CConfig(0)
+    self.assertEqual([0xff, 0x00], self.Run(self.board.I2CRead(0x4f, 0x00, 2)))
+
+  def test_I2CReadTimeout(self):
+    self.Start()
+    self.assertIsNone(self.Run(self.board.I2CRead(0x10, 0x00, 2, timeout=0.05)))
+    self.assertEqual([], self.board._i2c_reads[0x10])
+
+
+if __name__ == '__main__':
+  unittest.main()
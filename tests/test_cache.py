@@ -0,0 +1,63 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import shutil
+import tempfile
+import unittest2 as unittest
+
+from firmata.cache import CapabilityCache
+from firmata.constants import *
+
+
+PIN_CONFIG = [{}, {MODE_INPUT: 1, MODE_OUTPUT: 1}, {MODE_INPUT: 1, MODE_ANALOG: 10}]
+CHANNELS = [False, False, 0]
+
+
+class CapabilityCacheTest(unittest.TestCase):
+  def setUp(self):
+    super(CapabilityCacheTest, self).setUp()
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'cache.json')
+
+  def tearDown(self):
+    super(CapabilityCacheTest, self).tearDown()
+    shutil.rmtree(self.dir)
+
+  def test_PutPersists(self):
+    key = CapabilityCache.Key('/dev/ttyACM0', 'Test', '5.2')
+    CapabilityCache(self.path).Put(key, PIN_CONFIG, CHANNELS)
+    cache = CapabilityCache(self.path)
+    self.assertEqual((PIN_CONFIG, CHANNELS), cache.Get(key))
+    self.assertIsNone(cache.Get(CapabilityCache.Key('/dev/ttyACM0', 'Test', '5.3')))
+    self.assertIsNone(cache.Get(CapabilityCache.Key('/dev/ttyACM1', 'Test', '5.2')))
+
+  def test_Invalidate(self):
+    cache = CapabilityCache(self.path)
+    cache.Put('a', PIN_CONFIG, CHANNELS)
+    cache.Put('b', PIN_CONFIG, CHANNELS)
+    cache.Invalidate('a')
+    cache.Invalidate('missing')
+    reloaded = CapabilityCache(self.path)
+    self.assertIsNone(reloaded.Get('a'))
+    self.assertEqual((PIN_CONFIG, CHANNELS), reloaded.Get('b'))
+    self.assertEqual(['cache.json'], os.listdir(self.dir))
+
+  def test_CorruptFileIsEmpty(self):
+    with open(self.path, 'w') as f:
+      f.write('{not json')
+    self.assertIsNone(CapabilityCache(self.path).Get('a'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,88 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import tempfile
+import unittest2 as unittest
+import serial
+
+import firmata
+from firmata import capture
+from firmata.constants import *
+from tests.test_io import ARDUINO_ANALOG_MAPPING, ARDUINO_CAPABILITY, FIRMATA_INIT, MockSerial
+
+
+class CaptureTest(unittest.TestCase):
+  def setUp(self):
+    super(CaptureTest, self).setUp()
+    fd, self._path = tempfile.mkstemp()
+    os.close(fd)
+
+  def tearDown(self):
+    super(CaptureTest, self).tearDown()
+    os.remove(self._path)
+
+  def test_RoundTrip(self):
+    cap = capture.SerialCapture(self._path)
+    cap.start()
+    cap.Log(capture.DIRECTION_IN, '\xf9\x05\x02')
+    cap.Log(capture.DIRECTION_OUT, bytearray([SYSEX_START, SE_CAPABILITY_QUERY, SYSEX_END]))
+    cap.Close()
+    records = list(capture.ReadCapture(self._path))
+    self.assertEqual([(capture.DIRECTION_IN, bytearray('\xf9\x05\x02')),
+                      (capture.DIRECTION_OUT, bytearray('\xf0\x6b\xf7'))],
+                     [(direction, data) for _, direction, data in records])
+    self.assertLessEqual(records[0][0], records[1][0])
+    self.assertEqual(2, cap.records)
+    self.assertEqual(0, cap.dropped)
+
+  def test_DropsWhenFull(self):
+    cap = capture.SerialCapture(self._path, max_queued=2)
+    for i in xrange(5):
+      cap.Log(capture.DIRECTION_IN, chr(i))
+    self.assertEqual(3, cap.dropped)
+    cap.start()
+    cap.Close()
+    self.assertEqual(2, len(list(capture.ReadCapture(self._path))))
+
+  def test_Decoder(self):
+    cap = capture.SerialCapture(self._path)
+    cap.start()
+    cap.Log(capture.DIRECTION_IN, '\xf9\x05')
+    cap.Log(capture.DIRECTION_OUT, '\xf0')
+    cap.Close()
+    out_path = self._path + '.txt'
+    self.assertEqual(0, capture.main(['capture', self._path, out_path]))
+    with open(out_path) as f:
+      lines = f.read().splitlines()
+    os.remove(out_path)
+    self.assertEqual(['<< 0xf9 (PROTOCOL_VERSION)', '<< 0x5 (UNKNOWN)', '>> 0xf0 (SYSEX_START)'], lines)
+
+  def test_BoardCapture(self):
+    real_serial = serial.Serial
+    port = MockSerial()
+    port.data = FIRMATA_INIT[:] + ARDUINO_CAPABILITY[:] + ARDUINO_ANALOG_MAPPING[:]
+    serial.Serial = lambda *args, **kargs: port
+    try:
+      board = firmata.Board('', 10, start_serial=True, capture_to_file=self._path)
+      board.QueryCapabilities()
+      board.join(timeout=0.5)
+      board.StopCommunications()
+    finally:
+      serial.Serial = real_serial
+    received = bytearray()
+    sent = bytearray()
+    for _, direction, data in capture.ReadCapture(self._path):
+      (received if direction == capture.DIRECTION_IN else sent).extend(data)
+    self.assertEqual(bytearray(''.join(FIRMATA_INIT + ARDUINO_CAPABILITY + ARDUINO_ANALOG_MAPPING)), received)
+    self.assertEqual(bytearray([SYSEX_START, SE_CAPABILITY_QUERY, SYSEX_END]), sent)
@@ -0,0 +1,74 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import unittest2 as unittest
+
+from firmata import history
+from firmata.history import PinHistory
+
+
+class PinHistoryTest(unittest.TestCase):
+  def Fill(self, count, capacity=4):
+    pin_history = PinHistory(capacity)
+    for i in xrange(count):
+      pin_history.Append(float(i), i)
+    return pin_history
+
+  def test_Empty(self):
+    pin_history = PinHistory(4)
+    self.assertEqual(0, len(pin_history))
+    self.assertEqual([], list(pin_history.Last()))
+    self.assertEqual([], list(pin_history.Since(0)))
+
+  def test_Last(self):
+    pin_history = self.Fill(3)
+    self.assertEqual([(0.0, 0), (1.0, 1), (2.0, 2)], list(pin_history.Last()))
+    self.assertEqual([(1.0, 1), (2.0, 2)], list(pin_history.Last(2)))
+    self.assertEqual(3, len(pin_history.Last(10)))
+
+  def test_LastWraps(self):
+    for count in xrange(4, 13):
+      pin_history = self.Fill(count)
+      self.assertEqual(4, len(pin_history))
+      self.assertEqual(range(count - 4, count), list(pin_history.Last().values()))
+      self.assertEqual(range(count - 3, count), list(pin_history.Last(3).values()))
+      self.assertEqual((count - 1.0, count - 1), pin_history.Last()[-1])
+
+  def test_Since(self):
+    pin_history = self.Fill(10)
+    self.assertEqual([8.0, 9.0], list(pin_history.Since(7.5).times()))
+    self.assertEqual([7, 8, 9], list(pin_history.Since(7).values()))
+    self.assertEqual(range(6, 10), list(pin_history.Since(0).values()))
+    self.assertEqual(0, len(pin_history.Since(10)))
+
+  def test_WindowIsNotCopied(self):
+    pin_history = self.Fill(2)
+    window = pin_history.Last()
+    pin_history.Append(2.0, 2)
+    pin_history.Append(3.0, 3)
+    pin_history.Append(4.0, 4)  # Overwrites the first sample in the window.
+    self.assertEqual([4, 1], list(window.values()))
+
+  @unittest.skipIf(history.numpy is None, 'NumPy is not installed')
+  def test_Numpy(self):
+    pin_history = self.Fill(6)
+    times, values = pin_history.Last(3).numpy()
+    self.assertEqual([3, 4, 5], values.tolist())
+    self.assertEqual([3.0, 4.0, 5.0], times.tolist())
+    pin_history.Append(6.0, 6)
+    pin_history.Append(7.0, 7)
+    self.assertEqual([7, 4, 5], values.tolist())
+
+
+if __name__ == '__main__':
+  unittest.main()
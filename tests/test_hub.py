@@ -0,0 +1,104 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+import unittest2 as unittest
+
+from firmata import hub
+from firmata.constants import *
+from tests.fakeboard import ThreadedPtyBoard
+from tests.test_io import FIRMATA_INIT, WaitFor
+
+
+@unittest.skipIf(hub.selectors is None, 'selectors (or trollius) is not installed')
+class BoardHubTest(unittest.TestCase):
+  def setUp(self):
+    super(BoardHubTest, self).setUp()
+    self.fakes = [ThreadedPtyBoard() for _ in xrange(3)]
+    self.hub = hub.BoardHub()
+    self.hub.start()
+
+  def tearDown(self):
+    super(BoardHubTest, self).tearDown()
+    self.hub.Shutdown()
+    for fake in self.fakes:
+      fake.Close()
+
+  def AddStartedBoard(self, fake):
+    board = self.hub.AddBoard(fake.path, 57600, start_serial=False)
+    fake.Send(''.join(FIRMATA_INIT))
+    board.StartCommunications()
+    return board
+
+  def test_AddBoard(self):
+    boards = [self.hub.AddBoard(fake.path, 57600, query_version=True) for fake in self.fakes]
+    self.assertEqual(boards, self.hub.boards)
+    for board in boards:
+      self.assertEqual('Test', board.firmware_name)
+      self.assertTrue(WaitFor(lambda: len(board.pin_config) == 20))
+      self.assertEqual([13, 14, 15, 16, 17, 18], board.atod_map)
+    self.assertEqual(1, len([t for t in threading.enumerate() if isinstance(t, hub.BoardHub)]))
+
+  def test_TokensAreDispatchedPerBoard(self):
+    boards = [self.AddStartedBoard(fake) for fake in self.fakes]
+    for board in boards:
+      board.atod_map = range(16)
+    for i, fake in enumerate(self.fakes):
+      fake.Send([ANALOG_MESSAGE_0 + 2, i + 10, 0])
+    for i, board in enumerate(boards):
+      self.assertTrue(WaitFor(lambda: board.pin_state[2] == i + 10))
+
+  def test_WritesFromManyThreads(self):
+    board = self.AddStartedBoard(self.fakes[0])
+    def Write(pin):
+      for _ in xrange(10):
+        board.port.Put([SET_PIN_MODE, pin, MODE_OUTPUT])
+    writers = [threading.Thread(target=Write, args=(pin,)) for pin in xrange(2, 10)]
+    for writer in writers:
+      writer.start()
+    for writer in writers:
+      writer.join()
+    self.assertTrue(WaitFor(lambda: len(self.fakes[0].received) == 8 * 10 * 3))
+    self.assertEqual(80, self.fakes[0].received.count(chr(SET_PIN_MODE)))
+
+  def test_StopCommunications(self):
+    board = self.AddStartedBoard(self.fakes[0])
+    board.StopCommunications()
+    self.assertEqual([], self.hub.boards)
+    self.assertFalse(board._registered)
+
+
+@unittest.skipIf(hub.selectors is None, 'selectors (or trollius) is not installed')
+class BoardHubWorkersTest(BoardHubTest):
+  def setUp(self):
+    unittest.TestCase.setUp(self)
+    self.fakes = [ThreadedPtyBoard() for _ in xrange(3)]
+    self.hub = hub.BoardHub(workers=2)
+    self.hub.start()
+
+  def test_BoardsShareWorkers(self):
+    boards = [self.AddStartedBoard(fake) for fake in self.fakes]
+    self.assertIs(boards[0]._worker, boards[2]._worker)
+    self.assertIsNot(boards[0]._worker, boards[1]._worker)
+    dispatched_on = set()
+    def Listener(token):
+      dispatched_on.add(threading.current_thread())
+      return (False, False)
+    boards[0].AddListener('PROTOCOL_VERSION', Listener)
+    self.fakes[0].Send([PROTOCOL_VERSION, 2, 3])
+    self.assertTrue(WaitFor(lambda: boards[0].firmware_version == '2.3'))
+    self.assertEqual(set([boards[0]._worker]), dispatched_on)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -11,11 +11,19 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+from array import array
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest2 as unittest
 import serial
 
 import firmata
 from firmata import io
+from firmata import tokens
+from firmata.cache import CapabilityCache
 from firmata.constants import *
 
 
@@ -97,6 +105,13 @@ I2C_REPLY_MESSAGE = [chr(i) for i in (
 )]
 I2C_REPLY_DICT = dict(token='I2C_REPLY', addr=0x4f, reg=0x00, data=[0xff, 0x00])
 
+def WaitFor(condition, timeout=2):
+  end = time.time() + timeout
+  while not condition() and time.time() < end:
+    time.sleep(0.01)
+  return condition()
+
+
 class MockSerial(object):
   def __init__(self, *args, **kargs):
     self.data = []
@@ -108,7 +123,7 @@ class MockSerial(object):
   def read(self, num=1, *args, **kargs):
     if num > len(self.data):
       raise Exception('Tried to read more bytes than available.')
-    ret = self.data[:num]
+    ret = ''.join(self.data[:num])
     del self.data[:num]
     return ret
 
@@ -148,6 +163,27 @@ class LexerTest(unittest.TestCase):
       state = state()
     self.assertEqual(dict(token='REPORT_FIRMWARE', major=5, minor=2, name='Test'), reader.q.get())
 
+  def test_SelectReader(self):
+    master, slave = os.openpty()
+    port = self._real_serial(os.ttyname(slave), 57600)
+    reader = io.SerialReader(port, None)
+    self.assertEqual(io.READER_SELECT, reader.mode)
+    reader.start()
+    while reader.stopped:  # Wait for the reader to flush its input.
+      time.sleep(0.01)
+    os.write(master, ''.join(FIRMATA_INIT))
+    try:
+      self.assertEqual(dict(token='PROTOCOL_VERSION', major=5, minor=2), reader.q.get(timeout=1))
+      self.assertEqual(dict(token='REPORT_FIRMWARE', major=5, minor=2, name='Test'), reader.q.get(timeout=1))
+    finally:
+      start = time.time()
+      reader.Shutdown()
+      reader.join()
+    self.assertLess(time.time() - start, io.READER_TIMEOUT)
+    port.close()
+    os.close(master)
+    os.close(slave)
+
   def test_Mondo(self):
     self._port.data = FIRMATA_INIT[:] + ARDUINO_CAPABILITY[:] + ARDUINO_ANALOG_MAPPING[:] + MONDO_DATA[:]
     board = firmata.Board('', 10, log_to_file=None, start_serial=True)
@@ -162,6 +198,20 @@ class LexerTest(unittest.TestCase):
     self.assertEqual(board.pin_state[13], 35)
     self.assertEqual(board.pin_state[2], True)
 
+  def test_MondoTableLexer(self):
+    self._port.data = FIRMATA_INIT[:] + ARDUINO_CAPABILITY[:] + ARDUINO_ANALOG_MAPPING[:] + MONDO_DATA[:]
+    board = firmata.Board('', 10, log_to_file=None, start_serial=True, lexer=io.LEXER_TABLE)
+    board.join(timeout=1)
+    board.StopCommunications()
+    self.assertEqual(len(board.errors), 1)
+    self.assertIn('RESERVED_COMMAND', board.errors[0])
+    self.assertIn({0: 1, 1: 1, 4: 14}, board.pin_config)
+    self.assertEqual(20, len(board.pin_config))
+    self.assertEqual('5.2', board.firmware_version)
+    self.assertEqual('Test', board.firmware_name)
+    self.assertEqual(board.pin_state[13], 35)
+    self.assertEqual(board.pin_state[2], True)
+
 class FirmataTest(unittest.TestCase):
   def setUp(self):
     super(FirmataTest, self).setUp()
@@ -180,13 +230,146 @@ class FirmataTest(unittest.TestCase):
       self.board.QueryPinState(i)
     self.board.join(timeout=1)
     self.board.StopCommunications()
-    self.assertEqual(self._port.output, [
+    self.assertEqual(''.join(self._port.output), ''.join([
        # 0xF0 (START_SYSEX), 0X6D (PIN_STATE_QUERY), pin, 0XF7 (END_SYSEX)
       '\xf0\x6d\x00\xf7', '\xf0\x6d\x01\xf7', '\xf0\x6d\x02\xf7', '\xf0\x6d\x03\xf7',
       '\xf0\x6d\x04\xf7', '\xf0\x6d\x05\xf7', '\xf0\x6d\x06\xf7', '\xf0\x6d\x07\xf7',
       '\xf0\x6d\x08\xf7', '\xf0\x6d\x09\xf7', '\xf0\x6d\x0a\xf7', '\xf0\x6d\x0b\xf7',
       '\xf0\x6d\x0c\xf7', '\xf0\x6d\x0d\xf7', '\xf0\x6d\x0e\xf7', '\xf0\x6d\x0f\xf7',
-      '\xf0\x6d\x10\xf7', '\xf0\x6d\x11\xf7', '\xf0\x6d\x12\xf7', '\xf0\x6d\x13\xf7',])
+      '\xf0\x6d\x10\xf7', '\xf0\x6d\x11\xf7', '\xf0\x6d\x12\xf7', '\xf0\x6d\x13\xf7',]))
+
+  def RespondToQueries(self, skip_pins=(), firmware=True):
+    """Makes the mock port answer firmware, capability, analog mapping and pin state queries as they are written."""
+    def Write(data):
+      self._port.output.append(data)
+      for query in data.split(chr(SYSEX_END))[:-1]:
+        if query[-2:] == chr(SYSEX_START) + chr(SE_REPORT_FIRMWARE) and firmware:
+          self._port.data.extend(FIRMATA_INIT)
+        elif query[1:2] == chr(SE_CAPABILITY_QUERY):
+          self._port.data.extend(ARDUINO_CAPABILITY)
+        elif query[1:2] == chr(SE_ANALOG_MAPPING_QUERY):
+          self._port.data.extend(ARDUINO_ANALOG_MAPPING)
+        elif query[1:2] == chr(SE_PIN_STATE_QUERY) and ord(query[2]) not in skip_pins:
+          self._port.data.extend(chr(i) for i in (SYSEX_START, SE_PIN_STATE_RESPONSE, ord(query[2]), MODE_INPUT, 1,
+                                                  SYSEX_END))
+    self._port.write = Write
+
+  def test_HandshakeHearsBoardReset(self):
+    self._port.data = FIRMATA_INIT[:]
+    board = firmata.Board('', 10, log_to_file=None, start_serial=False)
+    board.StartCommunications()
+    board.StopCommunications()
+    self.assertEqual('Test', board.firmware_name)
+    self.assertEqual([], self._port.output)  # Not probed.
+    self.assertLess(board.startup_timings['reset'], 1)
+
+  def test_HandshakeProbes(self):
+    board = firmata.Board('', 10, log_to_file=None, start_serial=False)
+    self.RespondToQueries()
+    board.StartCommunications(reset_timeout=0.05)
+    board.StopCommunications()
+    self.assertEqual('Test', board.firmware_name)
+    self.assertEqual(['reset', 'firmware'], board.startup_timings.keys())
+    self.assertGreaterEqual(board.startup_timings['reset'], 0.05)
+    self.assertLess(board.startup_timings['firmware'], 1)
+
+  def test_HandshakeFailsFast(self):
+    board = firmata.Board('', 10, log_to_file=None, start_serial=False)
+    self.RespondToQueries(firmware=False)
+    start = time.time()
+    with self.assertRaisesRegexp(firmata.HandshakeError, 'nothing at all was received'):
+      board.StartCommunications(reset_timeout=0.05, firmware_timeout=0.5, probe_interval=0.05)
+    self.assertLess(time.time() - start, 1)
+    board.StopCommunications()
+    probes = ''.join(self._port.output).count(chr(SE_REPORT_FIRMWARE))
+    self.assertTrue(3 <= probes <= 5, probes)  # 0.05s, then 0.1s, 0.2s, ... between probes.
+    self.assertEqual((), board._listeners['REPORT_FIRMWARE'])
+
+  def test_FailedHandshakeInConstructorStopsThreads(self):
+    def FailHandshake(*args):
+      raise firmata.HandshakeError('Nothing heard')
+    threads = set(threading.enumerate())
+    finish_handshake = firmata.Board._FinishHandshake
+    firmata.Board._FinishHandshake = FailHandshake
+    try:
+      self.assertRaises(firmata.HandshakeError, firmata.Board, '', 10, log_to_file=None, start_serial=True)
+    finally:
+      firmata.Board._FinishHandshake = finish_handshake
+    self.assertEqual(threads, set(threading.enumerate()))
+
+  def test_SequentialQueryTimesOut(self):
+    self._port.data = FIRMATA_INIT[:]
+    board = firmata.Board('', 10, log_to_file=None, start_serial=True)
+    self.RespondToQueries(skip_pins=(5,))
+    missing = board.QueryBoardCapabilitiesAndState(pipelined=False, timeout=2.5)  # Each round trip takes up to 0.2s.
+    board.StopCommunications()
+    self.assertEqual(range(5, 20), missing)
+    self.assertEqual(20, len(board.pin_config))
+    self.assertEqual(MODE_INPUT, board.pin_mode[4])
+
+  def test_PipelinedQueryBoardCapabilitiesAndState(self):
+    self._port.data = FIRMATA_INIT[:]
+    board = firmata.Board('', 10, log_to_file=None, start_serial=True)
+    self.RespondToQueries()
+    self.assertEqual([], board.QueryBoardCapabilitiesAndState(timeout=2))
+    board.StopCommunications()
+    self.assertEqual(20, len(board.pin_config))
+    self.assertEqual([13, 14, 15, 16, 17, 18], board.atod_map)
+    self.assertEqual([MODE_INPUT] * 20, [board.pin_mode[pin] for pin in xrange(20)])
+    self.assertEqual([], board.errors)
+
+  def test_PipelinedQueryReportsMissingPins(self):
+    self._port.data = FIRMATA_INIT[:]
+    board = firmata.Board('', 10, log_to_file=None, start_serial=True)
+    board.pin_config = [{}] * 20  # Known pins are queried together with the capabilities.
+    self.RespondToQueries(skip_pins=(3, 7))
+    self.assertEqual([3, 7], board.QueryBoardCapabilitiesAndState(timeout=0.5))
+    board.StopCommunications()
+    self.assertEqual('\xf0\x6b\xf7\xf0\x69\xf7' + ''.join('\xf0\x6d%s\xf7' % chr(pin) for pin in xrange(20)),
+                     ''.join(self._port.output))
+    self.assertEqual(['No pin state response for pins: 3, 7'], board.errors)
+
+  def test_CachedCapabilities(self):
+    cache_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, cache_dir)
+    cache = CapabilityCache(os.path.join(cache_dir, 'cache.json'))
+    self._port.data = FIRMATA_INIT[:]
+    board = firmata.Board('', 10, log_to_file=None, start_serial=True)
+    board.device_id, board.capability_cache = 'mock', cache
+    self.RespondToQueries()
+    board.QueryBoardCapabilitiesAndState(timeout=2)
+    board.StopCommunications()
+    self.assertEqual((board.pin_config, board.dtoa_map), cache.Get(CapabilityCache.Key('mock', 'Test', '5.2')))
+
+    self._port.data, self._port.output = FIRMATA_INIT[:], []
+    board = firmata.Board('', 10, log_to_file=None, start_serial=True)
+    board.device_id, board.capability_cache = 'mock', CapabilityCache(cache.path)
+    self.RespondToQueries()
+    self.assertEqual([], board.QueryBoardCapabilitiesAndState(timeout=2))
+    self.assertEqual(20, len(board.pin_config))
+    self.assertEqual([13, 14, 15, 16, 17, 18], board.atod_map)
+    self.assertNotIn('\xf0\x6b\xf7', ''.join(self._port.output))  # No capability query.
+    self.assertTrue(WaitFor(lambda: board._revalidating is None))
+    board.StopCommunications()
+    self.assertIsNotNone(board.capability_cache.Get(CapabilityCache.Key('mock', 'Test', '5.2')))
+
+  def test_CachedCapabilitiesMismatch(self):
+    for pipelined in (True, False):
+      cache_dir = tempfile.mkdtemp()
+      self.addCleanup(shutil.rmtree, cache_dir)
+      cache = CapabilityCache(os.path.join(cache_dir, 'cache.json'))
+      key = CapabilityCache.Key('mock', 'Test', '5.2')
+      cache.Put(key, [{MODE_INPUT: 1}] * 4, [False, False, False, 0])
+      self._port.data, self._port.output = FIRMATA_INIT[:], []
+      board = firmata.Board('', 10, log_to_file=None, start_serial=True)
+      board.device_id, board.capability_cache = 'mock', cache
+      self.RespondToQueries()
+      self.assertEqual([], board.QueryBoardCapabilitiesAndState(pipelined=pipelined, timeout=5))
+      board.StopCommunications()
+      self.assertEqual(20, len(board.pin_config), pipelined)
+      self.assertEqual([MODE_INPUT] * 20, [board.pin_mode[pin] for pin in xrange(20)], pipelined)
+      self.assertEqual([13, 14, 15, 16, 17, 18], board.atod_map, pipelined)
+      self.assertEqual((board.pin_config, board.dtoa_map), cache.Get(key), pipelined)  # Replaced by the board's own.
 
   def test_FirmataInit(self):
     self._port.data = FIRMATA_INIT[:] + ARDUINO_CAPABILITY[:] + ARDUINO_ANALOG_MAPPING[:] + ARDUINO_BOARD_STATE[:]
@@ -221,7 +404,7 @@ class FirmataTest(unittest.TestCase):
     board.digitalWrite(8, 0)
     board.join(timeout=1)
     board.StopCommunications()
-    self.assertEqual(self._port.output, ['\x91\x00\x00'])
+    self.assertEqual(''.join(self._port.output), '\x91\x00\x00')
 
   def test_digitalWriteDoesntLeakBits(self):
     """Test that digitalWrite() doesn't let one pin's value affect another's"""
@@ -232,7 +415,7 @@ class FirmataTest(unittest.TestCase):
     board.digitalWrite(8, 0)
     board.join(timeout=1)
     board.StopCommunications()
-    self.assertEqual(self._port.output, ['\x91\x40\x00'])
+    self.assertEqual(''.join(self._port.output), '\x91\x40\x00')
 
   # This test is flaky, not sure why
   # output seen:
@@ -246,7 +429,7 @@ class FirmataTest(unittest.TestCase):
     board.join(timeout=1)
     board.StopCommunications()
     print self._port.output
-    self.assertEqual(self._port.output, ['\x91\x00\x00'])
+    self.assertEqual(''.join(self._port.output), '\x91\x00\x00')
 
   def test_I2CRead(self):
     """Test simple I2C read query is properly sent and reply lexxed"""
@@ -262,9 +445,172 @@ class FirmataTest(unittest.TestCase):
     board.join(timeout=1)
     board.StopCommunications()
     #                            |    i2c config      |   | start | addr  |  reg  |   2   | end
-    self.assertEqual(self._port.output, ['\xf0\x78\x00\x00\xf7', '\xf0\x76\x4f\x08\x00\x00\x02\x00\xf7'])
+    self.assertEqual(''.join(self._port.output),
+                     ''.join(['\xf0\x78\x00\x00\xf7', '\xf0\x76\x4f\x08\x00\x00\x02\x00\xf7']))
     self.assertEqual(reply, I2C_REPLY_DICT['data'])
 
+  def test_I2CReadsInFlight(self):
+    """Test that concurrent I2C reads are matched to their replies by address and register"""
+    board = firmata.Board('', 10, log_to_file=None, start_serial=False)
+    device = board.I2CConfig(0)
+    first = device.I2CReadAsync(0x10, 0x01, 2)
+    second = device.I2CReadAsync(0x10, 0x02, 2)
+    third = device.I2CReadAsync(0x10, 0x01, 2)
+    other = device.I2CReadAsync(0x20, None, 1)
+    done = []
+    third.add_done_callback(done.append)
+    board.DispatchToken(tokens.I2cReply(0x10, 0x02, [2, 2]))
+    board.DispatchToken(tokens.I2cReply(0x20, 0x7f, [9]))
+    board.DispatchToken(tokens.I2cReply(0x10, 0x01, [1, 1]))
+    self.assertEqual([[1, 1], [2, 2], [9]], [first.result(0), second.result(0), other.result(0)])
+    self.assertFalse(third.done())
+    board.DispatchToken(tokens.I2cReply(0x10, 0x01, [3, 3]))
+    self.assertEqual([third], done)
+    self.assertEqual([3, 3], third.result(0))
+    self.assertEqual({}, device._pending)
+
+  def test_I2CReadTimeout(self):
+    board = firmata.Board('', 10, log_to_file=None, start_serial=False)
+    device = board.I2CConfig(0)
+    slow = device.I2CReadAsync(0x10, 0x01, 2, timeout=0.05)
+    fast = device.I2CReadAsync(0x10, 0x01, 2, timeout=5)
+    self.assertIsNone(slow.result())
+    self.assertFalse(fast.done())
+    board.DispatchToken(tokens.I2cReply(0x10, 0x01, [1, 1]))
+    self.assertEqual([1, 1], fast.result(0))
+    self.assertIsNone(device.I2CRead(0x11, None, 1, timeout=0.05))
+    self.assertEqual({}, device._pending)
+
+  def test_I2CContinuousRead(self):
+    board = firmata.Board('', 10, log_to_file=None, start_serial=False)
+    device = board.I2CConfig(0)
+    heard = []
+    stream = device.StartContinuousRead(0x10, 0x01, 2, capacity=3, callback=lambda t, data: heard.append(data))
+    self.assertIsNone(stream.Latest())
+    for i in xrange(5):
+      board.DispatchToken(tokens.I2cReply(0x10, 0x01, [i, i]))
+    self.assertEqual([[i, i] for i in xrange(5)], heard)
+    self.assertEqual([[2, 2], [3, 3], [4, 4]], [data for _, data in stream.Samples()])
+    self.assertEqual([[4, 4]], [data for _, data in stream.Samples(1)])
+    self.assertEqual([4, 4], stream.Latest()[1])
+    samples = iter(stream)
+    self.assertEqual([2, 2], next(samples)[1])
+    stream.Stop()
+    self.assertEqual([[3, 3], [4, 4]], [data for _, data in samples])
+    self.assertFalse(stream.active)
+    self.assertEqual([[SYSEX_START, SE_I2C_REQUEST, 0x10, I2C_READ_CONTINUOUSLY, 0x01, 0, 2, 0, SYSEX_END],
+                      [SYSEX_START, SE_I2C_REQUEST, 0x10, I2C_STOP_READING, SYSEX_END]],
+                     list(board.port.writer.q.queue)[1:])
+
+  def test_RecordHistory(self):
+    board = firmata.Board('', 10, log_to_file=None, start_serial=False)
+    board.atod_map = [14, 15]
+    board.DispatchToken(tokens.AnalogMessage(0, 100))
+    self.assertEqual({}, board.histories)
+    board.RecordHistory(capacity=2)
+    for value in (200, 300, 400):
+      board.DispatchToken(tokens.AnalogMessage(0, value))
+    board.DispatchToken(tokens.DigitalMessage(0, 0x05))
+    self.assertEqual([300, 400], list(board.History(14).Last().values()))
+    self.assertEqual(400, board.pin_state[14])
+    self.assertEqual([1], list(board.History(0).Last().values()))
+    self.assertEqual([0], list(board.History(1).Last().values()))
+    self.assertIsNone(board.History(15))
+    board.StopRecordingHistory()
+    board.DispatchToken(tokens.AnalogMessage(1, 5))
+    self.assertIsNone(board.History(15))
+    self.assertEqual(5, board.pin_state[15])
+
+  def test_RecordHistoryOfSomePins(self):
+    board = firmata.Board('', 10, log_to_file=None, start_serial=False)
+    board.atod_map = [14, 15]
+    board.RecordHistory(pins=[15])
+    board.DispatchToken(tokens.AnalogMessage(0, 1))
+    board.DispatchToken(tokens.AnalogMessage(1, 2))
+    self.assertEqual([15], board.histories.keys())
+    self.assertEqual([2], list(board.History(15).Last().values()))
+
+  def test_ReadAll(self):
+    board = firmata.Board('', 10, log_to_file=None, start_serial=False)
+    board.atod_map = [14, 15, 16]
+    board.pin_config = [{}] * 17
+    board.DispatchToken(tokens.AnalogMessage(0, 100))
+    board.DispatchToken(tokens.AnalogMessage(2, 300))
+    board.DispatchToken(tokens.DigitalMessage(0, 0x05))
+    values, updated = board.analogReadAll()
+    self.assertEqual(array('l', [100, 0, 300]), values)
+    self.assertEqual(0, updated[1])
+    self.assertTrue(0 < updated[0] <= updated[2] <= time.time())
+    values, updated = board.digitalReadAll()
+    self.assertEqual(17, len(values))
+    self.assertEqual([1, 0, 1, 0, 0, 0, 0, 0], list(values[:8]))
+    self.assertEqual(100, values[14])
+    self.assertEqual(updated[0], updated[2])
+    self.assertEqual(0, updated[1])  # Still low, so the report did not change it.
+
+  def test_ReadAllIsConsistent(self):
+    board = firmata.Board('', 10, log_to_file=None, start_serial=False)
+    board.pin_config = [{}] * 8
+    stop = threading.Event()
+    def Dispatch():
+      mask = 0
+      while not stop.is_set():
+        mask ^= 0xff
+        board.DispatchToken(tokens.DigitalMessage(0, mask))
+    dispatcher = threading.Thread(target=Dispatch)
+    dispatcher.start()
+    try:
+      for _ in xrange(1000):
+        values, updated = board.digitalReadAll()
+        self.assertEqual(1, len(set(values)))
+        self.assertEqual(1, len(set(updated)))
+    finally:
+      stop.set()
+      dispatcher.join()
+
+  def test_DigitalMessageOnlySetsChangedPins(self):
+    board = firmata.Board('', 10, log_to_file=None, start_serial=False)
+    board.digitalWrite(3, 1)  # An output pin, which reports always show as low.
+    board.DispatchToken(tokens.DigitalMessage(0, 0x01))
+    self.assertEqual([1, 0, 0, 1], list(board.pin_state[:4]))
+    self.assertEqual(0x01, board.port_mask[0])
+    first_report = board.port_updated[0]
+    self.assertEqual(first_report, board.pin_updated[0])
+    board.DispatchToken(tokens.DigitalMessage(0, 0x03))
+    self.assertEqual([1, 1, 0, 1], list(board.pin_state[:4]))
+    self.assertEqual(first_report, board.pin_updated[0])
+    self.assertEqual(board.port_updated[0], board.pin_updated[1])
+
+  def test_DigitalMessageOverridesWrittenInputs(self):
+    """Test that a report of a low input pin clears a value written to it, though the last report also had it low"""
+    board = firmata.Board('', 10, log_to_file=None, start_serial=False)
+    board.pin_mode[2] = MODE_INPUT
+    board.DispatchToken(tokens.DigitalMessage(0, 0x00))
+    board.digitalWrite(2, 1)  # Enables the pullup, but the pin is still pulled low.
+    board.DispatchToken(tokens.DigitalMessage(0, 0x00))
+    self.assertEqual(0, board.pin_state[2])
+    board.DispatchToken(tokens.PinStateResponse(2, MODE_INPUT, 1))
+    board.DispatchToken(tokens.DigitalMessage(0, 0x00))
+    self.assertEqual(0, board.pin_state[2])
+
+  def test_EdgeListeners(self):
+    board = firmata.Board('', 10, log_to_file=None, start_serial=False)
+    edges = []
+    rising = []
+    Listener = lambda pin, value, timestamp: edges.append((pin, value))
+    board.AddEdgeListener(9, Listener)
+    board.AddEdgeListener(10, Listener)
+    board.AddEdgeListener(9, lambda pin, value, timestamp: rising.append(timestamp), edges=firmata.RISING)
+    for mask in (0x02, 0x02, 0x06, 0x00, 0x01):
+      board.DispatchToken(tokens.DigitalMessage(1, mask))
+    self.assertEqual([(9, 1), (10, 1), (9, 0), (10, 0)], edges)
+    self.assertEqual(1, len(rising))
+    self.assertTrue(rising[0] <= board.pin_updated[9])
+    board.RemoveEdgeListener(9, Listener)
+    board.DispatchToken(tokens.DigitalMessage(1, 0x07))
+    self.assertEqual([(10, 1)], edges[4:])
+    self.assertEqual(2, len(rising))
+
   def test_I2CWriteSend(self):
     """Test simple I2C write query is properly sent"""
     self._port.data = FIRMATA_INIT[:] + ARDUINO_CAPABILITY[:] + ARDUINO_ANALOG_MAPPING[:] + ARDUINO_BOARD_STATE[:]
@@ -274,7 +620,44 @@ class FirmataTest(unittest.TestCase):
     board.join(timeout=1)
     board.StopCommunications()
     #                                    |    i2c config      |   | start | addr  |  reg  |   2 bytes     | end
-    self.assertEqual(self._port.output, ['\xf0\x78\x00\x00\xf7', '\xf0\x76\x4f\x00\x00\x00\x7f\x00\x7f\x01\xf7'])
+    self.assertEqual(''.join(self._port.output),
+                     ''.join(['\xf0\x78\x00\x00\xf7', '\xf0\x76\x4f\x00\x00\x00\x7f\x00\x7f\x01\xf7']))
+
+  def test_WriterBatching(self):
+    """Test that commands queued while the writer is busy go out in a single write"""
+    writer = io.SerialWriter(self._port, None)
+    for pin in xrange(50):
+      writer.q.put([ANALOG_MESSAGE + (pin % 16), pin, 0])
+    writer.q.put(None)
+    writer.run()
+    self.assertEqual(1, len(self._port.output))
+    self.assertEqual(150, len(self._port.output[0]))
+    self.assertEqual((1, 150, 150.0), (writer.batches, writer.bytes_written, writer.average_batch_size))
+
+  def test_WriterMaxBytes(self):
+    writer = io.SerialWriter(self._port, None, max_bytes=10)
+    for pin in xrange(8):
+      writer.q.put([ANALOG_MESSAGE, pin, 0])
+    writer.q.put(None)
+    writer.run()
+    self.assertEqual([12, 12], [len(output) for output in self._port.output])
+
+  def test_WriterCoalescing(self):
+    """Test that pending pin writes are replaced by newer ones, but not across other commands"""
+    writer = io.SerialWriter(self._port, None, coalesce=True)
+    for value in xrange(100):
+      writer.Put([ANALOG_MESSAGE + 3, value, 0])
+      writer.Put([DIGITAL_MESSAGE + 1, value & 1, 0])
+    writer.Put([SET_PIN_MODE, 3, MODE_SERVO])
+    writer.Put([ANALOG_MESSAGE + 3, 5, 1])
+    writer.Put([ANALOG_MESSAGE + 4, 6, 1])
+    writer.Put([ANALOG_MESSAGE + 3, 7, 1])
+    writer.q.put(None)
+    writer.run()
+    self.assertEqual(''.join(self._port.output), ''.join(chr(i) for i in (
+        ANALOG_MESSAGE + 3, 99, 0, DIGITAL_MESSAGE + 1, 1, 0, SET_PIN_MODE, 3, MODE_SERVO,
+        ANALOG_MESSAGE + 3, 7, 1, ANALOG_MESSAGE + 4, 6, 1)))
+    self.assertEqual(199, writer.coalesced)
 
   def test_ListenerReuse(self):
     """Test that DispatchToken() will properly recycle listeners that request it"""
@@ -285,7 +668,7 @@ class FirmataTest(unittest.TestCase):
     board.AddListener(FAKE_TOKEN, FakeListener)
     token = {'token': FAKE_TOKEN}
     board.DispatchToken(token)
-    self.assertEqual(board._listeners[FAKE_TOKEN], [FakeListener])
+    self.assertEqual(board._listeners[FAKE_TOKEN], (FakeListener,))
 
   def test_OneTimeListener(self):
     """Test that DispatchToken() will properly delete listeners that request it"""
@@ -296,7 +679,25 @@ class FirmataTest(unittest.TestCase):
     board.AddListener(FAKE_TOKEN, FakeListener)
     token = {'token': FAKE_TOKEN}
     board.DispatchToken(token)
-    self.assertEqual(board._listeners[FAKE_TOKEN], [])
+    self.assertEqual(board._listeners[FAKE_TOKEN], ())
+
+  def test_RemoveListener(self):
+    """Test that RemoveListener() unregisters only the given listener"""
+    board = firmata.Board('', 10, log_to_file=None, start_serial=False)
+    calls = []
+    def First(token):
+      calls.append('first')
+      return (False, False)
+    def Second(token):
+      calls.append('second')
+      return (False, False)
+    board.AddListener('STRING_MESSAGE', First)
+    board.AddListener('STRING_MESSAGE', Second)
+    board.RemoveListener('STRING_MESSAGE', First)
+    board.RemoveListener('STRING_MESSAGE', First)
+    board.DispatchToken({'token': 'STRING_MESSAGE', 'message': 'hi'})
+    self.assertEqual(['second'], calls)
+    self.assertEqual(['hi'], board.errors)
 
   def test_SetSamplingInterval(self):
     self._port.data = FIRMATA_INIT[:] + ARDUINO_CAPABILITY[:] + ARDUINO_ANALOG_MAPPING[:]
@@ -305,7 +706,7 @@ class FirmataTest(unittest.TestCase):
     board.SetSamplingInterval()
     board.join(timeout=1)
     board.StopCommunications()
-    self.assertEqual(self._port.output, ['\xf0\x7a\x68\x07\xf7', '\xf0\x7a\x13\x00\xf7'])
+    self.assertEqual(''.join(self._port.output), ''.join(['\xf0\x7a\x68\x07\xf7', '\xf0\x7a\x13\x00\xf7']))
 
   def test_StringData(self):
     self._port.data = FIRMATA_INIT[:] + ARDUINO_CAPABILITY[:] + ARDUINO_ANALOG_MAPPING[:] + FIRMATA_STRING_DATA[:]
@@ -0,0 +1,104 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import random
+import unittest2 as unittest
+
+from firmata import io
+from firmata.constants import *
+from firmata.lexer import TableLexer
+from tests.test_io import (ARDUINO_ANALOG_MAPPING, ARDUINO_BOARD_STATE, ARDUINO_CAPABILITY, FIRMATA_INIT,
+                           FIRMATA_STRING_DATA, I2C_REPLY_MESSAGE, MONDO_DATA)
+
+
+CORRUPT_DATA = [chr(i) for i in (
+  ANALOG_MESSAGE_0, 0x23,  # Truncated analog message
+  ANALOG_MESSAGE_1, 0x10, 0x00,
+  SET_PIN_MODE, 0x02, 0x01,  # Not something a board sends
+  DIGITAL_MESSAGE_1, 0x01, 0x00,
+  SYSEX_START, SE_SERVO_CONFIG, 0x01, 0x02, SYSEX_END,  # Unknown sysex command
+  SYSEX_START, SE_STRING_DATA, 0x48, 0x00, ANALOG_MESSAGE_2, 0x01, SYSEX_END,  # High byte inside a sysex body
+  PROTOCOL_VERSION, 0x2, 0x3,
+)]
+
+
+class DrainedSerial(object):
+  """A port which stops the SerialReader using it once all of its data has been read."""
+  def __init__(self, data):
+    self.data = ''.join(data)
+
+  def inWaiting(self):
+    if not self.data:
+      raise io.ShutdownException()
+    return len(self.data)
+
+  def read(self, num=1):
+    ret, self.data = self.data[:num], self.data[num:]
+    return ret
+
+  def flushInput(self):
+    pass
+
+
+def PikeTokens(data):
+  reader = io.SerialReader(DrainedSerial(data), None, mode=io.READER_SLEEP, lexer=io.LEXER_PIKE)
+  reader.run()
+  return [reader.q.get() for _ in xrange(reader.q.qsize())]
+
+
+def TableTokens(data, chunk_sizes=None):
+  tokens = []
+  lexer = TableLexer(tokens.append)
+  data = ''.join(data)
+  while data:
+    size = chunk_sizes.next() if chunk_sizes else len(data)
+    lexer.Feed(data[:size])
+    data = data[size:]
+  return tokens
+
+
+class TableLexerTest(unittest.TestCase):
+  STREAMS = [
+    FIRMATA_INIT + ARDUINO_CAPABILITY + ARDUINO_ANALOG_MAPPING + ARDUINO_BOARD_STATE,
+    MONDO_DATA + FIRMATA_STRING_DATA + I2C_REPLY_MESSAGE,
+    CORRUPT_DATA,
+    MONDO_DATA + CORRUPT_DATA + MONDO_DATA,
+  ]
+
+  def test_MatchesPikeLexer(self):
+    for stream in self.STREAMS:
+      self.assertEqual(PikeTokens(stream), TableTokens(stream))
+
+  def test_MatchesPikeLexerWhenSplit(self):
+    rand = random.Random(1)
+    def RandomSizes():
+      while True:
+        yield rand.randint(1, 7)
+    for stream in self.STREAMS:
+      expected = PikeTokens(stream)
+      self.assertEqual(expected, TableTokens(stream, (1 for _ in iter(int, 1))))
+      for _ in xrange(20):
+        self.assertEqual(expected, TableTokens(stream, RandomSizes()))
+
+  def test_ErrorRecovery(self):
+    tokens = TableTokens(CORRUPT_DATA)
+    # The command byte that interrupts a message is consumed along with it, so ANALOG_MESSAGE_1 is lost.
+    self.assertEqual(['ERROR', 'ERROR', 'DIGITAL_MESSAGE', 'ERROR', 'ERROR', 'PROTOCOL_VERSION'],
+                     [token['token'] for token in tokens])
+    self.assertEqual(dict(token='DIGITAL_MESSAGE', port=1, pins=[True] + [False] * 7), tokens[2])
+
+  def test_TruncatedSysex(self):
+    tokens = TableTokens([chr(i) for i in (SYSEX_START, SE_PIN_STATE_RESPONSE, 0x01, SYSEX_END,
+                                           PROTOCOL_VERSION, 1, 2)])
+    self.assertEqual('ERROR', tokens[0]['token'])
+    self.assertEqual(dict(token='PROTOCOL_VERSION', major=1, minor=2), tokens[1])
@@ -0,0 +1,128 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import urllib2
+import unittest2 as unittest
+
+import firmata
+from firmata import io
+from firmata import metrics
+from firmata import tokens
+from firmata.constants import *
+from firmata.lexer import TableLexer
+from tests.test_io import FIRMATA_INIT, MockSerial, WaitFor
+
+
+# One bad byte inside an analog message, then a good one.
+CORRUPT_DATA = [chr(i) for i in (ANALOG_MESSAGE_0, 0x01, PROTOCOL_VERSION, 0x05, 0x02, ANALOG_MESSAGE_1, 0x02, 0x00)]
+
+
+class HistogramTest(unittest.TestCase):
+  def test_Snapshot(self):
+    histogram = metrics.Histogram(bounds=(0.001, 0.01))
+    for value in (0.0005, 0.001, 0.005, 1):
+      histogram.Observe(value)
+    snapshot = histogram.Snapshot()
+    self.assertEqual([(0.001, 2), (0.01, 3), (float('inf'), 4)], snapshot['buckets'])
+    self.assertEqual(4, snapshot['count'])
+    self.assertAlmostEqual(1.0065, snapshot['sum'])
+
+
+class MetricsTest(unittest.TestCase):
+  def setUp(self):
+    super(MetricsTest, self).setUp()
+    self.port = MockSerial()
+    self.board = None
+
+  def tearDown(self):
+    super(MetricsTest, self).tearDown()
+    if self.board and self.board.is_alive():
+      self.board.StopCommunications()
+
+  def StartBoard(self, data, **options):
+    self.port.data = data
+    self.board = firmata.Board('/dev/fake', 57600, log_to_file=None, start_serial=False, transport=self.port,
+                               reader_mode=io.READER_SLEEP, **options)
+    self.board.firmware_name = 'Fake'  # Skips the handshake.
+    self.board.atod_map = range(16)
+    self.board.StartCommunications()
+    return self.board
+
+  def test_Stats(self):
+    board = self.StartBoard(FIRMATA_INIT[:] + [chr(ANALOG_MESSAGE_0), chr(1), chr(0)] * 200)
+    self.assertTrue(WaitFor(lambda: board._token_counts[tokens.AnalogMessage.TAG] == 200))
+    board.QueryFirmwareVersionAndString()
+    self.assertTrue(WaitFor(lambda: board.Stats()['bytes_out'] == 3))
+    earlier = board.Stats()
+    metrics.FormatPrometheus([board])  # Scrapes do not disturb other callers' rates.
+    stats = board.Stats(since=earlier)
+    self.assertEqual(len(FIRMATA_INIT) + 600, stats['bytes_in'])
+    self.assertEqual(200, stats['tokens']['ANALOG_MESSAGE'])
+    self.assertEqual(1, stats['tokens']['REPORT_FIRMWARE'])
+    self.assertGreater(earlier['token_rates']['ANALOG_MESSAGE'], 0)  # Since the board was created.
+    self.assertEqual(0, stats['token_rates']['ANALOG_MESSAGE'])  # Nothing since earlier.
+    self.assertEqual({'reader': 0, 'writer': 0}, stats['queue_depths'])
+    self.assertEqual(0, stats['lexer_errors'])
+    self.assertEqual(202 // metrics.LATENCY_SAMPLE_EVERY, stats['dispatch_latency']['count'])
+
+  def test_InlineDispatch(self):
+    for dispatch_mode in (firmata.DISPATCH_INLINE, firmata.DISPATCH_BATCHED):
+      board = self.StartBoard(FIRMATA_INIT[:] + [chr(ANALOG_MESSAGE_0), chr(1), chr(0)] * 200,
+                              dispatch_mode=dispatch_mode)
+      self.assertTrue(WaitFor(lambda: board._token_counts[tokens.AnalogMessage.TAG] == 200))
+      self.assertFalse(board.is_alive())  # The reader dispatches, so the board thread is never started.
+      stats = board.Stats()
+      self.assertEqual(200, stats['tokens']['ANALOG_MESSAGE'])
+      self.assertEqual(202 // metrics.LATENCY_SAMPLE_EVERY, stats['dispatch_latency']['count'])
+      board.StopCommunications()
+    self.assertRaises(ValueError, firmata.Board, '/dev/fake', 57600, transport=self.port, dispatch_mode='eventually')
+
+  def test_LexerCounters(self):
+    for lexer in (io.LEXER_PIKE, io.LEXER_TABLE):
+      board = self.StartBoard(CORRUPT_DATA[:], lexer=lexer)
+      self.assertTrue(WaitFor(lambda: board.pin_state[1] == 2))
+      stats = board.Stats()
+      self.assertEqual((1, 1), (stats['lexer_errors'], stats['lexer_recoveries']), lexer)
+      self.assertEqual(1, stats['tokens']['ERROR'])
+      board.StopCommunications()
+
+  def test_TableLexerCounters(self):
+    lexer = TableLexer(lambda token: None)
+    lexer.Feed(bytearray([0x01, 0x02, SYSEX_END, ANALOG_MESSAGE_0, 0x01, 0x00]))
+    self.assertEqual((1, 1, 2), (lexer.lex_errors, lexer.lex_recoveries, lexer.lex_skipped))
+
+  def test_Prometheus(self):
+    board = firmata.Board('/dev/fake', 57600, log_to_file=None, start_serial=False, transport=self.port)
+    board.atod_map = range(16)
+    board.DispatchToken(tokens.AnalogMessage(0, 1))
+    text = metrics.FormatPrometheus([board])
+    self.assertIn('# TYPE firmata_tokens_total counter\n', text)
+    self.assertIn('firmata_tokens_total{board="/dev/fake",type="ANALOG_MESSAGE"} 1\n', text)
+    self.assertIn('firmata_queue_depth{board="/dev/fake",queue="reader"} 0\n', text)
+    self.assertIn('firmata_queue_overflows_total{board="/dev/fake",queue="writer"} 0\n', text)
+    self.assertIn('firmata_dispatch_latency_seconds_bucket{board="/dev/fake",le="+Inf"} 0\n', text)
+    self.assertIn('firmata_bytes_in_total{board="/dev/fake"} 0\n', text)
+
+  def test_ServeMetrics(self):
+    board = firmata.Board('/dev/fake', 57600, log_to_file=None, start_serial=False, transport=self.port)
+    server = metrics.ServeMetrics([board])
+    try:
+      url = 'http://%s:%d/metrics' % server.address
+      self.assertEqual(metrics.FormatPrometheus([board]), urllib2.urlopen(url).read())
+      self.assertRaises(urllib2.HTTPError, urllib2.urlopen, url.replace('/metrics', '/other'))
+    finally:
+      server.Shutdown()
+
+
+if __name__ == '__main__':
+  unittest.main()
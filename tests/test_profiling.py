@@ -0,0 +1,124 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+import unittest2 as unittest
+
+import firmata
+from firmata import io
+from firmata import metrics
+from firmata import profiling
+from firmata import tokens
+from firmata.constants import *
+from tests.test_io import FIRMATA_INIT, MockSerial, WaitFor
+
+
+class FlameCollectorTest(unittest.TestCase):
+  def test_Folded(self):
+    collector = profiling.FlameCollector()
+    collector(profiling.STAGE_READ, None, 0.000010)
+    collector(profiling.STAGE_LEX, 'ANALOG_MESSAGE', 0.000002)
+    collector(profiling.STAGE_DISPATCH, 'ANALOG_MESSAGE', 0.000005)
+    collector(profiling.STAGE_HANDLER, 'ANALOG_MESSAGE', 0.000003)
+    collector(profiling.STAGE_HANDLER, 'ANALOG_MESSAGE', 0.000001)
+    self.assertEqual((2, 0.000004, 0.000003), collector.Totals()[(profiling.STAGE_HANDLER, 'ANALOG_MESSAGE')])
+    self.assertEqual('board;dispatch;ANALOG_MESSAGE 1\n'
+                     'board;dispatch;ANALOG_MESSAGE;handler 4\n'
+                     'reader;lex;ANALOG_MESSAGE 2\n'
+                     'reader;read 10\n', collector.Folded())
+    summary = collector.Summary().splitlines()
+    self.assertEqual(5, len(summary))
+    self.assertTrue(summary[1].startswith('read '))  # Slowest first.
+
+
+class ProfilerTest(unittest.TestCase):
+  def setUp(self):
+    super(ProfilerTest, self).setUp()
+    self.port = MockSerial()
+    self.board = firmata.Board('/dev/fake', 57600, log_to_file=None, start_serial=False, transport=self.port,
+                               reader_mode=io.READER_SLEEP)
+    self.board.atod_map = range(16)
+    self.collector = profiling.FlameCollector()
+
+  def tearDown(self):
+    super(ProfilerTest, self).tearDown()
+    if self.board.is_alive():
+      self.board.StopCommunications()
+
+  def test_DispatchAndHandler(self):
+    board = firmata.BaseBoard(self.port)  # Without a reader, one token in sample_every is sampled at dispatch.
+    board.atod_map = range(16)
+    board.SetProfiler(self.collector, sample_every=2)
+    board.RecordHistory(pins=[0])  # Handlers swapped in while profiling are profiled too.
+    for value in xrange(4):
+      board._dispatch(tokens.AnalogMessage(0, value))
+    totals = self.collector.Totals()
+    self.assertEqual(2, totals[(profiling.STAGE_DISPATCH, 'ANALOG_MESSAGE')][0])
+    self.assertEqual(2, totals[(profiling.STAGE_HANDLER, 'ANALOG_MESSAGE')][0])
+    self.assertNotIn((profiling.STAGE_HANDOFF, 'ANALOG_MESSAGE'), totals)
+    self.assertEqual(4, len(board.History(0)))
+    board.SetProfiler(None)
+    self.assertEqual(board.DispatchToken, board._dispatch)
+    self.assertEqual(board._HandleAnalogMessageRecording, board._handlers[tokens.AnalogMessage.TAG])
+
+  def test_Disable(self):
+    self.board.SetProfiler(self.collector)
+    self.board.SetProfiler(None)
+    self.assertEqual(self.board.DispatchToken, self.board._dispatch)
+    self.assertEqual(self.board._HandleAnalogMessage, self.board._handlers[tokens.AnalogMessage.TAG])
+    self.assertNotIn('Emit', self.board.port.reader.__dict__)
+    self.assertEqual(self.board.port.reader._unprofiled_read, self.board.port.reader._Read)
+
+  def test_ThreadedBoard(self):
+    for lexer, dispatch_mode in [(lexer, mode) for lexer in (io.LEXER_PIKE, io.LEXER_TABLE)
+                                 for mode in firmata.DISPATCH_MODES]:
+      self.port.data = FIRMATA_INIT[:] + [chr(ANALOG_MESSAGE_0), chr(1), chr(0)] * 64
+      self.collector = profiling.FlameCollector()
+      self.board = firmata.Board('/dev/fake', 57600, log_to_file=None, start_serial=False, transport=self.port,
+                                 reader_mode=io.READER_SLEEP, lexer=lexer, dispatch_mode=dispatch_mode)
+      self.board.firmware_name = 'Fake'  # Skips the handshake.
+      self.board.atod_map = range(16)
+      self.board.SetProfiler(self.collector, sample_every=16)
+      self.board.StartCommunications()
+      self.assertTrue(WaitFor(lambda: self.board._token_counts[tokens.AnalogMessage.TAG] == 64))
+      self.board.StopCommunications()
+      totals = self.collector.Totals()
+      self.assertIn((profiling.STAGE_READ, None), totals, (lexer, dispatch_mode))
+      self.assertEqual(4, totals[(profiling.STAGE_LEX, 'ANALOG_MESSAGE')][0], (lexer, dispatch_mode))
+      self.assertEqual(4, totals[(profiling.STAGE_HANDOFF, 'ANALOG_MESSAGE')][0], (lexer, dispatch_mode))
+      self.assertEqual(4, totals[(profiling.STAGE_DISPATCH, 'ANALOG_MESSAGE')][0], (lexer, dispatch_mode))
+
+  def test_DroppedSamples(self):
+    """Test that samples of tokens dropped from a full reader queue do not hold up the ones after them"""
+    count = 5 * metrics.LATENCY_SAMPLE_EVERY  # The last sampled token, and the PROTOCOL_VERSION after it, stay queued.
+    self.port.data = [chr(ANALOG_MESSAGE_0), chr(1), chr(0)] * count + [chr(PROTOCOL_VERSION), chr(2), chr(3)]
+    self.board = firmata.Board('/dev/fake', 57600, log_to_file=None, start_serial=False, transport=self.port,
+                               reader_mode=io.READER_SLEEP, reader_queue_size=10)
+    self.board.firmware_name = 'Fake'  # Skips the handshake.
+    self.board.atod_map = range(16)
+    self.board.SetProfiler(self.collector, sample_every=16)
+    release = threading.Event()
+    self.board.AddListener('ANALOG_MESSAGE', lambda token: (release.wait(), (False, False))[1])
+    reader = self.board.port.reader
+    self.board.StartCommunications()
+    try:
+      self.assertTrue(WaitFor(lambda: reader.q.queue and reader.q.queue[-1]['token'] == 'PROTOCOL_VERSION'))
+      self.assertGreater(reader.q.dropped, 0)
+      release.set()
+      self.assertTrue(WaitFor(lambda: self.board.firmware_version == '2.3'))
+    finally:
+      release.set()
+    self.assertEqual(0, len(reader.profile_marks))
+    self.assertEqual(0, len(reader.lex_marks))
+    self.assertGreaterEqual(self.collector.Totals()[(profiling.STAGE_HANDOFF, 'ANALOG_MESSAGE')][0], 1)
+    self.assertGreaterEqual(self.board.dispatch_latency.Snapshot()['count'], 1)
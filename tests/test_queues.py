@@ -0,0 +1,170 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from Queue import Full
+import threading
+import unittest2 as unittest
+
+import firmata
+from firmata import io
+from firmata import queues
+from firmata import tokens
+from firmata.constants import *
+from tests.test_io import MockSerial, WaitFor
+
+
+def Drain(q):
+  return [q.get_nowait() for _ in xrange(q.qsize())]
+
+
+class BoundedQueueTest(unittest.TestCase):
+  def test_Unbounded(self):
+    q = queues.BoundedQueue()
+    for i in xrange(1000):
+      q.put(i)
+    self.assertEqual(range(1000), Drain(q))
+    self.assertEqual({}, q.overflows)
+
+  def test_DropOldestSparesOtherClasses(self):
+    q = queues.BoundedQueue(3, policies={'sample': queues.DROP_OLDEST}, classify=lambda item: item[0])
+    for item in (('reply', 1), ('sample', 2), ('sample', 3), ('sample', 4), ('sample', 5)):
+      q.put(item)
+    self.assertEqual([('reply', 1), ('sample', 4), ('sample', 5)], Drain(q))
+    self.assertEqual(({'sample': 2}, 2), (q.overflows, q.dropped))
+    for _ in xrange(3):
+      q.task_done()
+    q.join()  # Dropped items do not count as unfinished.
+
+  def test_DropOldestWithNothingToDrop(self):
+    q = queues.BoundedQueue(1, policies={'sample': queues.DROP_OLDEST}, classify=lambda item: item[0])
+    q.put(('reply', 1))
+    q.put(('sample', 2))
+    self.assertEqual([('reply', 1)], Drain(q))
+    self.assertEqual(1, q.dropped)
+
+  def test_BlockMakesRoomFromDroppableItems(self):
+    q = queues.BoundedQueue(2, policies={'sample': queues.DROP_OLDEST}, classify=lambda item: item[0])
+    for item in (('sample', 1), ('sample', 2), ('reply', 3), ('reply', 4)):
+      q.put(item)
+    self.assertEqual([('reply', 3), ('reply', 4)], Drain(q))
+    self.assertEqual(({'reply': 2}, 2), (q.overflows, q.dropped))
+
+  def test_DropNewest(self):
+    q = queues.BoundedQueue(2, queues.DROP_NEWEST)
+    for i in xrange(5):
+      q.put(i)
+    self.assertEqual([0, 1], Drain(q))
+    self.assertEqual(({None: 3}, 3), (q.overflows, q.dropped))
+
+  def test_Raise(self):
+    q = queues.BoundedQueue(1, queues.RAISE)
+    q.put(0)
+    self.assertRaises(Full, q.put, 1)
+    self.assertEqual({None: 1}, q.overflows)
+
+  def test_Block(self):
+    q = queues.BoundedQueue(1)
+    q.put(0)
+    self.assertRaises(Full, q.put, 1, timeout=0.01)
+    taker = threading.Timer(0.05, q.get)
+    taker.start()
+    q.put(2)
+    taker.join()
+    self.assertEqual([2], Drain(q))
+    self.assertEqual(0, q.dropped)
+
+  def test_ShutdownSignalIsNeverDropped(self):
+    q = queues.BoundedQueue(1, queues.DROP_NEWEST)
+    q.put(0)
+    threading.Timer(0.05, q.get).start()
+    q.put(None)
+    self.assertEqual([None], Drain(q))
+
+  def test_HighWater(self):
+    calls = []
+    q = queues.BoundedQueue(8, queues.DROP_NEWEST, name='test', on_high_water=lambda *args: calls.append(args))
+    for i in xrange(10):
+      q.put(i)
+    self.assertEqual([('test', 6)], calls)
+    for _ in xrange(4):
+      q.get()
+    q.put(10)
+    self.assertEqual(1, len(calls))  # Not yet drained to half the high water mark.
+    for _ in xrange(2):
+      q.get()
+    for i in xrange(11, 14):
+      q.put(i)
+    self.assertEqual([('test', 6), ('test', 6)], calls)
+
+  def test_UnknownPolicy(self):
+    self.assertRaises(ValueError, queues.BoundedQueue, 1, 'sometimes')
+
+
+class PortQueuesTest(unittest.TestCase):
+  def test_ReaderDropsOldSamples(self):
+    reader = io.SerialReader(MockSerial(), None, max_queued=2)
+    reader.Emit(tokens.AnalogMessage(0, 1))
+    reader.Emit(tokens.ReportFirmware(2, 3, 'Fake'))
+    reader.Emit(tokens.AnalogMessage(0, 2))
+    reader.Emit(tokens.AnalogMessage(0, 3))
+    self.assertEqual(['REPORT_FIRMWARE', 'ANALOG_MESSAGE'], [token['token'] for token in Drain(reader.q)])
+    self.assertEqual({'ANALOG_MESSAGE': 2}, reader.q.overflows)
+
+  def test_ReaderCannotRaise(self):
+    self.assertRaises(ValueError, io.SerialReader, MockSerial(), None, overflow={'REPORT_FIRMWARE': queues.RAISE})
+
+  def test_WriterRaises(self):
+    board = firmata.Board('', 10, log_to_file=None, start_serial=False, transport=MockSerial(), writer_queue_size=2,
+                          writer_overflow=queues.RAISE)
+    board.SetSamplingInterval(10)
+    board.SetSamplingInterval(20)
+    self.assertRaises(Full, board.SetSamplingInterval, 30)
+    self.assertEqual({'reader': 0, 'writer': 1}, board.Stats()['queue_overflows'])
+
+  def test_CoalescedWritesCannotBeDropped(self):
+    self.assertRaises(ValueError, io.SerialWriter, MockSerial(), None, coalesce=True, overflow=queues.DROP_OLDEST)
+
+  def test_CoalescedWriteRaises(self):
+    writer = io.SerialWriter(MockSerial(), None, coalesce=True, max_queued=1, overflow=queues.RAISE)
+    writer.Put([SET_PIN_MODE, 2, MODE_OUTPUT])
+    self.assertRaises(Full, writer.Put, [ANALOG_MESSAGE + 3, 1, 0])
+    writer.q.get()
+    writer.Put([ANALOG_MESSAGE + 3, 2, 0])  # Queued, not merged into the write that never was.
+    self.assertEqual((1, 0), (writer.q.qsize(), writer.coalesced))
+    self.assertEqual([ANALOG_MESSAGE + 3, 2, 0], writer.q.get().commands)
+
+  def test_StalledBoard(self):
+    """Test that a board thread held up by a listener loses old samples, not the reader's memory"""
+    alarms = []
+    port = MockSerial()
+    port.data = [chr(ANALOG_MESSAGE_0), chr(1), chr(0)] * 100 + [chr(PROTOCOL_VERSION), chr(2), chr(3)]
+    board = firmata.Board('', 10, log_to_file=None, start_serial=False, transport=port, reader_queue_size=10,
+                          on_high_water=lambda *args: alarms.append(args))
+    board.firmware_name = 'Fake'  # Skips the handshake.
+    board.atod_map = range(16)
+    release = threading.Event()
+    received = []
+    board.AddListener('ANALOG_MESSAGE', lambda token: (received.append(token), release.wait(), (False, False))[2])
+    reader = board.port.reader
+    board.StartCommunications()
+    try:
+      self.assertTrue(WaitFor(lambda: reader.q.queue and reader.q.queue[-1]['token'] == 'PROTOCOL_VERSION'))
+      self.assertTrue(WaitFor(lambda: len(received) == 1))
+      self.assertGreaterEqual(reader.q.dropped, 90)  # The board may not have taken a token before the queue filled.
+      self.assertEqual(101, reader.q.dropped + reader.q.qsize() + len(received))
+      release.set()
+      self.assertTrue(WaitFor(lambda: board.firmware_version == '2.3'))
+    finally:
+      release.set()
+      board.StopCommunications()
+    self.assertEqual([('reader', 7)], alarms)
@@ -0,0 +1,83 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import tempfile
+import unittest2 as unittest
+
+import firmata
+from firmata import capture
+from firmata import io
+from firmata import replay
+from firmata.constants import *
+from tests.test_io import ARDUINO_ANALOG_MAPPING, ARDUINO_BOARD_STATE, ARDUINO_CAPABILITY, FIRMATA_INIT, MONDO_DATA
+
+
+SESSION = [
+  (0, ''.join(FIRMATA_INIT)),
+  (0.1, ''.join(ARDUINO_CAPABILITY + ARDUINO_ANALOG_MAPPING)),
+  (0.2, ''.join(ARDUINO_BOARD_STATE)),
+]
+
+
+class ReplayTest(unittest.TestCase):
+  def assertBoardState(self, board):
+    self.assertEqual('Test', board.firmware_name)
+    self.assertEqual(20, len(board.pin_config))
+    self.assertEqual([13, 14, 15, 16, 17, 18], board.atod_map)
+    self.assertEqual(MODE_ANALOG, board.pin_mode[19])
+
+  def test_FastReplay(self):
+    for lexer, dispatch_mode in [(lexer, mode) for lexer in (io.LEXER_PIKE, io.LEXER_TABLE)
+                                 for mode in firmata.DISPATCH_MODES]:
+      port = replay.ReplaySerial(SESSION)
+      board, stats = replay.Replay(port, lexer=lexer, dispatch_mode=dispatch_mode)
+      self.assertBoardState(board)
+      self.assertEqual(sum(len(data) for _, data in SESSION), stats.bytes_read)
+      self.assertEqual(23, stats.tokens)
+      self.assertLess(stats.seconds, 0.2)
+
+  def test_RealtimeReplay(self):
+    port = replay.ReplaySerial(SESSION, realtime=True)
+    board, stats = replay.Replay(port)
+    self.assertBoardState(board)
+    self.assertGreaterEqual(stats.seconds, 0.2)
+
+  def test_ReplayStopsDispatchOnFailure(self):
+    for dispatch_mode in firmata.DISPATCH_MODES:
+      data = ''.join(FIRMATA_INIT + ARDUINO_CAPABILITY + ARDUINO_ANALOG_MAPPING + MONDO_DATA)
+      port = replay.ReplaySerial([(0, data)])
+      board, stats = replay.Replay(port, dispatch_mode=dispatch_mode)
+      self.assertEqual(1, len(board.errors), dispatch_mode)
+      self.assertIn('RESERVED_COMMAND', board.errors[0])
+
+  def test_LoadCapture(self):
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    cap = capture.SerialCapture(path)
+    cap.start()
+    cap.Log(capture.DIRECTION_IN, SESSION[0][1])
+    cap.Log(capture.DIRECTION_OUT, '\xf0\x6b\xf7')
+    cap.Log(capture.DIRECTION_IN, SESSION[1][1])
+    cap.Close()
+    chunks = replay.LoadCapture(path)
+    os.remove(path)
+    self.assertEqual([SESSION[0][1], SESSION[1][1]], [data for _, data in chunks])
+    self.assertEqual(0, chunks[0][0])
+
+  def test_LoadBytes(self):
+    fd, path = tempfile.mkstemp()
+    os.write(fd, SESSION[0][1])
+    os.close(fd)
+    self.assertEqual([(0, SESSION[0][1])], replay.LoadBytes(path))
+    os.remove(path)
@@ -0,0 +1,126 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import time
+import unittest2 as unittest
+
+import firmata
+from firmata import scheduler
+from firmata import tokens
+from firmata.constants import *
+from firmata.scheduler import ReportingBudgetError, ReportingScheduler
+from tests.test_io import MockSerial, WaitFor
+
+
+class ReportingSchedulerTest(unittest.TestCase):
+  def setUp(self):
+    super(ReportingSchedulerTest, self).setUp()
+    self.board = firmata.Board('', 57600, log_to_file=None, start_serial=False, transport=MockSerial())
+    self.board.atod_map = range(16)
+    self.board.pin_config = [{}] * 20
+    self.scheduler = ReportingScheduler(self.board)
+
+  def tearDown(self):
+    super(ReportingSchedulerTest, self).tearDown()
+    self.scheduler.Stop()
+
+  def Sent(self):
+    return list(self.board.port.writer.q.queue)
+
+  def test_Budget(self):
+    self.assertEqual(57600, self.scheduler.baud)
+    self.assertEqual(5760 * scheduler.UTILIZATION, self.scheduler.budget)
+
+  def test_PlanWithoutRotation(self):
+    plan = self.scheduler.Plan({0: 100, 1: 100, 2: 10}, digital={1: 20})
+    self.assertEqual(10, plan.interval)
+    self.assertEqual([frozenset([0, 1, 2])], plan.slots)
+    self.assertEqual({0: 100, 1: 100, 2: 100}, plan.analog_rates)
+    self.assertEqual(3 * 320, plan.bytes_per_second)
+
+  def test_PlanRotates(self):
+    plan = self.scheduler.Plan(dict([(channel, 100) for channel in xrange(4)] +
+                                    [(channel, 10) for channel in xrange(4, 16)]))
+    self.assertEqual(10, plan.interval)
+    self.assertEqual(2, len(plan.slots))
+    for slot in plan.slots:
+      self.assertTrue(set(xrange(4)) <= slot)
+      self.assertTrue(3 * 100 * len(slot) <= plan.budget)
+    for channel, rate in plan.analog_rates.items():
+      self.assertTrue(rate >= (100 if channel < 4 else 10))
+    self.assertTrue(plan.bytes_per_second <= plan.budget)
+
+  def test_PlanRejectsOrDegrades(self):
+    rates = dict((channel, 100) for channel in xrange(16))
+    self.assertRaises(ReportingBudgetError, self.scheduler.Plan, rates)
+    self.assertRaises(ReportingBudgetError, self.scheduler.Plan, {0: 10}, digital={0: 2000}, degrade=True)
+    plan = self.scheduler.Plan(rates, degrade=True)
+    self.assertTrue(plan.bytes_per_second <= plan.budget)
+    self.assertTrue(min(plan.analog_rates.values()) > 80)
+    self.assertEqual([], self.Sent())
+
+  def test_PlanRejectsWhatCannotFit(self):
+    self.assertRaises(ValueError, self.scheduler.Plan, {0: 0})
+    self.assertRaises(ValueError, self.scheduler.Plan, {0: 10}, digital={0: -1})
+    budget = self.scheduler.budget / scheduler.MESSAGE_BYTES
+    digital = {0: budget - 0.01}  # Leaves too little for even one channel at the longest interval.
+    self.assertRaises(ReportingBudgetError, self.scheduler.Plan, {0: 10}, digital=digital, degrade=True)
+    self.assertRaises(ReportingBudgetError, self.scheduler.Plan, dict.fromkeys(xrange(17), 10),
+                      digital={0: budget - 0.1}, degrade=True)
+    plan = self.scheduler.Plan({0: 10}, digital={0: budget - 0.1}, degrade=True)
+    self.assertGreaterEqual(plan.interval, 10000)  # Room for about 0.1 reports a second.
+
+  def test_Apply(self):
+    self.scheduler.Apply(self.scheduler.Plan({0: 50, 3: 50}, digital={1: 5}))
+    self.assertEqual([[SYSEX_START, SE_SAMPLING_INTERVAL, 20, 0, SYSEX_END],
+                      [REPORT_ANALOG + 0, 1], [REPORT_ANALOG + 3, 1], [REPORT_DIGITAL + 1, 1]], self.Sent())
+
+  def test_Rotation(self):
+    plan = self.scheduler.Plan(dict((channel, 100) for channel in xrange(16)), degrade=True)
+    plan.slot_time = 0.01
+    self.scheduler.Apply(plan)
+    self.assertTrue(WaitFor(lambda: self.scheduler._slot == len(plan.slots) - 1))
+    self.scheduler.Stop()
+    enabled = set(plan.slots[0])
+    for command in self.Sent()[1:]:
+      channel = command[0] - REPORT_ANALOG
+      if command[1]:
+        enabled.add(channel)
+      else:
+        enabled.discard(channel)
+    self.assertEqual(plan.slots[self.scheduler._slot], enabled)
+
+  def test_Rates(self):
+    self.scheduler.Apply(self.scheduler.Plan({0: 50}, digital={1: 5}))
+    for _ in xrange(10):
+      self.board.DispatchToken(tokens.AnalogMessage(0, 1))
+    self.board.DispatchToken(tokens.AnalogMessage(1, 1))
+    self.board.DispatchToken(tokens.DigitalMessage(1, 1))
+    time.sleep(0.1)
+    rates = self.scheduler.Rates()
+    self.assertEqual(set([('ANALOG_MESSAGE', 0), ('DIGITAL_MESSAGE', 1)]), set(rates))
+    expected, measured = rates[('ANALOG_MESSAGE', 0)]
+    self.assertEqual(50, expected)
+    self.assertTrue(0 < measured <= 10 / 0.1)
+    self.scheduler.Stop()
+    self.assertEqual((), self.board._listeners['ANALOG_MESSAGE'])
+
+  def test_ScheduleReporting(self):
+    reporting = self.board.ScheduleReporting({2: 25})
+    self.assertEqual(40, reporting.plan.interval)
+    self.assertRaises(ReportingBudgetError, self.board.ScheduleReporting, {2: 5000})
+    reporting.Stop()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,121 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+import time
+import unittest2 as unittest
+
+import firmata
+from firmata import aio
+from firmata import stream
+from firmata import tokens
+from tests.test_io import MockSerial
+
+
+class SampleStreamTest(unittest.TestCase):
+  def setUp(self):
+    super(SampleStreamTest, self).setUp()
+    self.board = firmata.Board('', 10, log_to_file=None, start_serial=False, transport=MockSerial())
+    self.board.atod_map = [14, 15]
+
+  def Values(self, batch):
+    return [(pin, value) for _, pin, value in batch]
+
+  def test_Batches(self):
+    samples = self.board.Stream()
+    self.board.DispatchToken(tokens.AnalogMessage(0, 100))
+    self.board.DispatchToken(tokens.DigitalMessage(0, 0x03))
+    batch = samples.Get()
+    self.assertEqual([(14, 100)] + [(pin, int(pin < 2)) for pin in xrange(8)], self.Values(batch))
+    self.assertTrue(batch[0][0] <= batch[1][0] <= time.time())
+    self.assertEqual(100, self.board.pin_state[14])  # Streaming does not stop normal dispatch.
+    self.assertEqual([], samples.Get(timeout=0.01))
+
+  def test_PinsAndKinds(self):
+    samples = self.board.Stream(pins=[1, 15], kinds=['DIGITAL_MESSAGE'])
+    self.board.DispatchToken(tokens.AnalogMessage(1, 100))
+    self.board.DispatchToken(tokens.DigitalMessage(0, 0x02))
+    self.assertEqual([(1, 1)], self.Values(samples.Get()))
+    self.assertRaises(ValueError, self.board.Stream, kinds=['I2C_REPLY'])
+    self.assertRaises(ValueError, self.board.Stream, overflow='drop-everything')
+
+  def test_MaxBatch(self):
+    samples = self.board.Stream(max_batch=2)
+    for value in xrange(5):
+      self.board.DispatchToken(tokens.AnalogMessage(0, value))
+    self.assertEqual([[0, 1], [2, 3], [4]], [[value for _, _, value in samples.Get()] for _ in xrange(3)])
+
+  def test_DropOldest(self):
+    samples = self.board.Stream(capacity=3)
+    for value in xrange(5):
+      self.board.DispatchToken(tokens.AnalogMessage(0, value))
+    self.assertEqual([2, 3, 4], [value for _, _, value in samples.Get()])
+    self.assertEqual(2, samples.dropped)
+
+  def test_DropNewest(self):
+    samples = self.board.Stream(capacity=3, overflow=stream.DROP_NEWEST)
+    for value in xrange(5):
+      self.board.DispatchToken(tokens.AnalogMessage(0, value))
+    self.assertEqual([0, 1, 2], [value for _, _, value in samples.Get()])
+    self.assertEqual(2, samples.dropped)
+
+  def test_Block(self):
+    samples = self.board.Stream(capacity=2, overflow=stream.BLOCK)
+    def Dispatch():
+      for value in xrange(5):
+        self.board.DispatchToken(tokens.AnalogMessage(0, value))
+    dispatcher = threading.Thread(target=Dispatch)
+    dispatcher.start()
+    received = []
+    while len(received) < 5:
+      received.extend(value for _, _, value in samples.Get(timeout=2))
+    dispatcher.join()
+    self.assertEqual(range(5), received)
+    self.assertEqual(0, samples.dropped)
+
+  def test_StopEndsIteration(self):
+    samples = self.board.Stream()
+    self.board.DispatchToken(tokens.AnalogMessage(0, 1))
+    samples.Stop()
+    self.board.DispatchToken(tokens.AnalogMessage(0, 2))
+    self.assertEqual([[(14, 1)]], [self.Values(batch) for batch in samples])
+    self.assertEqual((), self.board._listeners['ANALOG_MESSAGE'])
+
+  def test_StopReleasesBlockedDispatch(self):
+    samples = self.board.Stream(capacity=1, overflow=stream.BLOCK)
+    self.board.DispatchToken(tokens.AnalogMessage(0, 1))
+    dispatcher = threading.Thread(target=self.board.DispatchToken, args=(tokens.AnalogMessage(0, 2),))
+    dispatcher.start()
+    time.sleep(0.05)
+    self.assertTrue(dispatcher.is_alive())
+    samples.Stop()
+    dispatcher.join(1)
+    self.assertFalse(dispatcher.is_alive())
+
+  @unittest.skipIf(aio.asyncio is None, 'asyncio (or trollius) is not installed')
+  def test_NextBatch(self):
+    loop = aio.asyncio.new_event_loop()
+    samples = stream.SampleStream(self.board, loop=loop)
+    try:
+      future = samples.NextBatch()
+      loop.call_soon(self.board.DispatchToken, tokens.AnalogMessage(0, 1))
+      loop.call_soon(self.board.DispatchToken, tokens.AnalogMessage(1, 2))
+      self.assertEqual([(14, 1), (15, 2)], self.Values(loop.run_until_complete(future)))
+      samples.Stop()
+      self.assertEqual([], loop.run_until_complete(samples.NextBatch()))
+    finally:
+      loop.close()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,49 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import unittest2 as unittest
+
+from firmata import tokens
+
+
+class TokensTest(unittest.TestCase):
+  def test_MappingView(self):
+    token = tokens.AnalogMessage(3, 512)
+    self.assertEqual('ANALOG_MESSAGE', token['token'])
+    self.assertEqual(3, token['pin'])
+    self.assertEqual(512, token.get('value'))
+    self.assertEqual(None, token.get('mode'))
+    self.assertRaises(KeyError, lambda: token['mode'])
+    self.assertEqual(dict(token='ANALOG_MESSAGE', pin=3, value=512), token.AsDict())
+
+  def test_Equality(self):
+    self.assertEqual(tokens.ProtocolVersion(2, 3), tokens.ProtocolVersion(2, 3))
+    self.assertNotEqual(tokens.ProtocolVersion(2, 3), tokens.ProtocolVersion(2, 4))
+    self.assertEqual(dict(token='PROTOCOL_VERSION', major=2, minor=3), tokens.ProtocolVersion(2, 3))
+    self.assertNotEqual(dict(token='STRING_MESSAGE', message='x'), tokens.ErrorMessage('x'))
+
+  def test_DigitalMessagePins(self):
+    token = tokens.DigitalMessage(1, 0b10000101)
+    self.assertEqual([True, False, True, False, False, False, False, True], token['pins'])
+    self.assertEqual(dict(token='DIGITAL_MESSAGE', port=1, pins=token.pins), token.AsDict())
+
+  def test_FromDict(self):
+    self.assertEqual(tokens.DigitalMessage(1, 0b101), tokens.FromDict(tokens.DigitalMessage(1, 0b101).AsDict()))
+    self.assertEqual(tokens.I2cReply(0x4f, 0, [1, 2]), tokens.FromDict(dict(token='I2C_REPLY', addr=0x4f, reg=0,
+                                                                           data=[1, 2])))
+    unknown = dict(token='RESPONSE')
+    self.assertIs(unknown, tokens.FromDict(unknown))
+
+  def test_Tags(self):
+    for tag, cls in enumerate(tokens.TOKEN_CLASSES):
+      self.assertEqual(tag, cls.TAG)